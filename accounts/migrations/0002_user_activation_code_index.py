@@ -0,0 +1,18 @@
+# Generated by Django 4.1.3 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='activation_code',
+            field=models.CharField(blank=True, db_index=True, max_length=36),
+        ),
+    ]
@@ -62,7 +62,7 @@ class User(AbstractEmailUser):
     full_name = models.CharField(
         'Full name', max_length=255, blank=True
     )
-    activation_code = models.CharField(max_length=36, blank=True)
+    activation_code = models.CharField(max_length=36, blank=True, db_index=True)
 
     def get_full_name(self):
         return self.full_name
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from boards.models import (Card, Column, Board, Comment,
                            Favourite, Mark, CheckList,
-                           LastSeen, Members, MarkCard, File
+                           LastSeen, Members, MarkCard, File,
+                           BoardAccess, Job, Blob
                            )
 
 
@@ -16,3 +17,6 @@ admin.site.register(Members)
 admin.site.register(MarkCard)
 admin.site.register(File)
 admin.site.register(Comment)
+admin.site.register(BoardAccess)
+admin.site.register(Job)
+admin.site.register(Blob)
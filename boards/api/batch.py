@@ -0,0 +1,190 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import status
+
+from boards.models import BoardAccess, Card, Column
+from boards.ranks import RankConflict, place
+from boards.services import (delete_cards, get_card_changes, rebalance_ranks, record_board_change_set,
+                             schedule_rank_rebalance)
+
+CARD_FIELDS = ('name', 'description', 'due_date')
+STATUSES = {
+    'create': status.HTTP_201_CREATED,
+    'update': status.HTTP_200_OK,
+    'move': status.HTTP_200_OK,
+    'delete': status.HTTP_204_NO_CONTENT,
+}
+
+
+def get_card_error(operation, cards, columns, allowed, deleted, layouts):
+    if operation['op'] != 'create':
+        card = cards.get(operation['id'])
+        if card is None or card.pk in deleted or card.column is None or card.column.board_id not in allowed:
+            return status.HTTP_404_NOT_FOUND, {'id': [f'Invalid pk "{operation["id"]}" - object does not exist.']}
+    if 'column' in operation and columns.get(operation['column']) not in allowed:
+        return status.HTTP_400_BAD_REQUEST, {'column': [f'Invalid pk "{operation["column"]}" - object does not exist.']}
+    if operation['op'] == 'delete':
+        return None
+    column = operation['column'] if 'column' in operation else cards[operation['id']].column_id
+    siblings = {pk for _, pk in layouts.get(column, ())} - {operation.get('id')}
+    for field in ('after', 'before'):
+        if field in operation and operation[field] not in siblings:
+            return status.HTTP_400_BAD_REQUEST, {field: [f'Invalid pk "{operation[field]}" - not in the same column.']}
+    return None
+
+
+def get_layouts(operations, cards):
+    # (rank, pk) of the cards of every column a card is placed in, in order, in one query
+    columns = set()
+    for operation in operations:
+        if 'column' in operation:
+            columns.add(operation['column'])
+        elif operation['id'] in cards and ('after' in operation or 'before' in operation):
+            columns.add(cards[operation['id']].column_id)
+    layouts = defaultdict(list)
+    for column, rank, pk in (Card.objects.filter(column_id__in=columns).order_by('column_id', 'rank', 'pk')
+                             .values_list('column_id', 'rank', 'pk')):
+        layouts[column].append((rank, pk))
+    return layouts
+
+
+def lock_columns(pks):
+    # Same lock as a single placement takes, in pk order so two batches can't deadlock
+    list(Column.objects.select_for_update().filter(pk__in=pks).order_by('pk').values_list('pk', flat=True))
+
+
+def unplace(layouts, column, pk):
+    if column in layouts:
+        layouts[column] = [entry for entry in layouts[column] if entry[1] != pk]
+
+
+def apply_card_operation(operation, cards, layouts, updated, deleted, fields):
+    # Applies one allowed operation in memory, returns its card
+    if operation['op'] == 'create':
+        card = Card(column_id=operation['column'], **{field: operation.get(field) for field in CARD_FIELDS})
+        card.rank = place(layouts[card.column_id], None, operation.get('after'), operation.get('before'))
+        return card
+    card = cards[operation['id']]
+    if operation['op'] == 'delete':
+        unplace(layouts, card.column_id, card.pk)
+        deleted.add(card.pk)
+        updated.pop(card.pk, None)
+        return card
+    column = operation.get('column', card.column_id)
+    if column != card.column_id or 'after' in operation or 'before' in operation:
+        # Placed first, a conflict leaves the card as it was
+        entries = [entry for entry in layouts[column] if entry[1] != card.pk]
+        rank = place(entries, card.pk, operation.get('after'), operation.get('before'))
+        unplace(layouts, card.column_id, card.pk)
+        layouts[column] = entries
+        card.column_id, card.rank = column, rank
+        fields.update(['column', 'rank'])
+    for field in CARD_FIELDS:
+        if field in operation:
+            setattr(card, field, operation[field])
+            fields.add(field)
+    updated[card.pk] = card
+    return card
+
+
+def apply_card_operations(user, operations):
+    # operations are validated CardOperationSerializer data, applied in order. Nothing is
+    # written unless every one of them is allowed, the result says which ones were not.
+    with transaction.atomic():
+        ids = {operation['id'] for operation in operations if 'id' in operation}
+        # Columns are locked before the cards, like placing a single card does
+        locked = ({operation['column'] for operation in operations if 'column' in operation}
+                  | set(Card.objects.filter(pk__in=ids, column__isnull=False).values_list('column_id', flat=True)))
+        lock_columns(locked)
+        cards = (Card.objects.select_for_update(of=('self',)).select_related('column')
+                 .in_bulk(ids))
+        # Moved by someone else in the meantime
+        lock_columns({card.column_id for card in cards.values() if card.column_id} - locked)
+        columns = dict(Column.objects.filter(pk__in={operation['column'] for operation in operations
+                                                     if 'column' in operation}).values_list('pk', 'board_id'))
+        boards = {card.column.board_id for card in cards.values() if card.column} | set(columns.values())
+        # Access to every board involved, in one query
+        allowed = set(BoardAccess.objects.filter(user=user, board_id__in=boards).values_list('board_id', flat=True))
+
+        # Positions are worked out in memory, a move still only writes the moved card
+        layouts = get_layouts(operations, cards)
+
+        previous_boards = {card.pk: card.column.board_id for card in cards.values() if card.column}
+        results = []
+        created, updated, deleted = [], {}, set()
+        fields = set()
+        conflicts = set()
+        for operation in operations:
+            error = get_card_error(operation, cards, columns, allowed, deleted, layouts)
+            if error:
+                results.append({'op': operation['op'], 'id': operation.get('id'), 'status': error[0],
+                                'errors': error[1]})
+                continue
+            try:
+                card = apply_card_operation(operation, cards, layouts, updated, deleted, fields)
+            except RankConflict:
+                # Neighbours with the same key, their column is respread below
+                column = operation.get('column') or cards[operation['id']].column_id
+                conflicts.add(column)
+                field = 'after' if 'after' in operation else 'before'
+                results.append({'op': operation['op'], 'id': operation.get('id'), 'status': status.HTTP_409_CONFLICT,
+                                'errors': {field: ['Cards of this column were respread, retry the operation.']}})
+                continue
+            if operation['op'] == 'create':
+                created.append(card)
+            results.append({'op': operation['op'], 'card': card, 'status': STATUSES[operation['op']]})
+
+        if any('errors' in result for result in results):
+            for result in results:
+                if 'card' in result:
+                    # Valid, but not applied because of the others
+                    result.update(id=result.pop('card').pk, status=status.HTTP_424_FAILED_DEPENDENCY)
+            for column in conflicts:
+                rebalance_ranks('card', column)
+            return results, False
+
+        # Signals are not sent for bulk writes, the board changes are recorded below
+        Card.objects.bulk_create(created)
+        if updated and fields:
+            Card.objects.bulk_update(updated.values(), fields)
+        for column in {card.column_id for card in [*created, *updated.values()]
+                       if len(card.rank) > settings.RANK_MAX_LENGTH}:
+            schedule_rank_rebalance(Card, column)
+
+        # (model, object_ids) pairs per board, recorded with one version bump per board and kind
+        changes = defaultdict(lambda: {'created': [], 'updated': [], 'removed': []})
+        added, edited, moved, removed = defaultdict(list), defaultdict(list), defaultdict(list), defaultdict(list)
+        for card in created:
+            added[columns[card.column_id]].append(card.pk)
+        for card in updated.values():
+            board = columns.get(card.column_id, previous_boards[card.pk])
+            if board != previous_boards[card.pk]:
+                moved[previous_boards[card.pk], board].append(card.pk)
+            else:
+                edited[board].append(card.pk)
+        for board, ids in added.items():
+            changes[board]['created'].append((Card, ids))
+        for board, ids in edited.items():
+            changes[board]['updated'].append((Card, ids))
+        for pk in deleted:
+            removed[previous_boards[pk]].append(pk)
+        for (previous_board, board), ids in moved.items():
+            # Moved to another board with its children, gone from the previous one
+            card_changes = get_card_changes(ids)
+            changes[previous_board]['removed'].extend(card_changes)
+            changes[board]['created'].extend(card_changes)
+        for board, ids in removed.items():
+            # Taken before the rows go
+            changes[board]['removed'].extend(get_card_changes(ids))
+        if deleted:
+            delete_cards(deleted)
+        for board, kinds in changes.items():
+            record_board_change_set(board, kinds['created'], created=True)
+            record_board_change_set(board, kinds['updated'])
+            record_board_change_set(board, kinds['removed'], deleted=True)
+
+    for result in results:
+        result['id'] = result.pop('card').pk
+    return results, True
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from boards.api.serializers import BoardSerializer
+from boards.models import Board, BoardAccess
+from main.metrics import record_cache_lookup
+
+
+class RequestCache:
+    # Lives for a single request, holds fetched objects and request.user's board roles
+    def __init__(self):
+        self.objects = {}
+        self.roles = None
+        self.hits = 0
+
+    def get_object(self, queryset, pk):
+        key = (queryset.model._meta.label, int(pk))
+        if key in self.objects:
+            self.hits += 1
+        else:
+            self.objects[key] = queryset.get(pk=pk)
+        return self.objects[key]
+
+    def get_role(self, user, board):
+        if self.roles is None:
+            # From the primary even on replica reads, a removed member must lose access at once
+            self.roles = dict(BoardAccess.objects.using(DEFAULT_DB_ALIAS).filter(user=user)
+                              .values_list('board_id', 'role'))
+        else:
+            self.hits += 1
+        return self.roles.get(board.pk)
+
+
+def get_request_cache(request):
+    # DRF wraps the Django request, store the cache on the underlying one
+    request = getattr(request, '_request', request)
+    if not hasattr(request, 'board_cache'):
+        request.board_cache = RequestCache()
+    return request.board_cache
+
+
+class RequestCacheMixin:
+    def get_cached_object(self, queryset, pk):
+        return get_request_cache(self.request).get_object(queryset, pk)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        response['X-Request-Cache-Hits'] = get_request_cache(request).hits
+        return response
+
+
+def get_board_snapshot(board):
+    # Keyed by version, every write to the board bumps it, so entries never go stale
+    key = f'board-snapshot:{board.pk}:{board.version}'
+    data = cache.get(key)
+    record_cache_lookup('board_snapshot', data is not None)
+    if data is None:
+        # Read from the database board came from (one per request, see main.db.router). A write
+        # during the reads could mix versions, such a tree is returned but not cached.
+        tree = Board.objects.with_tree().get(pk=board.pk)
+        data = dict(BoardSerializer(tree).data)
+        version = Board.objects.filter(pk=board.pk).values_list('version', flat=True).first()
+        if tree.version == board.version == version:
+            cache.set(key, data, settings.BOARD_SNAPSHOT_TIMEOUT)
+    return data
@@ -0,0 +1,19 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    # Keyset pagination on the primary key index, cost does not grow with the page number
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class CursorPaginationMixin:
+    pagination_class = IdCursorPagination
+
+    def get_paginated_response(self, queryset, serializer_class, **kwargs):
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, self.request, view=self)
+        serializer = serializer_class(page, many=True, **kwargs)
+        return paginator.get_paginated_response(serializer.data)
@@ -1,12 +1,15 @@
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 
+from boards.api.cache import get_request_cache
+from boards.models import BoardAccess
+
 
 class IsBoardOwner(BasePermission):
     def has_object_permission(self, request, view, obj):
-        is_member = obj.members.filter(member=request.user).exists()
+        role = get_request_cache(request).get_role(request.user, obj)
         if request.method in SAFE_METHODS:
-            return obj.owner == request.user or is_member
-        return obj.owner == request.user
+            return role is not None
+        return role == BoardAccess.OWNER
 
     def has_permission(self, request, view):
         return bool(request.user and request.user.is_authenticated)
@@ -14,8 +17,7 @@ class IsBoardOwner(BasePermission):
 
 class IsBoardOwnerOrMember(BasePermission):
     def has_object_permission(self, request, view, obj):
-        is_member = obj.members.filter(member=request.user).exists()
-        return obj.owner == request.user or is_member
+        return get_request_cache(request).get_role(request.user, obj) is not None
 
     def has_permission(self, request, view):
         return bool(request.user and request.user.is_authenticated)
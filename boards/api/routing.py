@@ -0,0 +1,25 @@
+from rest_framework.permissions import SAFE_METHODS
+
+from main.db.router import choose_replica, is_pinned_to_primary, pin_to_primary, replica_alias
+
+
+class ReplicaReadMixin:
+    # Safe requests read from a replica (main.db.router), unless the user wrote recently
+    # and could otherwise miss their own change.
+    def initial(self, request, *args, **kwargs):
+        # Authentication runs here, before replica reads are switched on. Permissions are checked
+        # later in the view, their board roles are read from the primary by RequestCache.get_role.
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not (request.user.is_authenticated and
+                                                   is_pinned_to_primary(request.user.pk)):
+            # One database for the whole request, see main.db.router.replica_alias
+            self.replica_token = replica_alias.set(choose_replica())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if hasattr(self, 'replica_token'):
+            replica_alias.reset(self.replica_token)
+            del self.replica_token
+        elif request.method not in SAFE_METHODS and request.user.is_authenticated:
+            pin_to_primary(request.user.pk)
+        return response
@@ -1,14 +1,19 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from PIL import Image
-from io import BytesIO
-from django.core import files
+from django.db import transaction
+from django.urls import reverse
+from django.utils.http import urlencode
 
 from boards.models import (Board, Members, Column, Mark,
                            MarkCard, CheckList, LastSeen,
                            Card, Comment, Favourite, Archive,
-                           File
+                           File, FileUpload
                            )
+from boards.images import (ImageTooLarge, get_background_key, get_background_variants,
+                           get_best_background, open_image)
+from boards.ranks import RankConflict, get_rank, lock
+from boards.services import rebalance_ranks
 
 User = get_user_model()
 
@@ -18,39 +23,91 @@ class BoardSerializer(serializers.Serializer):
     title = serializers.CharField(max_length=36)
     background = serializers.ImageField(required=False)
     owner = serializers.StringRelatedField()
+    version = serializers.IntegerField(read_only=True)
 
-    def compress_image(self, image):
-        img = Image.open(image)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        img_io = BytesIO()
-        img.save(img_io, 'JPEG', optimize=True, quality=70)
-        new_image = files.File(img_io, name=image.name)
-        return new_image
+    def validate_background(self, value):
+        try:
+            open_image(value)
+        except ImageTooLarge as error:
+            raise serializers.ValidationError(str(error))
+        finally:
+            value.seek(0)
+        return value
 
     def create(self, validated_data):
-        if 'background' in validated_data:
-            validated_data.update({'background': self.compress_image(validated_data['background'])})
+        # The background is stored as uploaded, boards.images makes the resized copies
         board = Board(**validated_data)
         board.save()
         return board
 
     def update(self, instance, validated_data):
-        instance.title = validated_data.get('title')
-        instance.background = validated_data.get('background')
-        instance.owner = validated_data.get('owner')
+        instance.title = validated_data.get('title', instance.title)
+        instance.background = validated_data.get('background', instance.background)
+        instance.owner = validated_data.get('owner', instance.owner)
         instance.save()
         return instance
 
+    def get_background_url(self, instance, **params):
+        # Media is served by BoardBackgroundAPIView, which checks board access. The URL
+        # changes with the background, so the response can be cached for good.
+        url = reverse('board_api_background', kwargs={'pk': instance.pk})
+        url = f'{url}?{urlencode({**params, "v": get_background_key(instance)})}'
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
     def to_representation(self, instance):
         reps = super(BoardSerializer, self).to_representation(instance)
-        if instance.column.exists():
-            reps['columns'] = ColumnSerializer(instance.column.all(), many=True).data
-        if instance.members.exists():
-            reps['members'] = MembersSerializer(instance.members.all(), many=True).data
+        if instance.background:
+            reps['background'] = self.get_background_url(instance)
+        variants = get_background_variants(instance)
+        if variants:
+            best = get_best_background(instance)
+            reps['background'] = self.get_background_url(instance, w=best['width'], format=best['format'])
+            reps['background_variants'] = [
+                {'width': variant['width'], 'format': variant['format'],
+                 'url': self.get_background_url(instance, w=variant['width'], format=variant['format'])}
+                for variant in variants
+            ]
+        if not self.context.get('nested', True):
+            return reps
+        # .all() reuses the rows loaded by Board.objects.with_tree(), .exists() would not
+        columns = instance.column.all()
+        if columns:
+            reps['columns'] = ColumnSerializer(columns, many=True).data
+        members = instance.members.all()
+        if members:
+            reps['members'] = MembersSerializer(members, many=True).data
         return reps
 
 
+def validate_position(data, parent_field, parent, instance=None):
+    # after and before are the sibling to place the item next to, in the parent it ends up in
+    if data.get('after') is not None and data.get('before') is not None:
+        raise serializers.ValidationError({'before': ['Give either after or before, not both.']})
+    for field in ('after', 'before'):
+        sibling = data.get(field)
+        if sibling is not None and (getattr(sibling, f'{parent_field}_id') != getattr(parent, 'pk', None)
+                                    or sibling == instance):
+            raise serializers.ValidationError({field: [f'Invalid pk "{sibling.pk}" - not in the same {parent_field}.']})
+    return data
+
+
+def pop_rank(validated_data, model, parent, siblings):
+    # Rank of the position asked for with after or before, None when neither was given.
+    # Called in a transaction, the parent stays locked until the item is saved.
+    after = validated_data.pop('after', None)
+    before = validated_data.pop('before', None)
+    if after is None and before is None:
+        return None
+    lock(type(parent), parent.pk)
+    try:
+        return get_rank(siblings, after=after, before=before)
+    except RankConflict:
+        # Neighbours with the same key, respread them first
+        rebalance_ranks(model._meta.model_name, parent.pk)
+        (after or before).refresh_from_db(fields=['rank'])
+        return get_rank(siblings, after=after, before=before)
+
 
 class MembersSerializer(serializers.Serializer):
     id = serializers.IntegerField(read_only=True)
@@ -58,13 +115,13 @@ class MembersSerializer(serializers.Serializer):
     board = serializers.PrimaryKeyRelatedField(queryset=Board.objects.all())
 
     def create(self, validated_data):
-        member = Members(**validated_data)
-        member.save()
+        # Unique per pair, posting it again returns the existing row
+        member, _ = Members.objects.get_or_create(**validated_data)
         return member
 
     def update(self, instance, validated_data):
         instance.member = validated_data.get('member', instance.member)
-        instance.board = validated_data.get('board', instance.member)
+        instance.board = validated_data.get('board', instance.board)
         instance.save()
         return instance
 
@@ -73,25 +130,45 @@ class ColumnSerializer(serializers.Serializer):
     id = serializers.IntegerField(read_only=True)
     name = serializers.CharField()
     board = serializers.PrimaryKeyRelatedField(queryset=Board.objects.all())
+    rank = serializers.CharField(read_only=True)
+    # Column to put this one right after or right before, the end of the board by default
+    after = serializers.PrimaryKeyRelatedField(queryset=Column.objects.all(), write_only=True, required=False)
+    before = serializers.PrimaryKeyRelatedField(queryset=Column.objects.all(), write_only=True, required=False)
+
+    def validate(self, data):
+        board = data.get('board', getattr(self.instance, 'board', None))
+        return validate_position(data, 'board', board, self.instance)
 
+    @transaction.atomic
     def create(self, validated_data):
-        column = Column(**validated_data)
+        board = validated_data['board']
+        rank = pop_rank(validated_data, Column, board, Column.objects.filter(board=board))
+        column = Column(**validated_data, rank=rank or '')
         column.save()
         return column
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        board = validated_data.get('board', instance.board)
+        rank = pop_rank(validated_data, Column, board, Column.objects.filter(board=board).exclude(pk=instance.pk))
+        if rank is not None:
+            instance.rank = rank
+        elif board != instance.board:
+            # Moved to another board, at its end
+            instance.rank = ''
         instance.name = validated_data.get('name', instance.name)
-        instance.board = validated_data.get('board', instance.board)
+        instance.board = board
         instance.save()
         return instance
 
     def to_representation(self, instance):
         representation = super(ColumnSerializer, self).to_representation(instance)
-        if not representation.get('pk'):
+        if not representation.get('id') or not self.context.get('nested', True):
             return representation
 
-        if instance.card_column.exists():
-            representation['cards'] = CardColumnSerializer(instance.card_column.all(), many=True).data
+        cards = instance.card_column.all()
+        if cards:
+            representation['cards'] = CardColumnSerializer(cards, many=True).data
         return representation
 
 
@@ -120,8 +197,8 @@ class MarkCardSerializer(serializers.Serializer):
     card = serializers.StringRelatedField()
 
     def create(self, validated_data):
-        mark_card = MarkCard(**validated_data)
-        mark_card.save()
+        # Unique per pair, posting it again returns the existing row
+        mark_card, _ = MarkCard.objects.get_or_create(**validated_data)
         return mark_card
 
 
@@ -154,6 +231,23 @@ class LastSeenSerializer(serializers.Serializer):
         return LastSeen(**validated_data)
 
 
+def represent_card_relations(card, representation):
+    # Expects the relations to be prefetched with Card.objects.with_relations()
+    comments = card.comment.all()
+    if comments:
+        representation['comments'] = CommentSerializer(comments, many=True).data
+    marks = card.attached_to_card.all()
+    if marks:
+        representation['marks'] = MarkCardSerializer(marks, many=True).data
+    files = card.file.all()
+    if files:
+        representation['files'] = FileSerializer(files, many=True).data
+    checklists = card.check_list.all()
+    if checklists:
+        representation['checklists'] = ChecklistSerializer(checklists, many=True).data
+    return representation
+
+
 class CardColumnSerializer(serializers.Serializer):
     id = serializers.IntegerField(read_only=True)
     name = serializers.CharField()
@@ -161,6 +255,11 @@ class CardColumnSerializer(serializers.Serializer):
     due_date = serializers.DateField()
     mark = serializers.StringRelatedField()
     column = serializers.CharField()
+    rank = serializers.CharField(read_only=True)
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        return represent_card_relations(instance, representation)
 
 
 class CardSerializer(serializers.Serializer):
@@ -169,35 +268,77 @@ class CardSerializer(serializers.Serializer):
     description = serializers.CharField()
     due_date = serializers.DateField()
     column = serializers.PrimaryKeyRelatedField(queryset=Column.objects.all())
+    rank = serializers.CharField(read_only=True)
+    # Card to put this one right after or right before, the end of the column by default
+    after = serializers.PrimaryKeyRelatedField(queryset=Card.objects.all(), write_only=True, required=False)
+    before = serializers.PrimaryKeyRelatedField(queryset=Card.objects.all(), write_only=True, required=False)
+
+    def validate(self, data):
+        column = data.get('column', getattr(self.instance, 'column', None))
+        return validate_position(data, 'column', column, self.instance)
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
 
-        if not representation.get('pk'):
+        if not representation.get('id') or not self.context.get('nested', True):
             return representation
+        return represent_card_relations(instance, representation)
 
-        if instance.comment.exists():
-            representation['comments'] = CommentSerializer(instance.comment.all(), many=True).data
-        if instance.attached_to_card.exists():
-            representation['marks'] = MarkCardSerializer(instance.attached_to_card.all(), many=True).data
-        if instance.file.exists():
-            representation['files'] = FileSerializer(instance.file.all(), many=True).data
-        return representation
-
+    @transaction.atomic
     def create(self, validated_data):
-        card = Card(**validated_data)
+        column = validated_data['column']
+        rank = pop_rank(validated_data, Card, column, Card.objects.filter(column=column))
+        card = Card(**validated_data, rank=rank or '')
         card.save()
         return card
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        # A move only writes this card, whatever the size of the column
+        column = validated_data.get('column', instance.column)
+        rank = pop_rank(validated_data, Card, column, Card.objects.filter(column=column).exclude(pk=instance.pk))
+        if rank is not None:
+            instance.rank = rank
+        elif column != instance.column:
+            # Moved to another column, at its end
+            instance.rank = ''
         instance.name = validated_data.get('name', instance.name)
         instance.description = validated_data.get('description', instance.description)
         instance.due_date = validated_data.get('due_date', instance.due_date)
-        instance.column = validated_data.get('column', instance.column)
+        instance.column = column
         instance.save()
         return instance
 
 
+class CardOperationSerializer(serializers.Serializer):
+    # One item of a /api/card/batch/ request, a move is an update of the column
+    OPERATIONS = ('create', 'update', 'move', 'delete')
+    REQUIRED = {
+        'create': ('column', 'name', 'description'),
+        'update': ('id',),
+        'move': ('id', 'column'),
+        'delete': ('id',),
+    }
+
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    id = serializers.IntegerField(required=False)
+    column = serializers.IntegerField(required=False)
+    name = serializers.CharField(max_length=30, required=False)
+    description = serializers.CharField(max_length=500, required=False)
+    due_date = serializers.DateField(required=False, allow_null=True)
+    # Card of the same column to put this one right after or right before
+    after = serializers.IntegerField(required=False)
+    before = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        missing = [field for field in self.REQUIRED[data['op']] if field not in data]
+        if missing:
+            raise serializers.ValidationError({field: ['This field is required.'] for field in missing})
+        if 'after' in data and 'before' in data:
+            raise serializers.ValidationError({'before': ['Give either after or before, not both.']})
+        return data
+
+
 class CommentSerializer(serializers.Serializer):
     id = serializers.IntegerField(read_only=True)
     text = serializers.CharField()
@@ -211,14 +352,25 @@ class CommentSerializer(serializers.Serializer):
         return comment
 
 
+class CommentChangeSerializer(CommentSerializer):
+    # Delta rows (BoardChangesAPIView) point to their card and author by id
+    card = serializers.PrimaryKeyRelatedField(read_only=True)
+    author = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class MarkCardChangeSerializer(MarkCardSerializer):
+    mark = serializers.PrimaryKeyRelatedField(read_only=True)
+    card = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
 class FavouriteSerializer(serializers.Serializer):
     id = serializers.IntegerField(read_only=True)
     board = serializers.PrimaryKeyRelatedField(queryset=Board.objects.all())
     author = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
 
     def create(self, validated_data):
-        favourite = Favourite(**validated_data)
-        favourite.save()
+        # Unique per pair, posting it again returns the existing row
+        favourite, _ = Favourite.objects.get_or_create(**validated_data)
         return favourite
 
 
@@ -228,8 +380,8 @@ class ArchiveSerializer(serializers.Serializer):
     author = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
 
     def create(self, validated_data):
-        archive = Archive(**validated_data)
-        archive.save()
+        # Unique per pair, posting it again returns the existing row
+        archive, _ = Archive.objects.get_or_create(**validated_data)
         return archive
 
 
@@ -237,8 +389,43 @@ class FileSerializer(serializers.Serializer):
     id = serializers.IntegerField(read_only=True)
     name = serializers.FileField()
     card = serializers.PrimaryKeyRelatedField(queryset=Card.objects.all())
+    original_name = serializers.CharField(read_only=True)
+
+    def to_representation(self, instance):
+        reps = super().to_representation(instance)
+        # Attachments are only served by FileDownloadAPIView, which checks board access
+        url = reverse('file_api_download', kwargs={'pk': instance.pk})
+        request = self.context.get('request')
+        reps['name'] = request.build_absolute_uri(url) if request else url
+        return reps
 
     def create(self, validated_data):
         file = File(**validated_data)
         file.save()
         return file
+
+
+class FileUploadSerializer(serializers.Serializer):
+    id = serializers.IntegerField(read_only=True)
+    card = serializers.PrimaryKeyRelatedField(queryset=Card.objects.all())
+    name = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+    checksum = serializers.RegexField(r'^[0-9a-f]{64}$')
+    offset = serializers.IntegerField(read_only=True)
+
+    def validate_size(self, value):
+        # The part file is kept on disk until the upload is finalized or expires
+        if value > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f'Ensure this value is less than or equal to {settings.CHUNKED_UPLOAD_MAX_SIZE}.')
+        return value
+
+    def validate_card(self, value):
+        # A card whose column was deleted belongs to no board
+        if value.column_id is None:
+            raise serializers.ValidationError('The card is not in a column.')
+        return value
+
+    def create(self, validated_data):
+        upload = FileUpload(**validated_data)
+        upload.save()
+        return upload
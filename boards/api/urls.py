@@ -7,6 +7,8 @@ urlpatterns = [
     # Boards API urls
     path('', views.BoardListAPIView.as_view(), name='board_api'),
     path('<int:pk>/', views.BoardDetailUpdateDeleteAPIView.as_view(), name='board_api_detail'),
+    path('<int:pk>/changes/', views.BoardChangesAPIView.as_view(), name='board_api_changes'),
+    path('<int:pk>/background/', views.BoardBackgroundAPIView.as_view(), name='board_api_background'),
 
     # Members API urls
 
@@ -1,8 +1,13 @@
-import datetime
+import os
 
+from django.conf import settings
+from django.core.files.storage import default_storage
 from django.db.models import Q
+from django.http import Http404
+from django.utils.http import parse_etags
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -11,7 +16,8 @@ from boards.models import (
     Board, Members, Column,
     Card, CheckList,
     LastSeen, Mark, Favourite,
-    Archive, File, MarkCard
+    Archive, File, MarkCard, Comment,
+    BoardChange, FileUpload
 )
 
 from boards.api.serializers import (
@@ -19,32 +25,43 @@ from boards.api.serializers import (
     MembersSerializer,
     ColumnSerializer,
     CardSerializer,
+    CardOperationSerializer,
     CommentSerializer,
+    CommentChangeSerializer,
     ChecklistSerializer,
     LastSeenSerializer,
     MarksSerializer,
     FavouriteSerializer,
     ArchiveSerializer,
     MarkCardSerializer,
+    MarkCardChangeSerializer,
     FileSerializer,
+    FileUploadSerializer,
 )
 
+from boards.api.batch import apply_card_operations
+from boards.api.cache import RequestCacheMixin, get_board_snapshot
+from boards.api.pagination import CursorPaginationMixin
+from boards.api.routing import ReplicaReadMixin
 from boards.api.permissions import IsBoardOwner, IsBoardOwnerOrMember
+from boards.images import VARIANT_FORMATS, find_variant, get_background_key, get_cached_variant
+from boards.last_seen import last_seen_recorder
+from boards.media import serve_file
+from boards.uploads import UploadError, finalize_upload, write_chunk
 
 
-class BoardListAPIView(APIView):
+class BoardListAPIView(CursorPaginationMixin, ReplicaReadMixin, RequestCacheMixin, APIView):
     parser_classes = [MultiPartParser, FormParser]
     permission_classes = [IsBoardOwner]
 
 
     @swagger_auto_schema(responses={200: BoardSerializer(many=True)})
     def get(self, request):
-        boards = Board.objects.filter(Q(members__member=request.user) | Q(owner=request.user))
+        boards = Board.objects.with_tree().accessible_to(request.user)
         search = self.request.query_params.get('search')
         if search:
             boards = boards.filter(title__icontains=search)
-        serializer = BoardSerializer(boards, many=True, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.get_paginated_response(boards, BoardSerializer, context={'request': request})
 
     @swagger_auto_schema(request_body=BoardSerializer)
     def post(self, request):
@@ -55,22 +72,23 @@ class BoardListAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class BoardDetailUpdateDeleteAPIView(APIView):
+class BoardDetailUpdateDeleteAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwner, ]
 
     def get_object(self, pk):
-        board = Board.objects.get(pk=pk)
-        return board
+        return self.get_cached_object(Board.objects.with_tree(), pk)
 
     def get(self, request, pk):
-        board = self.get_object(pk)
+        # Only the board row is needed to check the ETag, the tree comes from the snapshot cache
+        board = self.get_cached_object(Board.objects.all(), pk)
         self.check_object_permissions(request, board)
-        serializer = BoardSerializer(board)
-        last_seen, created = LastSeen.objects.get_or_create(user=request.user, board=board)
-        if not created:
-            last_seen.seen = datetime.datetime.now()
-            last_seen.save()
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        last_seen_recorder.record(request.user.pk, board.pk)
+        etag = f'"board-{board.pk}-{board.version}"'
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if_none_match = {tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+        if etag in if_none_match or '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(get_board_snapshot(board), status=status.HTTP_200_OK, headers=headers)
 
     @swagger_auto_schema(request_body=BoardSerializer)
     def put(self, request, pk):
@@ -99,15 +117,98 @@ class BoardDetailUpdateDeleteAPIView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class MembersListAPIView(APIView):
+class MediaContentNegotiation(BaseContentNegotiation):
+    # Accept lists media types here, which none of the renderers produce. Errors are
+    # rendered with the first renderer and files are returned as plain responses.
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class BoardBackgroundAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
+    permission_classes = [IsBoardOwnerOrMember]
+    content_negotiation_class = MediaContentNegotiation
+
+    def get(self, request, pk):
+        board = self.get_cached_object(Board.objects.all(), pk)
+        self.check_object_permissions(request, board)
+        if not board.background:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        try:
+            width = int(request.query_params.get('w', settings.BOARD_BACKGROUND_MAX_WIDTH))
+        except ValueError:
+            return Response({'w': 'Must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        extension = request.query_params.get('format')
+        if extension not in VARIANT_FORMATS:
+            extension = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+
+        # Serializers link to the background with its key, those URLs never change content
+        immutable = request.query_params.get('v') == get_background_key(board)
+        variant = find_variant(board, width, extension)
+        path = default_storage.path(variant['name']) if variant else get_cached_variant(board, width, extension)
+        content_type = f'image/{extension}'
+        if path is None:
+            # Rendered by a job, meanwhile the other format or the original will do
+            variant = next(filter(None, (find_variant(board, width, other) for other in VARIANT_FORMATS)), None)
+            path = default_storage.path(variant['name']) if variant else board.background.path
+            content_type = f'image/{variant["format"]}' if variant else None
+            immutable = False
+        response = serve_file(request, path, content_type=content_type, immutable=immutable)
+        response['Vary'] = 'Accept'
+        return response
+
+
+# Models reported by BoardChangesAPIView, rendered without their nested children
+CHANGE_SERIALIZERS = {
+    'board': (Board.objects.select_related('owner'), BoardSerializer),
+    'members': (Members.objects.all(), MembersSerializer),
+    'column': (Column.objects.all(), ColumnSerializer),
+    'mark': (Mark.objects.all(), MarksSerializer),
+    'card': (Card.objects.all(), CardSerializer),
+    'checklist': (CheckList.objects.all(), ChecklistSerializer),
+    'comment': (Comment.objects.all(), CommentChangeSerializer),
+    'markcard': (MarkCard.objects.all(), MarkCardChangeSerializer),
+    'file': (File.objects.all(), FileSerializer),
+}
+
+
+class BoardChangesAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
+    permission_classes = [IsBoardOwnerOrMember]
+
+    def get(self, request, pk):
+        board = self.get_cached_object(Board.objects.all(), pk)
+        self.check_object_permissions(request, board)
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            return Response({'since': 'Must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        changes = BoardChange.objects.filter(board=board, version__gt=since)
+        data = {'version': board.version, 'inserted': {}, 'updated': {}, 'deleted': {}}
+        upserts = {}
+        for change in changes.values('model', 'object_id', 'created_version', 'deleted'):
+            if change['deleted']:
+                data['deleted'].setdefault(change['model'], []).append(change['object_id'])
+            else:
+                upserts.setdefault(change['model'], {})[change['object_id']] = change['created_version'] > since
+
+        for model, inserted in upserts.items():
+            queryset, serializer_class = CHANGE_SERIALIZERS[model]
+            for row in serializer_class(queryset.filter(pk__in=inserted), many=True, context={'nested': False}).data:
+                key = 'inserted' if inserted[row['id']] else 'updated'
+                data[key].setdefault(model, []).append(row)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class MembersListAPIView(CursorPaginationMixin, ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwner]
 
     def get(self, request):
+        # Own memberships and memberships of owned boards, both imply board access
         members = Members.objects.filter(Q(member=request.user) | Q(board__owner=request.user))
-        for member in members:
-            self.check_object_permissions(request, member.board)
-        serializer = MembersSerializer(members, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.get_paginated_response(members, MembersSerializer)
 
     @swagger_auto_schema(request_body=MembersSerializer)
     def post(self, request):
@@ -125,12 +226,11 @@ class MembersListAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class MembersDetailUpdateDeleteAPIView(APIView):
+class MembersDetailUpdateDeleteAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwner]
 
     def get_object(self, pk):
-        member = Members.objects.get(pk=pk)
-        return member
+        return self.get_cached_object(Members.objects.select_related('board'), pk)
 
     def get(self, request, pk):
         board = self.get_object(pk).board
@@ -166,15 +266,12 @@ class MembersDetailUpdateDeleteAPIView(APIView):
 
 
 
-class ColumnListCreateAPIView(APIView):
+class ColumnListCreateAPIView(CursorPaginationMixin, ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwner]
 
     def get(self, request):
-        columns = Column.objects.filter(Q(board__owner=request.user) | Q(board__members__member=request.user))
-        for column in columns:
-            self.check_object_permissions(request, column.board)
-        serializer = ColumnSerializer(columns, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        columns = Column.objects.accessible_to(request.user)
+        return self.get_paginated_response(columns, ColumnSerializer)
 
     @swagger_auto_schema(request_body=ColumnSerializer)
     def post(self, request):
@@ -187,21 +284,20 @@ class ColumnListCreateAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class ColumnDetailUpdateDeleteAPIView(APIView):
+class ColumnDetailUpdateDeleteAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwner]
 
     def get_object(self, pk):
-        column = Column.objects.get(pk=pk)
-        return column
+        return self.get_cached_object(Column.objects.select_related('board'), pk)
 
     def get(self, request, pk):
         column = self.get_object(pk)
-        self.check_object_permissions(request, column[0].board)
-        serializer = ColumnSerializer(column[0])
+        self.check_object_permissions(request, column.board)
+        serializer = ColumnSerializer(column)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def delete(self, request, pk):
-        column = Column.objects.get(pk=pk)
+        column = self.get_object(pk)
         self.check_object_permissions(request, column.board)
         column.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -226,23 +322,17 @@ class ColumnDetailUpdateDeleteAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class CardListCreateAPIView(APIView):
+class CardListCreateAPIView(CursorPaginationMixin, ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     def get(self, request):
-        cards = Card.objects.filter(
-            Q(column__board__owner=request.user) |
-            Q(column__board__members__member=request.user)
-        )
-        for card in cards:
-            self.check_object_permissions(request, card.column.board)
+        cards = Card.objects.with_relations().accessible_to(request.user)
         mark = self.request.query_params.get('mark')
         if mark:
             cards = cards.filter(
                 Q(attached_to_card__mark__name__icontains=mark)
             )
-        serializer = CardSerializer(cards, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.get_paginated_response(cards, CardSerializer)
 
     @swagger_auto_schema(request_body=CardSerializer)
     def post(self, request):
@@ -254,16 +344,34 @@ class CardListCreateAPIView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
-class CardDetailDeleteUpdate(APIView):
+class CardBatchAPIView(ReplicaReadMixin, APIView):
+    # {"operations": [{"op": "move", "id": 1, "column": 2}, ...]}, applied in one transaction
+    permission_classes = [IsBoardOwnerOrMember]
+
+    @swagger_auto_schema(request_body=CardOperationSerializer(many=True))
+    def post(self, request):
+        operations = request.data.get('operations') if isinstance(request.data, dict) else None
+        if not isinstance(operations, list) or not 0 < len(operations) <= settings.CARD_BATCH_MAX_OPERATIONS:
+            return Response({'operations': [f'A list of 1 to {settings.CARD_BATCH_MAX_OPERATIONS} operations.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        serializers = [CardOperationSerializer(data=operation) for operation in operations]
+        if not all([serializer.is_valid() for serializer in serializers]):
+            results = [{'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors} if serializer.errors
+                       else {'status': status.HTTP_424_FAILED_DEPENDENCY} for serializer in serializers]
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+        results, applied = apply_card_operations(request.user, [serializer.validated_data for serializer in serializers])
+        return Response({'results': results}, status=status.HTTP_200_OK if applied else status.HTTP_400_BAD_REQUEST)
+
+
+class CardDetailDeleteUpdate(ReplicaReadMixin, RequestCacheMixin, APIView):
 
     def get_object(self, pk):
-        card = Card.objects.get(pk=pk)
-        return card
+        return self.get_cached_object(Card.objects.select_related('column__board'), pk)
 
     def get(self, request, pk):
         card = self.get_object(pk)
-        self.check_object_permissions(request, card[0].column.board)
-        serializer = CardSerializer(card[0])
+        self.check_object_permissions(request, card.column.board)
+        serializer = CardSerializer(card)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def delete(self, request, pk):
@@ -291,16 +399,13 @@ class CardDetailDeleteUpdate(APIView):
             return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
-class FileListCreateAPIView(APIView):
+class FileListCreateAPIView(CursorPaginationMixin, ReplicaReadMixin, RequestCacheMixin, APIView):
     parser_classes = [MultiPartParser, FormParser]
     permission_classes = [IsBoardOwnerOrMember]
 
     def get(self, request):
-        obj = File.objects.filter(Q(card__column__board__owner=request.user) | Q(card__column__board__members__member=request.user))
-        for fi in obj:
-            self.check_object_permissions(request, fi.card.column.board)
-        serializer = FileSerializer(obj, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        obj = File.objects.accessible_to(request.user)
+        return self.get_paginated_response(obj, FileSerializer)
 
     @swagger_auto_schema(request_body=FileSerializer)
     def post(self, request):
@@ -313,12 +418,11 @@ class FileListCreateAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class FileDetailDeleteAPIView(APIView):
+class FileDetailDeleteAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     def get_object(self, pk):
-        file = File.objects.get(pk=pk)
-        return file
+        return self.get_cached_object(File.objects.select_related('card__column__board'), pk)
 
     def get(self, request, pk):
         board = self.get_object(pk).card.column.board
@@ -333,17 +437,95 @@ class FileDetailDeleteAPIView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class CheckListCreateAPIView(APIView):
+class FileDownloadAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
+    content_negotiation_class = MediaContentNegotiation
 
-    def get(self, request):
-        checklist = CheckList.objects.filter(Q(card__column__board__owner=request.user) |
-                                             Q(card__column__board__members__member=request.user))
-        for check in checklist:
-            self.check_object_permissions(request, check.card.column.board)
+    def get(self, request, pk):
+        file = self.get_cached_object(File.objects.select_related('card__column__board'), pk)
+        self.check_object_permissions(request, file.card.column.board)
+        try:
+            # Stored under the hash of their content, so a name always has the same bytes
+            return serve_file(request, file.name.path, immutable=True,
+                              filename=file.original_name or os.path.basename(file.name.name))
+        except FileNotFoundError:
+            raise Http404
 
-        serializer = ChecklistSerializer(checklist, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+
+class FileUploadCreateAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
+    permission_classes = [IsBoardOwnerOrMember]
+
+    @swagger_auto_schema(request_body=FileUploadSerializer)
+    def post(self, request):
+        serializer = FileUploadSerializer(data=request.data)
+        if serializer.is_valid():
+            self.check_object_permissions(request, serializer.validated_data['card'].column.board)
+            serializer.save(author=request.user)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class FileUploadMixin(ReplicaReadMixin, RequestCacheMixin):
+    def get_object(self, pk):
+        try:
+            upload = self.get_cached_object(
+                FileUpload.objects.select_related('card__column__board').filter(author=self.request.user), pk)
+        except FileUpload.DoesNotExist:
+            raise Http404
+        if upload.card.column is None:
+            raise Http404
+        self.check_object_permissions(self.request, upload.card.column.board)
+        return upload
+
+
+class FileUploadAPIView(FileUploadMixin, APIView):
+    # Chunks are PUT as the raw request body, starting at the Upload-Offset header.
+    # GET returns the offset to resume from after a failed request.
+    permission_classes = [IsBoardOwnerOrMember]
+
+    def get(self, request, pk):
+        return Response(FileUploadSerializer(self.get_object(pk)).data, status=status.HTTP_200_OK)
+
+    def put(self, request, pk):
+        upload = self.get_object(pk)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers.get('Content-Length') or 0)
+        except (KeyError, ValueError):
+            return Response({'detail': 'Upload-Offset and Content-Length headers are required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+            return Response(status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        # request.stream is the unparsed body, so the chunk is copied to disk without buffering it
+        try:
+            upload = write_chunk(upload, request.stream, offset, length)
+        except UploadError as error:
+            upload.refresh_from_db()
+            return Response({'detail': str(error), 'offset': upload.offset}, status=status.HTTP_409_CONFLICT)
+        return Response(FileUploadSerializer(upload).data, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        self.get_object(pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class FileUploadCompleteAPIView(FileUploadMixin, APIView):
+    permission_classes = [IsBoardOwnerOrMember]
+
+    def post(self, request, pk):
+        try:
+            file = finalize_upload(self.get_object(pk))
+        except UploadError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(FileSerializer(file).data, status=status.HTTP_201_CREATED)
+
+
+class CheckListCreateAPIView(CursorPaginationMixin, ReplicaReadMixin, RequestCacheMixin, APIView):
+    permission_classes = [IsBoardOwnerOrMember]
+
+    def get(self, request):
+        checklist = CheckList.objects.accessible_to(request.user)
+        return self.get_paginated_response(checklist, ChecklistSerializer)
 
     @swagger_auto_schema(request_body=ChecklistSerializer)
     def post(self, request):
@@ -356,12 +538,11 @@ class CheckListCreateAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class CheckDetailUpdateDeleteAPIView(APIView):
+class CheckDetailUpdateDeleteAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     def get_object(self, pk):
-        checklist = CheckList.objects.get(pk=pk)
-        return checklist
+        return self.get_cached_object(CheckList.objects.select_related('card__column__board'), pk)
 
     def get(self, request, pk):
         checklist = self.get_object(pk)
@@ -396,25 +577,26 @@ class CheckDetailUpdateDeleteAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class LastSeenListAPIView(APIView):
+class LastSeenListAPIView(RequestCacheMixin, APIView):
+    # Reads the rows it has just flushed, so it stays on the primary. Reads buffered by
+    # other workers are up to LAST_SEEN_FLUSH_INTERVAL late, see boards.last_seen.
     permission_classes = [IsBoardOwnerOrMember]
 
     def get(self, request):
-        last_seen = LastSeen.objects.filter(user=request.user).order_by('-seen')[:6]
-        self.check_object_permissions(request, last_seen.board)
+        last_seen_recorder.flush()
+        # Only boards the user can still open
+        last_seen = (LastSeen.objects.filter(user=request.user, board__access__user=request.user)
+                     .select_related('board', 'user').order_by('-seen')[:6])
         serializer = LastSeenSerializer(last_seen, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class FavouriteListAPIView(APIView):
+class FavouriteListAPIView(CursorPaginationMixin, ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     def get(self, request):
-        favourite = Favourite.objects.filter(author=request.user)
-        for fav in favourite:
-            self.check_object_permissions(request, fav.board)
-        serializer = FavouriteSerializer(favourite, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        favourite = Favourite.objects.accessible_to(request.user).filter(author=request.user)
+        return self.get_paginated_response(favourite, FavouriteSerializer)
 
     @swagger_auto_schema(request_body=FavouriteSerializer)
     def post(self, request):
@@ -426,12 +608,11 @@ class FavouriteListAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class FavouriteDetailDeleteView(APIView):
+class FavouriteDetailDeleteView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     def get_object(self, pk):
-        favourite = Favourite.objects.get(pk=pk)
-        return favourite
+        return self.get_cached_object(Favourite.objects.select_related('board'), pk)
 
     def get(self, request, pk):
         self.check_object_permissions(request, self.get_object(pk).board)
@@ -445,7 +626,7 @@ class FavouriteDetailDeleteView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class MarkListAPIView(APIView):
+class MarkListAPIView(CursorPaginationMixin, ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
 # ValueError: Cannot query "a@b.com": Must be "Board" instance. On Get test
@@ -453,8 +634,7 @@ class MarkListAPIView(APIView):
     def get(self, request):
 
         marks = Mark.objects.filter(board__owner=request.user)
-        serializer = MarksSerializer(marks, many=True)
-        return Response(serializer.data, status.HTTP_200_OK)
+        return self.get_paginated_response(marks, MarksSerializer)
 
     @swagger_auto_schema(request_body=MarksSerializer)
     def post(self, request):
@@ -466,12 +646,11 @@ class MarkListAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class MarkDetailUpdateDeleteAPIView(APIView):
+class MarkDetailUpdateDeleteAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     def get_object(self, pk):
-        mark = Mark.objects.get(pk=pk)
-        return mark
+        return self.get_cached_object(Mark.objects.select_related('board'), pk)
 
     def get(self, request, pk):
         mark = self.get_object(pk)
@@ -505,7 +684,7 @@ class MarkDetailUpdateDeleteAPIView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class CommentCreateAPIView(APIView):
+class CommentCreateAPIView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     @swagger_auto_schema(request_body=CommentSerializer)
@@ -519,15 +698,12 @@ class CommentCreateAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class ArchiveListCreateAPIView(APIView):
+class ArchiveListCreateAPIView(CursorPaginationMixin, ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     def get(self, request):
-        archive = Archive.objects.filter(author=request.user)
-        for arch in archive:
-            self.check_object_permissions(request, arch.board)
-        serializer = ArchiveSerializer(archive, many=True)
-        return Response(serializer.data, status.HTTP_200_OK)
+        archive = Archive.objects.accessible_to(request.user).filter(author=request.user)
+        return self.get_paginated_response(archive, ArchiveSerializer)
 
     @swagger_auto_schema(request_body=ArchiveSerializer)
     def post(self, request):
@@ -540,12 +716,11 @@ class ArchiveListCreateAPIView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class ArchiveDetailUpdateDeleteView(APIView):
+class ArchiveDetailUpdateDeleteView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     def get_object(self, pk):
-        archive = Archive.objects.get(pk=pk)
-        return archive
+        return self.get_cached_object(Archive.objects.select_related('board'), pk)
 
     def get(self, request, pk):
         serializer = ArchiveSerializer(self.get_object(pk))
@@ -557,7 +732,7 @@ class ArchiveDetailUpdateDeleteView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class MarkCardCreateView(APIView):
+class MarkCardCreateView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     def create(self, request):
@@ -569,12 +744,11 @@ class MarkCardCreateView(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class MarkCardDetailDeleteView(APIView):
+class MarkCardDetailDeleteView(ReplicaReadMixin, RequestCacheMixin, APIView):
     permission_classes = [IsBoardOwnerOrMember]
 
     def get_object(self, pk):
-        mark_card = MarkCard.objects.get(pk=pk)
-        return mark_card
+        return self.get_cached_object(MarkCard.objects.select_related('card__column__board'), pk)
 
     def get(self, request, pk):
         self.check_object_permissions(request, Card.objects.get('card').column.board)
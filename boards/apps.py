@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class BoardsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'boards'
+
+    def ready(self):
+        from boards import signals  # noqa: F401
+        from main.db.router import check_shared_cache
+        from main.timing import time_serializers
+        checks.register(check_shared_cache, checks.Tags.caches, checks.Tags.database)
+        time_serializers()
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import re
+from http.cookies import SimpleCookie
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.http import HttpRequest
+from rest_framework.authtoken.models import Token
+
+from boards.events import EventQueue, broker, ensure_listener
+from boards.models import BoardAccess
+
+EVENTS_PATH = re.compile(r'^/api/boards/(?P<pk>\d+)/events/$')
+
+
+def authenticate_scope(scope):
+    headers = dict(scope['headers'])
+    authorization = headers.get(b'authorization', b'').decode('latin1').split()
+    if len(authorization) == 2 and authorization[0].lower() == 'token':
+        token = Token.objects.select_related('user').filter(key=authorization[1]).first()
+        return token.user if token and token.user.is_active else None
+
+    cookie = SimpleCookie(headers.get(b'cookie', b'').decode('latin1'))
+    if settings.SESSION_COOKIE_NAME not in cookie:
+        return None
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+        cookie[settings.SESSION_COOKIE_NAME].value)
+    user = get_user(request)
+    return user if user.is_authenticated else None
+
+
+def has_board_access(user, board_id):
+    return BoardAccess.objects.filter(user=user, board_id=board_id).exists()
+
+
+@sync_to_async
+def run_query(function, *args):
+    # Outside of a request nothing else closes connections that went stale or over CONN_MAX_AGE
+    close_old_connections()
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+class BoardEventsApplication:
+    # Serves /api/boards/<pk>/events/ as server-sent events and passes everything
+    # else to Django. Idle connections only hold a queue, no thread or DB connection.
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        match = scope['type'] == 'http' and EVENTS_PATH.match(scope['path'])
+        if not match:
+            return await self.application(scope, receive, send)
+        await self.stream(int(match['pk']), scope, receive, send)
+
+    async def respond(self, send, status, body):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+    async def stream(self, board_id, scope, receive, send):
+        user = await run_query(authenticate_scope, scope)
+        if user is None:
+            return await self.respond(send, 401, {'detail': 'Authentication credentials were not provided.'})
+        if not await run_query(has_board_access, user, board_id):
+            return await self.respond(send, 403, {'detail': 'You do not have permission to perform this action.'})
+
+        await sync_to_async(ensure_listener)()
+        loop = asyncio.get_running_loop()
+        queue = EventQueue(maxsize=settings.BOARD_EVENTS_QUEUE_SIZE)
+        broker.subscribe(board_id, loop, queue)
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await self.send_body(send, f'retry: {settings.BOARD_EVENTS_RETRY}\n\n')
+            while not disconnected.done():
+                if queue.overflowed and queue.empty():
+                    # Events were dropped after these, the client reconnects after retry and catches up
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+                next_event = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({next_event, disconnected}, timeout=settings.BOARD_EVENTS_HEARTBEAT,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if next_event not in done:
+                    next_event.cancel()
+                    if not disconnected.done():
+                        await self.send_body(send, ': ping\n\n')
+                    continue
+                event = next_event.result()
+                await self.send_body(send, f'id: {event["version"]}\nevent: change\ndata: {json.dumps(event)}\n\n')
+        finally:
+            broker.unsubscribe(board_id, loop, queue)
+            disconnected.cancel()
+
+    async def send_body(self, send, text):
+        await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+
+    async def wait_for_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
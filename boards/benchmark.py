@@ -0,0 +1,141 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from boards.models import BoardAccess, Column
+from main.timing import percentile
+
+User = get_user_model()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def get_board_detail(client, target):
+    return client.get(reverse('board_api_detail', kwargs={'pk': target['board']}))
+
+
+def get_board_page(client, target):
+    return client.get(reverse('board_detail', kwargs={'pk': target['board']}))
+
+
+def list_cards(client, target):
+    return client.get(reverse('card_api'))
+
+
+def create_card(client, target):
+    return client.post(reverse('card_api'), {'name': 'Benchmark', 'description': 'Benchmark card',
+                                             'due_date': '2030-01-01', 'column': target['column']})
+
+
+def list_checklists(client, target):
+    return client.get(reverse('checklist_api'))
+
+
+def list_favourites(client, target):
+    return client.get(reverse('favourite_api'))
+
+
+def create_favourite(client, target):
+    return client.post(reverse('favourite_api'), {'board': target['board'], 'author': target['user']})
+
+
+SCENARIOS = {
+    'board_api_detail': get_board_detail,
+    'board_detail': get_board_page,
+    'card_api': list_cards,
+    'card_api_create': create_card,
+    'checklist_api': list_checklists,
+    'favourite_api': list_favourites,
+    'favourite_api_create': create_favourite,
+}
+
+
+def get_targets(users, seed=0):
+    # Board members with one of their boards and a column of it, picked the same way on every run
+    first = {}
+    access = BoardAccess.objects.order_by('user_id', 'board_id').values_list('user_id', 'board_id')
+    for user, board in access.iterator():
+        first.setdefault(user, board)
+    if not first:
+        return []
+    picked = random.Random(seed).sample(sorted(first), min(users, len(first)))
+    columns = dict(Column.objects.filter(board_id__in=[first[user] for user in picked])
+                   .order_by('board_id', '-pk').values_list('board_id', 'pk'))
+    return [{'user': user, 'board': first[user], 'column': columns.get(first[user])} for user in picked]
+
+
+def get_clients(targets):
+    users = User.objects.in_bulk([target['user'] for target in targets])
+    clients = {}
+    for pk, user in users.items():
+        clients[pk] = Client()
+        clients[pk].force_login(user)
+    return clients
+
+
+def run_scenario(scenario, clients, targets, requests, warmup=5, seed=0):
+    rng = random.Random(seed)
+    timings = []
+    queries = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(warmup + requests):
+        target = rng.choice(targets)
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with connections['default'].execute_wrapper(counter):
+            response = scenario(clients[target['user']], target)
+        elapsed = time.perf_counter() - start
+        if i < warmup:
+            started = time.perf_counter()
+            continue
+        timings.append(elapsed * 1000)
+        queries.append(counter.queries)
+        errors += response.status_code >= 400
+    duration = time.perf_counter() - started
+    timings.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50': percentile(timings, 0.5),
+        'p95': percentile(timings, 0.95),
+        'p99': percentile(timings, 0.99),
+        'mean': statistics.mean(timings),
+        'throughput': requests / duration,
+        'queries': statistics.mean(queries),
+        'max_queries': max(queries),
+    }
+
+
+def run(names, users=20, requests=200, warmup=5, seed=0):
+    targets = get_targets(users, seed)
+    if not targets:
+        raise ValueError('There are no boards with members to run the scenarios against')
+    clients = get_clients(targets)
+    return {name: run_scenario(SCENARIOS[name], clients, targets, requests, warmup, seed) for name in names}
+
+
+def compare(baseline, results, threshold=0.2):
+    # Regressions: p95 slower by more than the threshold, or more queries per request
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95'] > before['p95'] * (1 + threshold):
+            regressions.append(f'{name}: p95 {before["p95"]:.1f} ms -> {result["p95"]:.1f} ms')
+        if result['max_queries'] > before['max_queries']:
+            regressions.append(f'{name}: queries {before["max_queries"]} -> {result["max_queries"]}')
+    return regressions
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'board_events'
+
+
+class EventQueue(asyncio.Queue):
+    # Queue of one stream. A client that can't keep up is disconnected instead of growing it,
+    # it reconnects and catches up from the last version it got.
+    overflowed = False
+
+    def offer(self, event):
+        try:
+            self.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class BoardEventBroker:
+    # In-process pub/sub. Subscribers are EventQueues living on an event loop,
+    # publishers may be any thread (sync views, signals, the NOTIFY listener).
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, board_id, loop, queue):
+        with self.lock:
+            self.subscribers.setdefault(board_id, set()).add((loop, queue))
+
+    def unsubscribe(self, board_id, loop, queue):
+        with self.lock:
+            subscribers = self.subscribers.get(board_id, set())
+            subscribers.discard((loop, queue))
+            if not subscribers:
+                self.subscribers.pop(board_id, None)
+
+    def dispatch(self, board_id, event):
+        with self.lock:
+            subscribers = list(self.subscribers.get(board_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.offer, event)
+
+
+broker = BoardEventBroker()
+
+
+def publish_board_event(board_id, event):
+    # Sent after commit, so subscribers never see a change that was rolled back
+    def send():
+        if settings.BOARD_EVENTS_NOTIFY:
+            payload = json.dumps({'board': board_id, 'event': event})
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_notify(%s, %s)', [NOTIFY_CHANNEL, payload])
+        else:
+            broker.dispatch(board_id, event)
+
+    transaction.on_commit(send)
+
+
+class PostgresListener(threading.Thread):
+    # Fans NOTIFY payloads from every process out to this process' subscribers
+    daemon = True
+
+    def __init__(self, alias='default'):
+        super().__init__(name='board-events-listener')
+        self.alias = alias
+
+    def listen(self):
+        import psycopg2
+
+        params = connections[self.alias].get_connection_params()
+        pg_connection = psycopg2.connect(**params)
+        pg_connection.autocommit = True
+        with pg_connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+        try:
+            while True:
+                if select.select([pg_connection], [], [], 5) == ([], [], []):
+                    continue
+                pg_connection.poll()
+                while pg_connection.notifies:
+                    message = json.loads(pg_connection.notifies.pop(0).payload)
+                    broker.dispatch(message['board'], message['event'])
+        finally:
+            pg_connection.close()
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:
+                logger.exception('Board events listener failed, reconnecting')
+                time.sleep(1)
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def ensure_listener():
+    global _listener
+    if not settings.BOARD_EVENTS_NOTIFY:
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = PostgresListener()
+            _listener.start()
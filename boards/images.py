@@ -0,0 +1,190 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image
+
+from boards.jobs import enqueue
+from boards.models import Board, Job
+from main.metrics import IMAGE_PROCESSING
+
+VARIANT_FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def get_background_variants(board):
+    # Variants of an older background are ignored until the new one is processed
+    variants = board.background_variants or {}
+    if not board.background or variants.get('source') != board.background.name:
+        return []
+    return variants.get('images', [])
+
+
+def get_background_key(board):
+    # Blob names are content hashes, so this changes whenever the background does
+    return os.path.splitext(os.path.basename(board.background.name))[0][:16]
+
+
+def get_best_background(board):
+    jpegs = [variant for variant in get_background_variants(board) if variant['format'] == 'jpeg']
+    return max(jpegs, key=lambda variant: variant['width'], default=None)
+
+
+def find_variant(board, requested_width, extension):
+    variants = sorted((variant for variant in get_background_variants(board) if variant['format'] == extension),
+                      key=lambda variant: variant['width'])
+    if not variants:
+        return None
+    return next((variant for variant in variants if variant['width'] >= requested_width), variants[-1])
+
+
+def check_image_size(image):
+    # Only the header has been read at this point, so this is cheap
+    if image.width * image.height > settings.BOARD_BACKGROUND_MAX_PIXELS:
+        raise ImageTooLarge(f'Image has more than {settings.BOARD_BACKGROUND_MAX_PIXELS} pixels')
+
+
+def get_variant_widths(width):
+    largest = min(width, settings.BOARD_BACKGROUND_MAX_WIDTH)
+    return sorted({size for size in settings.BOARD_BACKGROUND_WIDTHS if size < largest} | {largest})
+
+
+def snap_width(requested, width):
+    # Any requested width is served by the smallest variant that is at least as wide
+    widths = get_variant_widths(width)
+    return next((size for size in widths if size >= requested), widths[-1])
+
+
+def open_image(file):
+    # Only the header is read, the pixels are decoded on first use
+    image = Image.open(file)
+    check_image_size(image)
+    return image
+
+
+def decode(image, width):
+    # JPEGs are decoded straight at a reduced scale (1/2 to 1/8) when that is enough for width
+    image.draft('RGB', (width, round(image.height * width / image.width)))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def resize(image, width):
+    if width >= image.width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def write_image(image, extension, file):
+    image.save(file, VARIANT_FORMATS[extension], optimize=True, quality=settings.BOARD_BACKGROUND_QUALITY)
+
+
+def save_variant(image, extension, name):
+    # Encoded into a temporary file that goes to disk when it grows, then streamed to storage
+    with tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as file:
+        write_image(image, extension, file)
+        file.seek(0)
+        return default_storage.save(name, File(file))
+
+
+def process_board_background(board_id):
+    board = Board.objects.filter(pk=board_id).first()
+    if board is None or not board.background or get_background_variants(board):
+        return
+    source = board.background.name
+    stem = os.path.splitext(os.path.basename(source))[0]
+
+    images = []
+    with IMAGE_PROCESSING.labels('background_variants').time(), board.background.open('rb') as file:
+        image = open_image(file)
+        widths = get_variant_widths(image.width)
+        image = decode(image, widths[-1])
+        # Largest first, every size is scaled down from the previous one
+        for width in reversed(widths):
+            image = resize(image, width)
+            for extension in VARIANT_FORMATS:
+                name = f'board_background/variants/{board_id}/{stem}-{width}.{extension}'
+                images.append({'width': width, 'format': extension, 'name': save_variant(image, extension, name)})
+
+    with transaction.atomic():
+        board = Board.objects.select_for_update().get(pk=board_id)
+        if board.background.name != source:
+            # Replaced while we were working, the new background has its own job
+            stale, current = images, []
+        else:
+            stale, current = (board.background_variants or {}).get('images', []), images
+            board.background_variants = {'source': source, 'images': current}
+            board.save(update_fields=['background_variants'])
+    delete_variants(stale)
+
+
+def delete_variants(variants):
+    for variant in variants:
+        default_storage.delete(variant['name'])
+
+
+def get_cache_path(board, requested_width, extension):
+    # Path and width of the variant in the on-disk cache, only the header of the background is read
+    with board.background.open('rb') as file:
+        width = snap_width(requested_width, open_image(file).width)
+    stem, _ = os.path.splitext(board.background.name)
+    return os.path.join(settings.BOARD_BACKGROUND_CACHE_DIR, f'{stem}-{width}.{extension}'), width
+
+
+def get_cached_variant(board, requested_width, extension):
+    # Returns the path of the variant in the on-disk cache, None until a job has rendered it
+    path, width = get_cache_path(board, requested_width, extension)
+    if os.path.exists(path):
+        return path
+    payload = {'board_id': board.pk, 'width': width, 'extension': extension}
+    # Requests keep coming until it is there, one pending job is enough
+    if not Job.objects.filter(name='boards.images.render_cached_variant', payload=payload,
+                              status=Job.PENDING).exists():
+        enqueue('boards.images.render_cached_variant', **payload)
+    return None
+
+
+def render_cached_variant(board_id, width, extension):
+    board = Board.objects.filter(pk=board_id).first()
+    if board is None or not board.background:
+        return
+    path, width = get_cache_path(board, width, extension)
+    if os.path.exists(path):
+        return
+    with IMAGE_PROCESSING.labels('cached_variant').time(), board.background.open('rb') as file:
+        image = resize(decode(open_image(file), width), width)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written next to the final path and renamed, so readers never see a partial file
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as cached:
+            write_image(image, extension, cached)
+    os.replace(cached.name, path)
+
+
+def delete_cached_variants(source):
+    # Cached variants are named after the content of the background, other boards may use it too
+    if not source or Board.objects.filter(background=source).exists():
+        return
+    stem, _ = os.path.splitext(source)
+    directory = os.path.join(settings.BOARD_BACKGROUND_CACHE_DIR, os.path.dirname(stem))
+    prefix = f'{os.path.basename(stem)}-'
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.startswith(prefix):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
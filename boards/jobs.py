@@ -0,0 +1,74 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from boards.models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(name, **payload):
+    # Created in the caller's transaction, so the job only becomes visible with its data
+    return Job.objects.create(name=name, payload=payload)
+
+
+def claim_job():
+    now = timezone.now()
+    # A lease that ran out means the worker died during the job (killed, out of memory), it is
+    # not handed out again once it used up its attempts
+    failed = (Job.objects.filter(status=Job.RUNNING, run_after__lte=now, attempts__gte=settings.JOB_MAX_ATTEMPTS)
+              .update(status=Job.FAILED, error='The lease ran out on the last attempt, the worker probably died'))
+    if failed:
+        logger.error('%s jobs failed after their lease ran out', failed)
+    with transaction.atomic():
+        job = (Job.objects.select_for_update(skip_locked=True)
+               .filter(Q(status=Job.PENDING) | Q(status=Job.RUNNING), run_after__lte=now)
+               .order_by('run_after', 'pk').first())
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.run_after = now + timedelta(seconds=settings.JOB_LEASE)
+        job.save(update_fields=['status', 'attempts', 'run_after'])
+    return job
+
+
+def run_job(job):
+    try:
+        import_string(job.name)(**job.payload)
+    except Exception:
+        logger.exception('Job %s failed', job.pk)
+        job.error = traceback.format_exc()
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            job.status = Job.FAILED
+        else:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=2 ** job.attempts)
+    else:
+        job.status = Job.DONE
+        job.run_after = timezone.now()
+        job.error = ''
+    job.save(update_fields=['status', 'run_after', 'error'])
+    return job
+
+
+def delete_done_jobs():
+    return Job.objects.filter(status=Job.DONE,
+                              run_after__lt=timezone.now() - timedelta(seconds=settings.JOB_KEEP_DONE)).delete()[0]
+
+
+def run_pending_jobs(limit=None):
+    count = 0
+    while limit is None or count < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
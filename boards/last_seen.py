@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.utils import timezone
+
+from boards.models import Board, LastSeen
+from main.metrics import LAST_SEEN_PENDING
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+class LastSeenRecorder:
+    # Board reads only touch this in-process buffer. It is written to the database
+    # with one bulk upsert when LAST_SEEN_FLUSH_INTERVAL has passed or when
+    # LAST_SEEN_MAX_PENDING entries are waiting. Each server worker has its own buffer
+    # and flushes it from a thread (start()), so reads served by other workers show up
+    # within LAST_SEEN_FLUSH_INTERVAL, and a killed worker loses at most that much.
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.thread = None
+        self.stopping = threading.Event()
+        # Set by record() when the buffer is due, the thread flushes it right away
+        self.due = threading.Event()
+
+    def start(self):
+        # Called in every worker by `manage.py serve`, threads do not survive the fork
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name='last-seen-flush', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.due.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while True:
+            self.due.wait(settings.LAST_SEEN_FLUSH_INTERVAL)
+            self.due.clear()
+            if self.stopping.is_set():
+                return
+            try:
+                self.try_flush()
+            finally:
+                # This thread's connection, given back to the pool when there is one
+                connections.close_all()
+
+    def try_flush(self):
+        # The entries are kept for the next try, a failure must not reach whoever triggered it
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Flushing last seen entries failed')
+
+    def record(self, user_id, board_id, seen=None):
+        with self.lock:
+            self.pending[(user_id, board_id)] = seen or timezone.now()
+            LAST_SEEN_PENDING.set(len(self.pending))
+            due = (len(self.pending) >= settings.LAST_SEEN_MAX_PENDING or
+                   time.monotonic() - self.last_flush >= settings.LAST_SEEN_FLUSH_INTERVAL)
+        if not due:
+            return
+        if self.thread is not None and self.thread.is_alive():
+            # The read itself writes nothing
+            self.due.set()
+        else:
+            # No thread outside of `manage.py serve` (runserver, tests)
+            self.try_flush()
+
+    def clear(self):
+        with self.lock:
+            self.pending = {}
+            LAST_SEEN_PENDING.set(0)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            LAST_SEEN_PENDING.set(0)
+            self.last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        try:
+            # Boards or users may have been deleted while the entries were waiting
+            boards = set(Board.objects.filter(pk__in={board for _, board in pending}).values_list('pk', flat=True))
+            users = set(User.objects.filter(pk__in={user for user, _ in pending}).values_list('pk', flat=True))
+            rows = [LastSeen(user_id=user, board_id=board, seen=seen)
+                    for (user, board), seen in pending.items() if user in users and board in boards]
+            # Django 4.1 puts unique_fields into the ON CONFLICT clause as is, hence the column names
+            LastSeen.objects.bulk_create(rows, update_conflicts=True, unique_fields=['user_id', 'board_id'],
+                                         update_fields=['seen'])
+        except Exception:
+            # Kept for the next flush, unless the board was read again meanwhile
+            with self.lock:
+                self.pending = {**pending, **self.pending}
+                LAST_SEEN_PENDING.set(len(self.pending))
+            raise
+        return len(rows)
+
+
+last_seen_recorder = LastSeenRecorder()
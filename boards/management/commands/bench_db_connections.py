@@ -0,0 +1,59 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+
+from boards.models import Favourite
+from main.db.pool import acquire_stats
+
+MODES = {
+    # Connection settings applied for each run
+    'new connection per request': {'CONN_MAX_AGE': 0, 'POOL_SIZE': 0},
+    'persistent (CONN_MAX_AGE)': {'CONN_MAX_AGE': 60, 'POOL_SIZE': 0},
+    'pool': {'CONN_MAX_AGE': 0, 'POOL_SIZE': 4},
+}
+
+
+class Command(BaseCommand):
+    help = ('Measures per-request latency of a cheap query (the /api/favourite/ list) '
+            'with each database connection strategy')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--database', default='default')
+
+    def request(self, database):
+        # The same signals as a real request, they close or check in the connection
+        request_started.send(sender=self.__class__)
+        try:
+            list(Favourite.objects.using(database)[:20])
+        finally:
+            request_finished.send(sender=self.__class__)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'postgresql':
+            self.stderr.write(f'{options["database"]} is not a Postgres database, the results would be meaningless')
+        original = {key: connection.settings_dict.get(key) for key in ('CONN_MAX_AGE', 'POOL_SIZE')}
+        try:
+            for mode, settings in MODES.items():
+                connection.close()
+                connection.settings_dict.update(settings)
+                self.request(options['database'])
+                acquire_stats.reset()
+                timings = []
+                for _ in range(options['requests']):
+                    start = time.perf_counter()
+                    self.request(options['database'])
+                    timings.append((time.perf_counter() - start) * 1000)
+                stats = acquire_stats.snapshot()
+                acquire = stats['total'] / stats['count'] * 1000 if stats['count'] else 0
+                self.stdout.write(
+                    f'{mode:28} mean {statistics.mean(timings):7.3f} ms   '
+                    f'p95 {statistics.quantiles(timings, n=20)[-1]:7.3f} ms   '
+                    f'acquired {stats["count"]:5}   acquire {acquire:6.3f} ms')
+        finally:
+            connection.close()
+            connection.settings_dict.update(original)
@@ -0,0 +1,82 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from boards.benchmark import SCENARIOS, compare, run
+from boards.models import Board
+from boards.seed import Seeder
+
+
+class Command(BaseCommand):
+    help = ('Seeds a test database and measures the boards API and pages with scripted scenarios. '
+            'The configured database is not touched, its test database is used instead.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                            help='Run only this scenario, can be repeated')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+        parser.add_argument('--clients', type=int, default=20, help='Different users making the requests')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--boards', type=int, default=20)
+        parser.add_argument('--columns', type=int, default=20, help='Columns per board on average')
+        parser.add_argument('--cards', type=int, default=10, help='Cards per column on average')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the test database, and its data, for the next run')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='JSON file of an earlier run, regressions make the command fail')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed p95 slowdown against --compare, 0.2 is 20%%')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        databases = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        # Slow requests are what is measured here, the budget warnings would only drown the report
+        logging.disable(logging.WARNING)
+        try:
+            results = self.benchmark(options)
+        finally:
+            logging.disable(logging.NOTSET)
+            teardown_databases(databases, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.report(results['scenarios'])
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+            self.report_diff(baseline['scenarios'], results['scenarios'])
+            regressions = compare(baseline['scenarios'], results['scenarios'], options['threshold'])
+            if regressions:
+                raise CommandError('Regressions against {}:\n{}'.format(options['compare'], '\n'.join(regressions)))
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["compare"]}'))
+
+    def benchmark(self, options):
+        shape = {key: options[key] for key in ('users', 'boards', 'columns', 'cards', 'seed')}
+        if not Board.objects.exists():
+            counts = Seeder(**shape).seed()
+            self.stdout.write('Seeded ' + ', '.join(f'{count} {model}' for model, count in counts.items()))
+        names = options['scenario'] or list(SCENARIOS)
+        scenarios = run(names, users=options['clients'], requests=options['requests'], seed=options['seed'])
+        return {'database': connection.vendor, 'shape': shape, 'scenarios': scenarios}
+
+    def report(self, scenarios):
+        self.stdout.write(f'{"scenario":22} {"p50":>8} {"p95":>8} {"p99":>8} {"req/s":>8} {"queries":>8} {"errors":>6}')
+        for name, result in scenarios.items():
+            self.stdout.write(f'{name:22} {result["p50"]:8.2f} {result["p95"]:8.2f} {result["p99"]:8.2f} '
+                              f'{result["throughput"]:8.1f} {result["queries"]:8.1f} {result["errors"]:6}')
+
+    def report_diff(self, baseline, scenarios):
+        self.stdout.write(f'{"scenario":22} {"p95 before":>10} {"p95 after":>10} {"change":>8} {"queries":>12}')
+        for name, result in scenarios.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            change = (result['p95'] / before['p95'] - 1) * 100
+            queries = f'{before["queries"]:.1f} -> {result["queries"]:.1f}'
+            self.stdout.write(f'{name:22} {before["p95"]:10.2f} {result["p95"]:10.2f} {change:+7.1f}% {queries:>12}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from boards.uploads import delete_expired_uploads
+
+
+class Command(BaseCommand):
+    help = 'Deletes chunked uploads that were not finalized in time, with their part files'
+
+    def handle(self, *args, **options):
+        count = delete_expired_uploads()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} expired uploads'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from boards.services import rebuild_board_access
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the BoardAccess table from board owners and members'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_board_access(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} board access rows'))
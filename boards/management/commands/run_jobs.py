@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from boards.jobs import delete_done_jobs, run_pending_jobs
+
+# Seconds between two deletions of old done jobs
+CLEAN_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the pending jobs and exit')
+        parser.add_argument('--sleep', type=float, default=1, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        cleaned = None
+        while True:
+            if cleaned is None or time.monotonic() - cleaned >= CLEAN_INTERVAL:
+                delete_done_jobs()
+                cleaned = time.monotonic()
+            count = run_pending_jobs()
+            if options['once']:
+                self.stdout.write(self.style.SUCCESS(f'Ran {count} jobs'))
+                return
+            if not count:
+                time.sleep(options['sleep'])
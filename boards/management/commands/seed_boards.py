@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from boards.seed import DISTRIBUTIONS, SEED_PASSWORD, Seeder
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with generated users and boards, with bulk inserts (COPY on Postgres). '
+            'Sizes are averages, --distribution decides how they vary between boards, columns and cards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--boards', type=int, default=100)
+        parser.add_argument('--members', type=int, default=10, help='Members per board')
+        parser.add_argument('--columns', type=int, default=20, help='Columns per board')
+        parser.add_argument('--cards', type=int, default=10, help='Cards per column')
+        parser.add_argument('--comments', type=int, default=2, help='Comments per card')
+        parser.add_argument('--checklists', type=int, default=1, help='Checklists per card')
+        parser.add_argument('--marks', type=int, default=5, help='Marks per board')
+        parser.add_argument('--marked', type=float, default=0.5, help='Share of the cards with a mark')
+        parser.add_argument('--files', type=float, default=0.2, help='Share of the cards with a file')
+        parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same shapes')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT or COPY')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        seeder = Seeder(
+            users=options['users'], boards=options['boards'], members=options['members'],
+            columns=options['columns'], cards=options['cards'], comments=options['comments'],
+            checklists=options['checklists'], marks=options['marks'], marked=options['marked'],
+            files=options['files'], distribution=options['distribution'], seed=options['seed'],
+            batch_size=options['batch_size'], progress=self.progress,
+        )
+        counts = seeder.seed()
+        self.stdout.write(self.style.SUCCESS(
+            'Created {} in {:.1f} s, users log in with "{}"'.format(
+                ', '.join(f'{count} {model}' for model, count in counts.items()),
+                time.monotonic() - start, SEED_PASSWORD)))
+
+    def progress(self, counts):
+        self.stdout.write(f'{counts.get("Board", 0)} boards, {counts.get("Card", 0)} cards')
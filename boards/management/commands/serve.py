@@ -0,0 +1,119 @@
+import gc
+import glob
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.module_loading import import_string
+from gunicorn.app.base import BaseApplication
+from prometheus_client import multiprocess
+
+from boards.last_seen import last_seen_recorder
+from main.metrics import get_process_id
+
+APPLICATIONS = {
+    'wsgi': 'main.wsgi.application',
+    'asgi': 'main.asgi.application',
+}
+
+
+def when_ready(server):
+    # Everything imported while preloading is moved out of the collector's reach, otherwise
+    # the first collection in each worker writes to (and copies) the pages shared with the master
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Connections must not be shared between processes
+    connections.close_all()
+
+
+def post_worker_init(worker):
+    # Buffered board reads are written every LAST_SEEN_FLUSH_INTERVAL, even by an idle worker
+    last_seen_recorder.start()
+
+
+def worker_exit(server, worker):
+    # Buffered board reads would be lost on a graceful reload or shutdown
+    last_seen_recorder.stop()
+    last_seen_recorder.flush()
+
+
+def child_exit(server, worker):
+    # The live gauges of a dead worker must not be added up any more
+    if settings.METRICS_DIR:
+        multiprocess.mark_process_dead(get_process_id(worker.pid))
+
+
+def clear_metrics():
+    # Files left by the previous server would be added to the new values, the job worker's stay
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, f'*_{get_process_id("*")}.db')):
+        os.remove(path)
+
+
+class ServerApplication(BaseApplication):
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return import_string(self.application)
+
+
+class Command(BaseCommand):
+    help = ('Runs the site under gunicorn: preloaded prefork workers, SIGHUP restarts them gracefully '
+            'and SIGTERM drains them before exiting')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--asgi', action='store_true', help='Run main.asgi (with board events) on uvicorn workers')
+        parser.add_argument('--bind', default=settings.SERVER_BIND)
+        parser.add_argument('--workers', type=int, default=settings.SERVER_WORKERS)
+        parser.add_argument('--threads', type=int, default=settings.SERVER_THREADS,
+                            help='Threads per WSGI worker')
+        parser.add_argument('--no-preload', action='store_true',
+                            help='Import the application in every worker instead of once before forking')
+
+    def get_options(self, options):
+        if options['asgi']:
+            worker_class = 'uvicorn.workers.UvicornWorker'
+        else:
+            worker_class = 'gthread' if options['threads'] > 1 else 'sync'
+        return {
+            'bind': options['bind'],
+            'workers': options['workers'],
+            'threads': options['threads'],
+            'worker_class': worker_class,
+            'preload_app': not options['no_preload'],
+            'timeout': settings.SERVER_TIMEOUT,
+            'graceful_timeout': settings.SERVER_TIMEOUT,
+            'keepalive': settings.SERVER_KEEPALIVE,
+            # Recycled now and then, so slow leaks don't grow without bound
+            'max_requests': settings.SERVER_MAX_REQUESTS,
+            'max_requests_jitter': settings.SERVER_MAX_REQUESTS // 10,
+            'accesslog': '-',
+            'when_ready': when_ready,
+            'post_fork': post_fork,
+            'post_worker_init': post_worker_init,
+            'worker_exit': worker_exit,
+            'child_exit': child_exit,
+        }
+
+    def handle(self, *args, **options):
+        if options['asgi'] and options['workers'] > 1 and not settings.BOARD_EVENTS_NOTIFY:
+            # The in-process broker only reaches the clients of the worker that made the change
+            raise CommandError('Board events need BOARD_EVENTS_NOTIFY with more than one ASGI worker.')
+        if options['asgi'] and not settings.MEDIA_SENDFILE:
+            # Django's ASGI handler reads FileResponse in Python on the event loop, there is no file_wrapper
+            self.stderr.write('Protected media are sent by the workers, set MEDIA_SENDFILE to hand them '
+                              'to the front server.')
+        application = APPLICATIONS['asgi' if options['asgi'] else 'wsgi']
+        if settings.METRICS_DIR:
+            clear_metrics()
+        ServerApplication(application, self.get_options(options)).run()
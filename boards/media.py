@@ -0,0 +1,127 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import http_date, parse_etags
+from django.views.static import was_modified_since
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange:
+    # Reads length bytes from start. fileno() lets the WSGI server's file_wrapper
+    # send the range with os.sendfile, it starts at the current offset and stops at Content-Length.
+    # The ASGI handler has no file_wrapper and reads it in Python, there MEDIA_SENDFILE is needed.
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    # Returns (start, end) inclusive, None to send the whole file, or False when unsatisfiable.
+    # Multiple ranges are rare and may be answered with the whole file.
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def get_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def get_sendfile_response(path):
+    if settings.MEDIA_SENDFILE == 'x-sendfile':
+        return HttpResponse(headers={'X-Sendfile': path})
+    media_root = os.path.abspath(settings.MEDIA_ROOT)
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect' and path.startswith(media_root + os.sep):
+        # The front server maps MEDIA_ACCEL_REDIRECT_PREFIX to MEDIA_ROOT as an internal location
+        name = os.path.relpath(path, media_root).replace(os.sep, '/')
+        return HttpResponse(headers={'X-Accel-Redirect': settings.MEDIA_ACCEL_REDIRECT_PREFIX + name})
+    return None
+
+
+def get_content_disposition(filename):
+    # filename* carries any name, the plain filename is an ASCII fallback for old clients
+    fallback = filename.encode('ascii', 'ignore').decode().replace('\\', '_').replace('"', '_') or 'download'
+    return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{quote(filename)}'
+
+
+def serve_file(request, path, content_type=None, immutable=False, filename=None):
+    # With filename the file is sent as a download under that name
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    etag = get_etag(stat)
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        # Only ever sent to users with access to the board, so shared caches must not keep it
+        'Cache-Control': 'private, max-age=31536000, immutable' if immutable else 'private, no-cache',
+    }
+    if filename:
+        headers['Content-Disposition'] = get_content_disposition(filename)
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        not_modified = etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+    else:
+        not_modified = not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime)
+    if not_modified:
+        return HttpResponse(status=304, headers=headers)
+
+    # The front server handles Range itself when it sends the file
+    response = get_sendfile_response(path)
+    if response is not None:
+        response['Content-Type'] = content_type
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    headers['Accept-Ranges'] = 'bytes'
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if 'Range' in request.headers and (not if_range or if_range == etag):
+        byte_range = parse_range(request.headers['Range'], stat.st_size)
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{stat.st_size}'
+        return HttpResponse(status=416, headers=headers)
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type, headers=headers)
+        response['Content-Length'] = stat.st_size
+        if filename:
+            # FileResponse puts the stored name in its own header
+            response['Content-Disposition'] = headers['Content-Disposition']
+        return response
+    start, end = byte_range
+    response = FileResponse(FileRange(file, start, end - start + 1), status=206, content_type=content_type,
+                            headers=headers)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    return response
@@ -0,0 +1,41 @@
+# Generated by Django 4.1.3 on 2026-10-18 19:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_board_access(apps, schema_editor):
+    Board = apps.get_model('boards', 'Board')
+    Members = apps.get_model('boards', 'Members')
+    BoardAccess = apps.get_model('boards', 'BoardAccess')
+    owners = set(Board.objects.exclude(owner=None).values_list('pk', 'owner_id'))
+    members = set(Members.objects.values_list('board_id', 'member_id')) - owners
+    rows = [BoardAccess(board_id=board_id, user_id=user_id, role='owner') for board_id, user_id in owners]
+    rows += [BoardAccess(board_id=board_id, user_id=user_id, role='member') for board_id, user_id in members]
+    BoardAccess.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('boards', '0007_alter_mark_board'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoardAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('owner', 'Owner'), ('member', 'Member')], max_length=6)),
+                ('board', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access', to='boards.board')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='board_access', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='boardaccess',
+            constraint=models.UniqueConstraint(fields=('user', 'board'), name='unique_board_access'),
+        ),
+        migrations.RunPython(fill_board_access, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.3 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0008_boardaccess'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='BoardChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=30)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('version', models.PositiveBigIntegerField()),
+                ('created_version', models.PositiveBigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('board', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='changes', to='boards.board')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='boardchange',
+            index=models.Index(fields=['board', 'version'], name='board_change_version_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='boardchange',
+            constraint=models.UniqueConstraint(fields=('board', 'model', 'object_id'), name='unique_board_change'),
+        ),
+    ]
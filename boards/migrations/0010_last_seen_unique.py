@@ -0,0 +1,33 @@
+# Generated by Django 4.1.3 on 2026-10-18 19:42
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def remove_duplicate_last_seen(apps, schema_editor):
+    # Keeps the most recent row of every (user, board) pair
+    LastSeen = apps.get_model('boards', 'LastSeen')
+    duplicates = LastSeen.objects.values('user', 'board').annotate(count=models.Count('pk')).filter(count__gt=1)
+    for row in duplicates:
+        rows = LastSeen.objects.filter(user=row['user'], board=row['board']).order_by('-seen')
+        rows.exclude(pk=rows[0].pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0009_board_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lastseen',
+            name='seen',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(remove_duplicate_last_seen, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='lastseen',
+            constraint=models.UniqueConstraint(fields=('user', 'board'), name='unique_last_seen'),
+        ),
+    ]
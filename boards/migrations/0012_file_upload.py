@@ -0,0 +1,29 @@
+# Generated by Django 4.1.3 on 2026-10-18 19:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('boards', '0011_jobs_background_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('offset', models.PositiveBigIntegerField(default=0)),
+                ('checksum', models.CharField(max_length=64)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='boards.card')),
+            ],
+        ),
+    ]
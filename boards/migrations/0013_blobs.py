@@ -0,0 +1,32 @@
+# Generated by Django 4.1.3 on 2026-10-18 19:51
+
+import boards.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0012_file_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='board',
+            name='background',
+            field=models.ImageField(blank=True, null=True, storage=boards.storage.ContentAddressedStorage(), upload_to='board_background'),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='name',
+            field=models.FileField(storage=boards.storage.ContentAddressedStorage(), upload_to='board_files'),
+        ),
+    ]
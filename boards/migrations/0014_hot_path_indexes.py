@@ -0,0 +1,55 @@
+# Generated by Django 4.1.3 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+UNIQUE_FIELDS = {
+    'Archive': ('author', 'board'),
+    'Favourite': ('author', 'board'),
+    'MarkCard': ('mark', 'card'),
+    'Members': ('member', 'board'),
+}
+
+
+def remove_duplicates(apps, schema_editor):
+    # Keeps the oldest row of every pair
+    for model_name, fields in UNIQUE_FIELDS.items():
+        model = apps.get_model('boards', model_name)
+        duplicates = model.objects.values(*fields).annotate(count=models.Count('pk')).filter(count__gt=1)
+        for row in duplicates:
+            rows = model.objects.filter(**{field: row[field] for field in fields}).order_by('pk')
+            rows.exclude(pk=rows[0].pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0013_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['card', '-created_on'], name='comment_card_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lastseen',
+            index=models.Index(fields=['user', '-seen'], name='last_seen_user_seen_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='archive',
+            constraint=models.UniqueConstraint(fields=('author', 'board'), name='unique_archive'),
+        ),
+        migrations.AddConstraint(
+            model_name='favourite',
+            constraint=models.UniqueConstraint(fields=('author', 'board'), name='unique_favourite'),
+        ),
+        migrations.AddConstraint(
+            model_name='markcard',
+            constraint=models.UniqueConstraint(fields=('mark', 'card'), name='unique_mark_card'),
+        ),
+        migrations.AddConstraint(
+            model_name='members',
+            constraint=models.UniqueConstraint(fields=('member', 'board'), name='unique_member'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.1.3 on 2026-10-18 20:30
+
+from django.db import migrations, models
+
+from boards.ranks import spread_ranks
+
+
+def set_ranks(apps, schema_editor):
+    # Existing items keep the order they had, the order of their primary keys
+    for model_name, parent in (('Column', 'board_id'), ('Card', 'column_id')):
+        model = apps.get_model('boards', model_name)
+        parents = model.objects.exclude(**{parent: None}).values_list(parent, flat=True).distinct().order_by()
+        for parent_id in list(parents):
+            items = list(model.objects.filter(**{parent: parent_id}).order_by('pk').only('pk'))
+            for item, rank in zip(items, spread_ranks(len(items))):
+                item.rank = rank
+            model.objects.bulk_update(items, ['rank'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0014_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='card',
+            options={'ordering': ['rank', 'id']},
+        ),
+        migrations.AlterModelOptions(
+            name='column',
+            options={'ordering': ['rank', 'id']},
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='rank',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='column',
+            name='rank',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(set_ranks, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['column', 'rank', 'id'], name='card_column_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='column',
+            index=models.Index(fields=['board', 'rank', 'id'], name='column_board_rank_idx'),
+        ),
+    ]
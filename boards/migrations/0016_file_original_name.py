@@ -0,0 +1,30 @@
+# Generated by Django 4.1.3 on 2026-10-18 20:43
+
+import os
+
+from django.db import migrations, models
+
+
+def set_original_names(apps, schema_editor):
+    # The upload name of files stored by content hash is gone, the stored name is the best there is
+    File = apps.get_model('boards', 'File')
+    files = list(File.objects.only('pk', 'name'))
+    for file in files:
+        file.original_name = os.path.basename(file.name.name)[:255]
+    File.objects.bulk_update(files, ['original_name'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0015_ranks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='original_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(set_original_names, migrations.RunPython.noop),
+    ]
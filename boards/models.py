@@ -1,16 +1,76 @@
+import os
+
 from django.core.validators import FileExtensionValidator
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
+from boards.ranks import get_rank, lock
+from boards.storage import blob_storage
+
 User = get_user_model()
 
 
+class BoardQuerySet(models.QuerySet):
+    def accessible_to(self, user):
+        # BoardAccess is unique on (user, board), so the join never duplicates boards
+        return self.filter(access__user=user)
+
+    def with_tree(self):
+        # Loads the whole board (columns, cards and everything attached to cards)
+        # in a fixed number of queries, regardless of the board size.
+        cards = Card.objects.with_relations()
+        columns = Column.objects.prefetch_related(models.Prefetch('card_column', queryset=cards))
+        return self.select_related('owner').prefetch_related(
+            models.Prefetch('column', queryset=columns),
+            'members',
+        )
+
+
+class BoardRelatedQuerySet(models.QuerySet):
+    # Lookup path from the model to its Board
+    board_lookup = 'board'
+
+    def accessible_to(self, user):
+        return self.filter(**{f'{self.board_lookup}__access__user': user})
+
+
+class CardRelatedQuerySet(BoardRelatedQuerySet):
+    board_lookup = 'card__column__board'
+
+
+class CardQuerySet(BoardRelatedQuerySet):
+    board_lookup = 'column__board'
+
+    def with_relations(self):
+        return self.prefetch_related(
+            models.Prefetch('comment', queryset=Comment.objects.select_related('author')),
+            models.Prefetch('attached_to_card', queryset=MarkCard.objects.select_related('mark')),
+            'file',
+            'check_list',
+        )
+
+
 class Board(models.Model):
     file_extension_validator = FileExtensionValidator(allowed_extensions=['png', 'jpeg', 'jpg'],
                                                       message='File extension not allowed')
     title = models.CharField(max_length=36)
-    background = models.ImageField(upload_to='board_background', null=True, blank=True)
+    background = models.ImageField(upload_to='board_background', storage=blob_storage, null=True, blank=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owner', null=True, blank=True)
+    # Bumped on every write to the board or its content, see BoardChange
+    version = models.PositiveBigIntegerField(default=0)
+    # Resized copies of background made by boards.images, {'source': name, 'images': [...]}
+    background_variants = models.JSONField(default=dict, blank=True)
+
+    objects = BoardQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # version is only written by boards.services.record_board_change, a stale
+        # in-memory value must not overwrite a concurrent bump
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'version']
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.title}, {self.pk}'
@@ -20,14 +80,76 @@ class Members(models.Model):
     member = models.ForeignKey(User, on_delete=models.CASCADE)
     board = models.ForeignKey(Board, on_delete=models.CASCADE, related_name='members')
 
+    objects = BoardRelatedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['member', 'board'], name='unique_member'),
+        ]
+
     def __str__(self):
         return f'{self.member} - {self.board}'
 
 
+class BoardAccess(models.Model):
+    # Denormalized from Board.owner and Members, kept in sync by boards.signals
+    OWNER = 'owner'
+    MEMBER = 'member'
+    ROLE_CHOICES = (
+        (OWNER, 'Owner'),
+        (MEMBER, 'Member'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='board_access')
+    board = models.ForeignKey(Board, on_delete=models.CASCADE, related_name='access')
+    role = models.CharField(max_length=6, choices=ROLE_CHOICES)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'board'], name='unique_board_access'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.board} - {self.role}'
+
+
+class BoardChange(models.Model):
+    # One row per changed object, holding the board version of its latest change.
+    # Rows are removed together with the board in boards.signals, not by the database,
+    # so that changes recorded while a board is being deleted do not break the cascade.
+    board = models.ForeignKey(Board, on_delete=models.DO_NOTHING, db_constraint=False, related_name='changes')
+    model = models.CharField(max_length=30)
+    object_id = models.PositiveBigIntegerField()
+    version = models.PositiveBigIntegerField()
+    created_version = models.PositiveBigIntegerField()
+    deleted = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['board', 'model', 'object_id'], name='unique_board_change'),
+        ]
+        indexes = [
+            models.Index(fields=['board', 'version'], name='board_change_version_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.board_id} - {self.model} {self.object_id} - {self.version}'
+
+
 class LastSeen(models.Model):
+    # Written in bulk by boards.last_seen.LastSeenRecorder
     board = models.ForeignKey(Board, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    seen = models.DateTimeField(auto_now=True)
+    seen = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'board'], name='unique_last_seen'),
+        ]
+        indexes = [
+            # The last seen list, a user's rows newest first
+            models.Index(fields=['user', '-seen'], name='last_seen_user_seen_idx'),
+        ]
 
     def create(self):
         self.board = self.user
@@ -39,6 +161,25 @@ class LastSeen(models.Model):
 class Column(models.Model):
     name = models.CharField(max_length=30)
     board = models.ForeignKey(Board, on_delete=models.CASCADE, related_name='column')
+    # Position on the board, see boards.ranks
+    rank = models.CharField(max_length=255, default='', blank=True)
+
+    objects = BoardRelatedQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['rank', 'id']
+        indexes = [
+            models.Index(fields=['board', 'rank', 'id'], name='column_board_rank_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.rank:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            # New columns go to the end of the board
+            lock(Board, self.board_id)
+            self.rank = get_rank(Column.objects.filter(board_id=self.board_id).exclude(pk=self.pk))
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.name}, {self.pk}'
@@ -58,6 +199,25 @@ class Card(models.Model):
     description = models.TextField(max_length=500)
     due_date = models.DateField(blank=True, null=True)
     column = models.ForeignKey(Column, on_delete=models.SET_NULL, null=True, blank=True, related_name='card_column')
+    # Position in the column, see boards.ranks
+    rank = models.CharField(max_length=255, default='', blank=True)
+
+    objects = CardQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['rank', 'id']
+        indexes = [
+            models.Index(fields=['column', 'rank', 'id'], name='card_column_rank_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.rank or not self.column_id:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            # New cards go to the end of their column
+            lock(Column, self.column_id)
+            self.rank = get_rank(Card.objects.filter(column_id=self.column_id).exclude(pk=self.pk))
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.name}'
@@ -67,13 +227,54 @@ class MarkCard(models.Model):
     mark = models.ForeignKey(Mark, related_name='attached_mark', on_delete=models.CASCADE)
     card = models.ForeignKey(Card, related_name='attached_to_card', on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mark', 'card'], name='unique_mark_card'),
+        ]
+
     def __str__(self):
         return f'{self.mark} - {self.card}'
 
 
 class File(models.Model):
-    name = models.FileField(upload_to='board_files')
+    name = models.FileField(upload_to='board_files', storage=blob_storage)
     card = models.ForeignKey(Card, related_name='file', on_delete=models.CASCADE)
+    # The stored name is the hash of the content, this is the name the file was uploaded with
+    original_name = models.CharField(max_length=255, blank=True)
+
+    objects = CardRelatedQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # Taken before storage renames the upload
+        if not self.original_name and self.name and not self.name._committed:
+            self.original_name = os.path.basename(self.name.name)[:255]
+        super().save(*args, **kwargs)
+
+
+class Blob(models.Model):
+    # A file in boards.storage.ContentAddressedStorage and the number of fields that point to it
+    name = models.CharField(max_length=100, unique=True)
+    references = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} ({self.references})'
+
+
+class FileUpload(models.Model):
+    # Chunked upload in progress, the data is kept in a part file (boards.uploads) until finalized
+    card = models.ForeignKey(Card, related_name='uploads', on_delete=models.CASCADE)
+    author = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    # Hex SHA-256 of the whole file, checked when the upload is finalized
+    checksum = models.CharField(max_length=64)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    objects = CardRelatedQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.name} - {self.offset}/{self.size}'
 
 
 class CheckList(models.Model):
@@ -81,6 +282,8 @@ class CheckList(models.Model):
     done = models.BooleanField(default=False)
     card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='check_list')
 
+    objects = CardRelatedQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -91,6 +294,11 @@ class Comment(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     created_on = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['card', '-created_on'], name='comment_card_created_idx'),
+        ]
+
     def __str__(self):
         return f'{self.card}, {self.text}'
 
@@ -99,6 +307,13 @@ class Favourite(models.Model):
     board = models.ForeignKey(Board, on_delete=models.CASCADE, null=True, blank=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    objects = BoardRelatedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['author', 'board'], name='unique_favourite'),
+        ]
+
     def __str__(self):
         return f'{self.author.email} - {self.board.title}'
 
@@ -107,5 +322,45 @@ class Archive(models.Model):
     board = models.ForeignKey(Board, on_delete=models.CASCADE, null=True, blank=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    objects = BoardRelatedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['author', 'board'], name='unique_archive'),
+        ]
+
     def __str__(self):
         return f'{self.author.email} - {self.board.title}'
+
+
+class Job(models.Model):
+    # Background work queue, run by the run_jobs management command
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    # Dotted path of the function to call with payload as keyword arguments
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # For a running job this is the end of its lease, after which it is picked up again,
+    # for a done one when it finished
+    run_after = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} - {self.status}'
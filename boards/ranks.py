@@ -0,0 +1,91 @@
+from django.db.models import Q
+
+# Columns and cards are ordered by a rank key, compared as a plain string. A key is a
+# fraction in base 36 (the digits after the point), so there is always room for another
+# key between two of them and placing an item only writes that item. Digits and lowercase
+# letters sort the same way in every collation. Keys never end with '0', otherwise nothing
+# would fit between 'a' and 'a0'.
+ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+BASE = len(ALPHABET)
+
+
+class RankConflict(ValueError):
+    # Neighbours with the same key, nothing fits between them until their parent is respread
+    pass
+
+
+def lock(model, pk):
+    # Placing items holds their parent (board or column) row until the transaction ends, so
+    # concurrent placements in it are serialized and can't compute the same key
+    list(model.objects.select_for_update().filter(pk=pk).values_list('pk', flat=True))
+
+
+def rank_between(before=None, after=None):
+    # A key sorting after before and before after, None meaning the start and the end
+    before = before or ''
+    if after is not None and after <= before:
+        raise RankConflict(f'No key between {before!r} and {after!r}')
+    # Going to the end is the usual case (new cards), stepping by one instead of halving the
+    # gap keeps those keys short for longer: 35 of them per extra character instead of about 5
+    last = after is None
+    rank = []
+    i = 0
+    while True:
+        low = ALPHABET.index(before[i]) if i < len(before) else 0
+        high = ALPHABET.index(after[i]) if after is not None and i < len(after) else BASE
+        if last and low < BASE - 1:
+            rank.append(ALPHABET[low + 1])
+            return ''.join(rank)
+        if high - low > 1:
+            rank.append(ALPHABET[(low + high) // 2])
+            return ''.join(rank)
+        rank.append(ALPHABET[low])
+        if high - low == 1:
+            # Anything longer that starts with the lower digit sorts before after
+            after = None
+        i += 1
+
+
+def spread_ranks(count):
+    # count evenly spaced keys, as short as they can be
+    length = 1
+    while BASE ** length <= count:
+        length += 1
+    ranks = []
+    for i in range(1, count + 1):
+        value = BASE ** length * i // (count + 1)
+        digits = []
+        for _ in range(length):
+            value, digit = divmod(value, BASE)
+            digits.append(ALPHABET[digit])
+        ranks.append(''.join(reversed(digits)).rstrip('0'))
+    return ranks
+
+
+def get_rank(siblings, after=None, before=None):
+    # Key for an item placed right after or right before one of its siblings, or at the end.
+    # siblings are the other items of the same board (columns) or column (cards).
+    if after is not None:
+        following = (siblings.filter(Q(rank__gt=after.rank) | Q(rank=after.rank, pk__gt=after.pk))
+                     .order_by('rank', 'pk').values_list('rank', flat=True).first())
+        return rank_between(after.rank, following)
+    if before is not None:
+        preceding = (siblings.filter(Q(rank__lt=before.rank) | Q(rank=before.rank, pk__lt=before.pk))
+                     .order_by('-rank', '-pk').values_list('rank', flat=True).first())
+        return rank_between(preceding, before.rank)
+    last = siblings.order_by('-rank', '-pk').values_list('rank', flat=True).first()
+    return rank_between(last, None)
+
+
+def place(entries, pk, after=None, before=None):
+    # Same as get_rank, on an in-memory list of (rank, pk) in order, which gets the new entry
+    if after is not None:
+        index = next(i for i, entry in enumerate(entries) if entry[1] == after) + 1
+    elif before is not None:
+        index = next(i for i, entry in enumerate(entries) if entry[1] == before)
+    else:
+        index = len(entries)
+    rank = rank_between(entries[index - 1][0] if index else None,
+                        entries[index][0] if index < len(entries) else None)
+    entries.insert(index, (rank, pk))
+    return rank
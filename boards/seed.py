@@ -0,0 +1,210 @@
+import io
+import json
+import random
+import uuid
+from datetime import date, datetime
+from itertools import groupby, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from boards.models import (Blob, Board, BoardAccess, Card, CheckList, Column, Comment, File, Mark, MarkCard,
+                           Members)
+from boards.ranks import spread_ranks
+
+User = get_user_model()
+
+COLORS = ['Red', 'Blue', 'Green', 'Yellow', 'Purple']
+SEED_PASSWORD = 'seed-password'
+SEED_FILE = 'blobs/00/seed.txt'
+DISTRIBUTIONS = ('uniform', 'exponential', 'fixed')
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def get_ranks(parents):
+    # Rank keys for items listed parent by parent, spread within each parent
+    return [rank for _, items in groupby(parents) for rank in spread_ranks(len(list(items)))]
+
+
+def get_defaults(model, fields):
+    # Values of the columns the rows leave out, COPY does not know about Django defaults
+    defaults = {}
+    for field in model._meta.concrete_fields:
+        if field.primary_key or field.attname in fields:
+            continue
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            defaults[field.attname] = timezone.now()
+        else:
+            defaults[field.attname] = field.get_default()
+    return defaults
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class BulkCreateWriter:
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+
+    def insert(self, model, fields, rows):
+        # rows are tuples of values for fields (attnames), the new primary keys are returned
+        pks = []
+        for chunk in chunks(rows, self.batch_size):
+            objects = model.objects.bulk_create([model(**dict(zip(fields, row))) for row in chunk])
+            pks += [obj.pk for obj in objects]
+        return pks
+
+
+class CopyWriter(BulkCreateWriter):
+    # Postgres only. The primary keys are taken from the table's sequence up front, so the
+    # rows can be streamed with COPY and still be pointed to by the next table.
+    def insert(self, model, fields, rows):
+        table = model._meta.db_table
+        defaults = get_defaults(model, fields)
+        columns = ['id', *(model._meta.get_field(field).column for field in fields),
+                   *(model._meta.get_field(field).column for field in defaults)]
+        sql = 'COPY {} ({}) FROM STDIN'.format(
+            connection.ops.quote_name(table), ', '.join(connection.ops.quote_name(column) for column in columns))
+        pks = []
+        with connection.cursor() as cursor:
+            for chunk in chunks(rows, self.batch_size):
+                cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                               [table, len(chunk)])
+                chunk_pks = [row[0] for row in cursor.fetchall()]
+                buffer = io.StringIO()
+                for pk, row in zip(chunk_pks, chunk):
+                    buffer.write('\t'.join(copy_value(value) for value in (pk, *row, *defaults.values())))
+                    buffer.write('\n')
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                pks += chunk_pks
+        return pks
+
+
+def get_writer(batch_size=1000):
+    if connection.vendor == 'postgresql':
+        return CopyWriter(batch_size)
+    return BulkCreateWriter(batch_size)
+
+
+class Seeder:
+    # Generates users and boards full of content with bulk inserts (COPY on Postgres). Signals
+    # are not sent, BoardAccess rows and the Blob reference count are written here instead.
+    # Boards are written a few at a time, each group in its own transaction, so memory stays
+    # bounded by the size of a group whatever the total.
+    def __init__(self, users=1000, boards=20, members=10, columns=20, cards=10, comments=2, marks=5,
+                 checklists=1, files=0.2, marked=0.5, distribution='uniform', seed=0, batch_size=1000,
+                 boards_per_transaction=None, writer=None, progress=None):
+        self.users = users
+        self.boards = boards
+        self.members = members
+        self.columns = columns
+        self.cards = cards
+        self.comments = comments
+        self.marks = marks
+        self.checklists = checklists
+        self.files = files
+        self.marked = marked
+        self.distribution = distribution
+        self.boards_per_transaction = boards_per_transaction or max(1, 100_000 // max(1, columns * cards))
+        self.writer = writer or get_writer(batch_size)
+        self.progress = progress
+        self.rng = random.Random(seed)
+        self.counts = {}
+
+    def size(self, mean):
+        # Number of children of one parent, with the mean asked for
+        if not mean:
+            return 0
+        if self.distribution == 'fixed':
+            return mean
+        if self.distribution == 'exponential':
+            # Mostly small, a few very large ones
+            return min(int(self.rng.expovariate(1 / mean)), mean * 20)
+        return self.rng.randint(0, 2 * mean)
+
+    def insert(self, model, fields, rows):
+        pks = self.writer.insert(model, fields, rows)
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(pks)
+        return pks
+
+    def seed(self):
+        with transaction.atomic():
+            users = self.create_users()
+        for boards in chunks(range(self.boards), self.boards_per_transaction):
+            with transaction.atomic():
+                self.create_boards(users, len(boards))
+            if self.progress:
+                self.progress(self.counts)
+        if self.counts.get('File'):
+            with transaction.atomic():
+                blob, _ = Blob.objects.select_for_update().get_or_create(name=SEED_FILE)
+                blob.references += self.counts['File']
+                blob.save()
+        return self.counts
+
+    def create_users(self):
+        # Hashed once, hashing for every user would take most of the time
+        password = make_password(SEED_PASSWORD)
+        prefix = uuid.uuid4().hex[:8]
+        return self.insert(User, ['email', 'username', 'password'], (
+            (f'{prefix}-{i}@example.com', f'{prefix}-{i}', password) for i in range(self.users)))
+
+    def create_boards(self, users, count):
+        rng = self.rng
+        owners = [rng.choice(users) for _ in range(count)]
+        boards = self.insert(Board, ['title', 'owner_id'], ((f'Board {i}', owner) for i, owner in enumerate(owners)))
+        people = {}
+        for board, owner in zip(boards, owners):
+            invited = set(rng.sample(users, min(self.size(self.members), len(users)))) - {owner}
+            people[board] = [owner, *sorted(invited)]
+        self.insert(Members, ['board_id', 'member_id'], (
+            (board, user) for board, team in people.items() for user in team[1:]))
+        self.insert(BoardAccess, ['board_id', 'user_id', 'role'], (
+            (board, user, BoardAccess.MEMBER if i else BoardAccess.OWNER)
+            for board, team in people.items() for i, user in enumerate(team)))
+
+        mark_boards = [board for board in boards for _ in range(self.marks)]
+        marks = {}
+        for board, mark in zip(mark_boards, self.insert(Mark, ['board_id', 'name', 'color'], (
+                (board, f'Mark {i % self.marks}', rng.choice(COLORS)) for i, board in enumerate(mark_boards)))):
+            marks.setdefault(board, []).append(mark)
+
+        column_boards = [board for board in boards for _ in range(max(1, self.size(self.columns)))]
+        columns = self.insert(Column, ['board_id', 'name', 'rank'], (
+            (board, f'Column {i}', rank)
+            for i, (board, rank) in enumerate(zip(column_boards, get_ranks(column_boards)))))
+        card_columns = [column for column in columns for _ in range(self.size(self.cards))]
+        board_of = dict(zip(columns, column_boards))
+        cards = self.insert(Card, ['column_id', 'name', 'description', 'rank'], (
+            (column, f'Card {i}', 'Generated card', rank)
+            for i, (column, rank) in enumerate(zip(card_columns, get_ranks(card_columns)))))
+        card_boards = [board_of[column] for column in card_columns]
+
+        self.insert(Comment, ['card_id', 'author_id', 'text'], (
+            (card, rng.choice(people[board]), 'Generated comment')
+            for card, board in zip(cards, card_boards) for _ in range(self.size(self.comments))))
+        self.insert(CheckList, ['card_id', 'name', 'done'], (
+            (card, f'Checklist {i}', rng.random() < 0.5)
+            for card in cards for i in range(self.size(self.checklists))))
+        self.insert(MarkCard, ['card_id', 'mark_id'], (
+            (card, rng.choice(marks[board]))
+            for card, board in zip(cards, card_boards) if self.marks and rng.random() < self.marked))
+        self.insert(File, ['card_id', 'name', 'original_name'], (
+            (card, SEED_FILE, 'seed.txt') for card in cards if rng.random() < self.files))
@@ -0,0 +1,151 @@
+from django.db import transaction
+from django.db.models import F
+
+from boards.events import publish_board_event
+from boards.jobs import enqueue
+from boards.models import (Board, BoardAccess, BoardChange, Card, CheckList, Column, Comment, File, FileUpload, Job,
+                           MarkCard, Members)
+from boards.ranks import lock, spread_ranks
+from boards.storage import release
+
+# Ranked models by name, with the parent model and field their items are ordered within
+RANKED = {
+    'column': (Column, Board, 'board_id'),
+    'card': (Card, Column, 'column_id'),
+}
+
+# Models attached to a card, they belong to whichever board the card is on
+CARD_CHILDREN = (CheckList, Comment, File, MarkCard)
+
+
+def refresh_board_access(board_id, user_id):
+    # Recomputes the BoardAccess row of one user on one board, owner wins over member
+    if Board.objects.filter(pk=board_id, owner_id=user_id).exists():
+        role = BoardAccess.OWNER
+    elif Members.objects.filter(board_id=board_id, member_id=user_id).exists():
+        role = BoardAccess.MEMBER
+    else:
+        BoardAccess.objects.filter(board_id=board_id, user_id=user_id).delete()
+        return
+    BoardAccess.objects.update_or_create(board_id=board_id, user_id=user_id, defaults={'role': role})
+
+
+def rebuild_board_access(batch_size=1000):
+    with transaction.atomic():
+        BoardAccess.objects.all().delete()
+        owners = set(Board.objects.exclude(owner=None).values_list('pk', 'owner_id'))
+        members = set(Members.objects.values_list('board_id', 'member_id')) - owners
+        rows = [BoardAccess(board_id=board_id, user_id=user_id, role=BoardAccess.OWNER)
+                for board_id, user_id in owners]
+        rows += [BoardAccess(board_id=board_id, user_id=user_id, role=BoardAccess.MEMBER)
+                 for board_id, user_id in members]
+        BoardAccess.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def record_board_change(board_id, instance, created=False, deleted=False):
+    model = instance._meta.model_name
+    with transaction.atomic():
+        # The UPDATE locks the board row, so concurrent writers get distinct versions
+        if not Board.objects.filter(pk=board_id).update(version=F('version') + 1):
+            return None
+        version = Board.objects.filter(pk=board_id).values_list('version', flat=True).get()
+        changes = BoardChange.objects.filter(board_id=board_id, model=model, object_id=instance.pk)
+        if created or not changes.update(version=version, deleted=deleted):
+            BoardChange.objects.update_or_create(
+                board_id=board_id, model=model, object_id=instance.pk,
+                defaults={'version': version, 'created_version': version, 'deleted': deleted},
+            )
+    if isinstance(instance, Board):
+        instance.version = version
+    publish_board_event(board_id, {'version': version, 'model': model, 'id': instance.pk, 'deleted': deleted})
+    return version
+
+
+def record_board_changes(board_id, model, object_ids, created=False, deleted=False):
+    # record_board_change for many objects of one model, with a single version bump
+    return record_board_change_set(board_id, [(model, object_ids)], created=created, deleted=deleted)
+
+
+def record_board_change_set(board_id, changes, created=False, deleted=False):
+    # Same for (model, object_ids) pairs of several models, still with a single version bump
+    changes = [(model._meta.model_name, object_ids) for model, object_ids in changes if object_ids]
+    if not changes:
+        return None
+    with transaction.atomic():
+        if not Board.objects.filter(pk=board_id).update(version=F('version') + 1):
+            return None
+        version = Board.objects.filter(pk=board_id).values_list('version', flat=True).get()
+        rows = [BoardChange(board_id=board_id, model=model_name, object_id=pk, version=version,
+                            created_version=version, deleted=deleted)
+                for model_name, object_ids in changes for pk in object_ids]
+        # Column names again, see boards.last_seen
+        BoardChange.objects.bulk_create(rows, update_conflicts=True, unique_fields=['board_id', 'model', 'object_id'],
+                                        update_fields=['version', 'deleted', *(['created_version'] if created else [])])
+    for model_name, object_ids in changes:
+        for pk in object_ids:
+            publish_board_event(board_id, {'version': version, 'model': model_name, 'id': pk, 'deleted': deleted})
+    return version
+
+
+def get_card_changes(card_ids):
+    # The cards and everything attached to them, as (model, object_ids) pairs
+    changes = [(Card, list(card_ids))]
+    for model in CARD_CHILDREN:
+        changes.append((model, list(model.objects.filter(card_id__in=card_ids).values_list('pk', flat=True))))
+    return changes
+
+
+def record_cards_moved(card_ids, previous_board_id, board_id):
+    # Cards that left previous_board_id take their children along, they are tombstones there
+    # and new on board_id (None when they no longer belong to a board)
+    if not card_ids or previous_board_id == board_id:
+        return
+    changes = get_card_changes(card_ids)
+    if previous_board_id:
+        record_board_change_set(previous_board_id, changes, deleted=True)
+    if board_id:
+        record_board_change_set(board_id, changes, created=True)
+
+
+def delete_cards(card_ids):
+    # Deletes cards and their children without the per-object signals of a cascade, callers
+    # record the board changes themselves (see get_card_changes)
+    names = list(File.objects.filter(card_id__in=card_ids).values_list('name', flat=True))
+    # Few rows, and their signal removes the part files
+    FileUpload.objects.filter(card_id__in=card_ids).delete()
+    with transaction.atomic():
+        for model in (*CARD_CHILDREN, Card):
+            queryset = model.objects.filter(**{'card_id__in' if model is not Card else 'pk__in': card_ids})
+            queryset._raw_delete(queryset.db)
+        for name in names:
+            release(name)
+
+
+def schedule_rank_rebalance(model, parent_id):
+    # One pending job per board or column is enough, it respreads whatever is there when it runs
+    payload = {'model': model._meta.model_name, 'parent_id': parent_id}
+    if not Job.objects.filter(name='boards.services.rebalance_ranks', payload=payload, status=Job.PENDING).exists():
+        enqueue('boards.services.rebalance_ranks', **payload)
+
+
+def rebalance_ranks(model, parent_id):
+    # Gives the columns of a board, or the cards of a column, short evenly spaced keys in
+    # the order they have. Run as a job once keys get longer than RANK_MAX_LENGTH, and
+    # right away when two neighbours share a key.
+    model, parent_model, parent = RANKED[model]
+    with transaction.atomic():
+        lock(parent_model, parent_id)
+        items = list(model.objects.select_for_update().filter(**{parent: parent_id})
+                     .order_by('rank', 'pk').only('pk', 'rank'))
+        changed = []
+        for item, rank in zip(items, spread_ranks(len(items))):
+            if item.rank != rank:
+                item.rank = rank
+                changed.append(item)
+        model.objects.bulk_update(changed, ['rank'], batch_size=1000)
+        board_id = parent_id if model is Column else (
+            Column.objects.filter(pk=parent_id).values_list('board_id', flat=True).first())
+        if board_id:
+            record_board_changes(board_id, model, [item.pk for item in changed])
+    return len(changed)
@@ -0,0 +1,178 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from boards.models import (Board, BoardAccess, BoardChange, Card, CheckList,
+                           Column, Comment, File, FileUpload, Mark, MarkCard, Members)
+from boards.images import delete_cached_variants, delete_variants
+from boards.jobs import enqueue
+from boards.services import record_board_change, record_cards_moved, refresh_board_access, schedule_rank_rebalance
+from boards.storage import release
+from boards.uploads import delete_part, get_part_path
+
+
+@receiver(pre_save, sender=Board)
+def board_changing(sender, instance, **kwargs):
+    # An uploaded file is committed to storage during save, so check it before
+    instance._background_uploaded = bool(instance.background) and not instance.background._committed
+    instance._previous_background = None
+    update_fields = kwargs.get('update_fields')
+    if instance.pk and (update_fields is None or 'background' in update_fields):
+        instance._previous_background = Board.objects.filter(pk=instance.pk).values_list('background', flat=True).first()
+
+
+@receiver(post_save, sender=Board)
+def board_saved(sender, instance, **kwargs):
+    if getattr(instance, '_background_uploaded', False):
+        enqueue('boards.images.process_board_background', board_id=instance.pk)
+    previous_background = getattr(instance, '_previous_background', None)
+    if previous_background and previous_background != instance.background.name:
+        release(previous_background)
+        transaction.on_commit(partial(delete_cached_variants, previous_background))
+    elif previous_background and getattr(instance, '_background_uploaded', False):
+        # The same content uploaded again, storage took a second reference to the blob
+        release(previous_background)
+    # The owner may have changed, so also refresh whoever was recorded as owner before
+    previous = (BoardAccess.objects.filter(board=instance, role=BoardAccess.OWNER)
+                .exclude(user_id=instance.owner_id).values_list('user_id', flat=True))
+    for user_id in list(previous):
+        refresh_board_access(instance.pk, user_id)
+    if instance.owner_id:
+        refresh_board_access(instance.pk, instance.owner_id)
+
+
+@receiver(pre_delete, sender=Board)
+def board_deleting(sender, instance, origin=None, **kwargs):
+    # Sent before any row of the cascade is deleted, so the post_delete receivers of its content
+    # know the board goes too. Kept on the object that started the delete, shared by all signals.
+    if origin is not None:
+        origin._deleted_boards = getattr(origin, '_deleted_boards', set()) | {instance.pk}
+
+
+def is_board_deleted(board_id, origin):
+    # board_deleted throws away the access and change rows of the board anyway
+    return board_id in getattr(origin, '_deleted_boards', ())
+
+
+@receiver(post_delete, sender=Board)
+def board_deleted(sender, instance, **kwargs):
+    # Members and content deleted in the cascade write these rows again before the board goes
+    BoardAccess.objects.filter(board_id=instance.pk).delete()
+    BoardChange.objects.filter(board_id=instance.pk).delete()
+    release(instance.background.name)
+    transaction.on_commit(partial(delete_variants, (instance.background_variants or {}).get('images', [])))
+    transaction.on_commit(partial(delete_cached_variants, instance.background.name))
+
+
+@receiver(pre_save, sender=Members)
+def members_changing(sender, instance, **kwargs):
+    instance._previous_access = None
+    if instance.pk:
+        instance._previous_access = Members.objects.filter(pk=instance.pk).values_list('board_id', 'member_id').first()
+
+
+@receiver(post_save, sender=Members)
+def members_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_access', None)
+    if previous and previous != (instance.board_id, instance.member_id):
+        refresh_board_access(*previous)
+    refresh_board_access(instance.board_id, instance.member_id)
+
+
+@receiver(post_delete, sender=Members)
+def members_deleted(sender, instance, origin=None, **kwargs):
+    if not is_board_deleted(instance.board_id, origin):
+        refresh_board_access(instance.board_id, instance.member_id)
+
+
+@receiver(post_delete, sender=FileUpload)
+def file_upload_deleted(sender, instance, **kwargs):
+    # The path is taken now, a deleted instance loses its pk
+    transaction.on_commit(partial(delete_part, get_part_path(instance)))
+
+
+@receiver(post_delete, sender=File)
+def file_deleted(sender, instance, **kwargs):
+    release(instance.name.name)
+
+
+@receiver(post_save, sender=Column)
+@receiver(post_save, sender=Card)
+def ranked_saved(sender, instance, raw=False, **kwargs):
+    parent_id = instance.board_id if sender is Column else instance.column_id
+    if not raw and parent_id and len(instance.rank) > settings.RANK_MAX_LENGTH:
+        schedule_rank_rebalance(sender, parent_id)
+
+
+# Board change versions
+def get_card_board_id(card_id):
+    return Card.objects.filter(pk=card_id).values_list('column__board', flat=True).first()
+
+
+def get_board_id(instance):
+    if isinstance(instance, (Column, Members, Mark)):
+        return instance.board_id
+    if isinstance(instance, Card):
+        return Column.objects.filter(pk=instance.column_id).values_list('board', flat=True).first()
+    return get_card_board_id(instance.card_id)
+
+
+def content_changing(sender, instance, raw=False, **kwargs):
+    # A card, column or member moved to another board has to disappear from the previous one
+    instance._previous_board_id = None
+    if raw or not instance.pk:
+        return
+    if sender is Card:
+        instance._previous_board_id = get_card_board_id(instance.pk)
+    else:
+        instance._previous_board_id = sender.objects.filter(pk=instance.pk).values_list('board', flat=True).first()
+
+
+def content_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    board_id = instance.pk if sender is Board else get_board_id(instance)
+    previous_board_id = getattr(instance, '_previous_board_id', None)
+    if previous_board_id and previous_board_id != board_id:
+        if sender is Card:
+            # Recorded with its comments, checklists, files and marks on both boards
+            record_cards_moved([instance.pk], previous_board_id, board_id)
+            return
+        record_board_change(previous_board_id, instance, deleted=True)
+        if sender is Column:
+            record_cards_moved(list(instance.card_column.values_list('pk', flat=True)), previous_board_id, board_id)
+    if board_id:
+        record_board_change(board_id, instance, created=created)
+
+
+def content_deleted(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Board):
+        # All of it belongs to that board, no need to look the board up
+        return
+    board_id = get_board_id(instance)
+    if board_id and not is_board_deleted(board_id, origin):
+        record_board_change(board_id, instance, deleted=True)
+
+
+@receiver(pre_delete, sender=Column)
+def column_deleting(sender, instance, origin=None, **kwargs):
+    # The cards are kept with no column by a bulk update that sends no signals
+    if not isinstance(origin, Board):
+        instance._card_ids = list(instance.card_column.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Column)
+def column_deleted(sender, instance, origin=None, **kwargs):
+    if not is_board_deleted(instance.board_id, origin):
+        record_cards_moved(getattr(instance, '_card_ids', []), instance.board_id, None)
+
+
+post_save.connect(content_saved, sender=Board, dispatch_uid='board_change_board')
+for model in (Members, Column, Card):
+    pre_save.connect(content_changing, sender=model, dispatch_uid=f'board_change_{model._meta.model_name}')
+for model in (Members, Column, Mark, Card, CheckList, Comment, MarkCard, File):
+    post_save.connect(content_saved, sender=model, dispatch_uid=f'board_change_{model._meta.model_name}')
+    post_delete.connect(content_deleted, sender=model, dispatch_uid=f'board_change_{model._meta.model_name}')
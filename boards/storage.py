@@ -0,0 +1,81 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # Every file is stored once under the SHA-256 of its content, whatever name it was uploaded with.
+    # Blob rows count the references to each file, saving takes a reference and release() drops it.
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content is hashed in _save
+        return name
+
+    def get_blob_name(self, digest, extension):
+        return f'blobs/{digest[:2]}/{digest}{extension}'
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()[:10]
+        directory = self.path('blobs')
+        os.makedirs(directory, exist_ok=True)
+
+        # Hashed while it is copied, so the upload is read only once
+        checksum = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+            for chunk in content.chunks():
+                checksum.update(chunk)
+                file.write(chunk)
+        try:
+            name = self.get_blob_name(checksum.hexdigest(), extension)
+            with transaction.atomic():
+                # Holding the row lock keeps collect_blob from deleting the file under us
+                acquire(name)
+                if not self.exists(name):
+                    os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(file.name, self.file_permissions_mode)
+                    os.replace(file.name, self.path(name))
+        finally:
+            if os.path.exists(file.name):
+                os.remove(file.name)
+        return name
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def acquire(name):
+    from boards.models import Blob
+
+    blobs = Blob.objects.filter(name=name)
+    if blobs.update(references=F('references') + 1):
+        return
+    try:
+        with transaction.atomic():
+            Blob.objects.create(name=name, references=1)
+    except IntegrityError:
+        # Created by a concurrent upload of the same content
+        blobs.update(references=F('references') + 1)
+
+
+def release(name):
+    from boards.models import Blob
+
+    if name and Blob.objects.filter(name=name, references__gt=0).update(references=F('references') - 1):
+        transaction.on_commit(lambda: collect_blob(name))
+
+
+def collect_blob(name):
+    from boards.models import Blob
+
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(name=name, references=0).first()
+        if blob is None:
+            return False
+        blob_storage.delete(name)
+        blob.delete()
+    return True
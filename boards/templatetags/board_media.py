@@ -0,0 +1,17 @@
+from django import template
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from boards.images import get_background_key
+
+register = template.Library()
+
+
+@register.filter
+def background_url(board):
+    # Media is only served by BoardBackgroundAPIView, which checks board access. Versioned
+    # like BoardSerializer.get_background_url, so browsers can cache it for good.
+    if not board or not board.background:
+        return ''
+    url = reverse('board_api_background', kwargs={'pk': board.pk})
+    return f'{url}?{urlencode({"v": get_background_key(board)})}'
@@ -1,11 +1,53 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from PIL import Image as PILImage
+from prometheus_client import REGISTRY
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.reverse import reverse_lazy
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
+from django.core import mail
 from django.core.files.uploadedfile import SimpleUploadedFile
-
+from django.core.mail import send_mail
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from boards.api.cache import RequestCache
+from boards.api.serializers import BoardSerializer
 from boards.api.views import BoardListAPIView
-from boards.models import Board, Members, Column, Card, CheckList, Archive, File, Comment, Mark, Favourite
+from boards.asgi import BoardEventsApplication
+from boards.benchmark import SCENARIOS, compare, run
+from boards.events import EventQueue, broker
+from boards.jobs import enqueue, run_pending_jobs
+from boards.last_seen import last_seen_recorder
+from boards.management.commands.serve import APPLICATIONS, Command as ServeCommand, ServerApplication, clear_metrics
+from boards.ranks import RankConflict, place, rank_between, spread_ranks
+from boards.models import Board, Members, Column, Card, CheckList, Archive, File, Comment, Mark, Favourite, MarkCard, BoardAccess, BoardChange, LastSeen, Job, FileUpload, Blob
+from boards.seed import Seeder, copy_value
+from boards.uploads import UploadError, write_chunk
+from main.db.pool import ConnectionPool, PoolTimeout
+from main.db.router import ReplicaRouter, check_shared_cache, is_pinned_to_primary, lag_checks, read_from_replica, replica_alias
+from main.timing import endpoint_stats
 
 User = get_user_model()
 
@@ -79,6 +121,951 @@ class BoardTestView(APITestCase):
         self.assertEqual(request.status_code, status.HTTP_204_NO_CONTENT)
 
 
+@override_settings(LAST_SEEN_FLUSH_INTERVAL=3600)
+class BoardTreeQueryTest(APITestCase):
+
+    def setUp(self):
+        last_seen_recorder.clear()
+        cache.clear()
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.user2 = User(email='b@c.com', password='12345678', username='bc')
+        self.user2.save()
+        self.board = create_board_instance(self)
+        Members(member=self.user2, board=self.board).save()
+        self.mark = Mark(board=self.board, name='Some Name', color='Blue')
+        self.mark.save()
+
+    def fill_column(self, cards):
+        column = Column(name='Column', board=self.board)
+        column.save()
+        for i in range(cards):
+            card = Card(name=f'Card {i}', description='descr', column=column)
+            card.save()
+            Comment(text='Some text', card=card, author=self.user1).save()
+            MarkCard(mark=self.mark, card=card).save()
+            File(name='board_files/some.txt', card=card).save()
+            CheckList(name='Some checklist', card=card).save()
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            request = self.client.get(reverse_lazy('board_api_detail', kwargs={'pk': self.board.pk}))
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), request.data
+
+    def test_query_count_does_not_grow_with_board(self):
+        self.client.force_authenticate(user=self.user1)
+        self.fill_column(cards=1)
+        small_count, _ = self.count_queries()
+
+        for _ in range(4):
+            self.fill_column(cards=5)
+        big_count, data = self.count_queries()
+
+        self.assertEqual(small_count, big_count)
+        self.assertEqual(len(data['columns']), 5)
+        card = data['columns'][1]['cards'][0]
+        self.assertEqual(len(card['comments']), 1)
+        self.assertEqual(len(card['marks']), 1)
+        self.assertEqual(len(card['files']), 1)
+        self.assertEqual(len(card['checklists']), 1)
+        self.assertEqual(len(data['members']), 1)
+
+
+class QueryPlanTest(APITestCase):
+    # The hot lookups have to be served by an index, whatever the size of the tables
+
+    def setUp(self):
+        self.user1 = User(email='a@b.com', password='12345678', activation_code='code')
+        self.user1.save()
+        users = User.objects.bulk_create(
+            User(email=f'user{i}@b.com', username=f'user{i}', password='12345678') for i in range(50))
+        self.board = create_board_instance(self)
+        boards = Board.objects.bulk_create(Board(title=f'Board {i}', owner=self.user1) for i in range(50))
+        column = Column.objects.create(name='Column', board=self.board)
+        self.card = Card.objects.create(name='Card', description='descr', column=column)
+        self.mark = Mark.objects.create(board=self.board, name='Some Name', color='Blue')
+        Members.objects.bulk_create(Members(member=user, board=board) for user, board in zip(users, boards))
+        Favourite.objects.bulk_create(Favourite(author=user, board=board) for user, board in zip(users, boards))
+        Archive.objects.bulk_create(Archive(author=user, board=board) for user, board in zip(users, boards))
+        LastSeen.objects.bulk_create(LastSeen(user=user, board=board) for user in users for board in boards[:5])
+        Comment.objects.bulk_create(Comment(text='Some text', card=self.card, author=user) for user in users)
+
+    def assertUsesIndex(self, queryset, ordered=False):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tiny test tables are cheaper to scan, make the planner show what it would do at scale
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+                cursor.execute('RESET enable_seqscan')
+                self.assertNotIn('Seq Scan', plan)
+                if ordered:
+                    self.assertNotIn('Sort', plan)
+            else:
+                plan = queryset.explain()
+                self.assertNotRegex(plan, r'\bSCAN\b')
+                if ordered:
+                    self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_hot_queries_use_indexes(self):
+        self.assertUsesIndex(LastSeen.objects.filter(user=self.user1).order_by('-seen')[:6], ordered=True)
+        self.assertUsesIndex(Favourite.objects.filter(author=self.user1, board=self.board))
+        self.assertUsesIndex(Archive.objects.filter(author=self.user1, board=self.board))
+        self.assertUsesIndex(Members.objects.filter(member=self.user1, board=self.board))
+        self.assertUsesIndex(MarkCard.objects.filter(mark=self.mark, card=self.card))
+        self.assertUsesIndex(Comment.objects.filter(card=self.card).order_by('-created_on'), ordered=True)
+        self.assertUsesIndex(User.objects.filter(activation_code='code'))
+        self.assertUsesIndex(Column.objects.filter(board=self.board), ordered=True)
+        self.assertUsesIndex(Card.objects.filter(column_id=self.card.column_id), ordered=True)
+
+    def test_pairs_are_unique(self):
+        self.client.force_authenticate(user=self.user1)
+        for _ in range(2):
+            request = self.client.post(reverse_lazy('favourite_api'), data={'board': self.board.pk, 'author': self.user1.pk})
+            self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Favourite.objects.filter(author=self.user1, board=self.board).count(), 1)
+
+
+@override_settings(LAST_SEEN_FLUSH_INTERVAL=3600)
+class BenchmarkTest(APITestCase):
+
+    def test_seed(self):
+        counts = Seeder(users=20, boards=3, members=4, columns=2, cards=3, seed=1).seed()
+        self.assertEqual(counts['User'], 20)
+        self.assertEqual(Board.objects.count(), 3)
+        self.assertEqual(BoardAccess.objects.count(), 3 + Members.objects.count())
+        self.assertEqual(Blob.objects.get().references, File.objects.count())
+        self.assertEqual(counts, Seeder(users=20, boards=3, members=4, columns=2, cards=3, seed=1).seed())
+
+    def test_seed_boards_command(self):
+        out = StringIO()
+        call_command('seed_boards', users=30, boards=5, columns=3, cards=4, distribution='exponential',
+                     batch_size=7, stdout=out)
+        self.assertEqual(Board.objects.count(), 5)
+        self.assertEqual(Card.objects.filter(column__board__in=Board.objects.all()).count(), Card.objects.count())
+        self.assertEqual(BoardAccess.objects.filter(role=BoardAccess.OWNER).count(), 5)
+        self.assertIn(f'{Card.objects.count()} Card', out.getvalue())
+
+    def test_copy_values(self):
+        self.assertEqual([copy_value(value) for value in (None, True, {'a': 1}, 'a\tb\\')],
+                         ['\\N', 't', '{"a": 1}', 'a\\tb\\\\'])
+
+    def test_scenarios(self):
+        Seeder(users=20, boards=3, members=4, columns=2, cards=3).seed()
+        results = run(list(SCENARIOS), users=3, requests=4, warmup=1)
+        for name, result in results.items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertGreater(result['queries'], 0, name)
+
+        slower = {name: dict(result, p95=result['p95'] * 2) for name, result in results.items()}
+        self.assertEqual(compare(results, results), [])
+        self.assertEqual(len(compare(results, slower)), len(results))
+
+@override_settings(LAST_SEEN_FLUSH_INTERVAL=3600)
+class BoardSnapshotTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+        self.board = create_board_instance(self)
+        self.column = create_column_instance(self, self.board)
+        self.url = reverse_lazy('board_api_detail', kwargs={'pk': self.board.pk})
+
+    def test_conditional_get(self):
+        request = self.client.get(self.url)
+        etag = request['ETag']
+        request = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(request.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(request['ETag'], etag)
+
+        create_card_instance(self, self.column)
+        request = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(request['ETag'], etag)
+        self.assertEqual(len(request.data['columns'][0]['cards']), 1)
+
+    def test_repeat_reads_skip_serialization(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as second:
+            request = self.client.get(self.url)
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(request.data['columns'][0]['id'], self.column.pk)
+        # board row and permission check only
+        self.assertEqual(len(second.captured_queries), 2)
+        self.assertLess(len(second.captured_queries), len(first.captured_queries))
+
+
+class BoardBackgroundTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root, BOARD_BACKGROUND_WIDTHS=[32, 64, 256],
+                                     BOARD_BACKGROUND_CACHE_DIR=os.path.join(self.media_root, 'variant_cache'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+
+    def create_image(self, size=(128, 96)):
+        buffer = BytesIO()
+        PILImage.new('RGBA', size, (255, 0, 0, 128)).save(buffer, 'PNG')
+        return SimpleUploadedFile('background.png', buffer.getvalue(), content_type='image/png')
+
+    def test_upload_is_processed_by_job(self):
+        request = self.client.post(reverse_lazy('board_api'), {'title': 'Board', 'background': self.create_image()})
+        self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        board = Board.objects.get()
+        self.assertRegex(board.background.name, r'^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(Job.objects.get().status, Job.PENDING)
+
+        call_command('run_jobs', '--once', stdout=StringIO())
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+        board.refresh_from_db()
+        variants = board.background_variants['images']
+        self.assertEqual(sorted({variant['width'] for variant in variants}), [32, 64, 128])
+        self.assertEqual({variant['format'] for variant in variants}, {'jpeg', 'webp'})
+
+        data = self.client.get(reverse_lazy('board_api_detail', kwargs={'pk': board.pk})).data
+        self.assertIn('?w=128&format=jpeg&v=', data['background'])
+        self.assertEqual(len(data['background_variants']), 6)
+
+    def test_variant_url(self):
+        self.client.post(reverse_lazy('board_api'), {'title': 'Board', 'background': self.create_image()})
+        board = Board.objects.get()
+        url = reverse_lazy('board_api_background', kwargs={'pk': board.pk})
+
+        # Before the worker ran the original is sent and the variant is rendered by a job
+        request = self.client.get(url, {'w': 40}, HTTP_ACCEPT='image/webp')
+        self.assertEqual((request['Content-Type'], request['Cache-Control']), ('image/png', 'private, no-cache'))
+        self.client.get(url, {'w': 50}, HTTP_ACCEPT='image/webp')
+        self.assertEqual(Job.objects.filter(name='boards.images.render_cached_variant').count(), 1)
+        run_pending_jobs()
+        stem = os.path.splitext(board.background.name)[0]
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'variant_cache', f'{stem}-64.webp')))
+
+        request = self.client.get(url, {'w': 1000, 'format': 'jpeg'})
+        self.assertEqual(request['Content-Type'], 'image/jpeg')
+        self.assertEqual(PILImage.open(BytesIO(b''.join(request.streaming_content))).width, 128)
+
+        # Served from the cache while the variants are out of date
+        Board.objects.filter(pk=board.pk).update(background_variants={})
+        request = self.client.get(url, {'w': 40}, HTTP_ACCEPT='image/webp')
+        self.assertEqual(request['Content-Type'], 'image/webp')
+        self.assertEqual(PILImage.open(BytesIO(b''.join(request.streaming_content))).width, 64)
+
+    def test_cache_is_pruned(self):
+        self.client.post(reverse_lazy('board_api'), {'title': 'Board', 'background': self.create_image()})
+        board = Board.objects.get()
+        enqueue('boards.images.render_cached_variant', board_id=board.pk, width=64, extension='webp')
+        run_pending_jobs()
+        directory = os.path.join(self.media_root, 'variant_cache', os.path.dirname(board.background.name))
+        self.assertEqual(len(os.listdir(directory)), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            board.background = self.create_image((100, 50))
+            board.save()
+        self.assertEqual(os.listdir(directory), [])
+
+        enqueue('boards.images.render_cached_variant', board_id=board.pk, width=64, extension='jpeg')
+        run_pending_jobs()
+        directory = os.path.join(self.media_root, 'variant_cache', os.path.dirname(board.background.name))
+        self.assertEqual(len(os.listdir(directory)), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            board.delete()
+        self.assertEqual(os.listdir(directory), [])
+
+    @override_settings(BOARD_BACKGROUND_MAX_PIXELS=100)
+    def test_too_large_upload_is_rejected(self):
+        request = self.client.post(reverse_lazy('board_api'), {'title': 'Board', 'background': self.create_image()})
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Board.objects.exists())
+
+    def test_failed_job_is_retried(self):
+        board = Board(title='Board', owner=self.user1, background='board_background/missing.png')
+        board.save()
+        job = enqueue('boards.images.process_board_background', board_id=board.pk)
+        with self.assertLogs('boards.jobs', 'ERROR'):
+            run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn('FileNotFoundError', job.error)
+
+    def test_job_of_a_dead_worker_is_not_retried_forever(self):
+        job = enqueue('boards.images.process_board_background', board_id=0)
+        # Claimed by workers that died, the lease ran out on the last attempt
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, attempts=settings.JOB_MAX_ATTEMPTS,
+                                             run_after=timezone.now())
+        with self.assertLogs('boards.jobs', 'ERROR'):
+            self.assertEqual(run_pending_jobs(), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)
+
+    @override_settings(JOB_KEEP_DONE=60)
+    def test_done_jobs_are_deleted(self):
+        old, recent = (enqueue('boards.images.process_board_background', board_id=0) for _ in range(2))
+        run_pending_jobs()
+        Job.objects.filter(pk=old.pk).update(run_after=timezone.now() - timedelta(seconds=61))
+        call_command('run_jobs', '--once', stdout=StringIO())
+        self.assertEqual(list(Job.objects.values_list('pk', flat=True)), [recent.pk])
+
+
+class MediaServingTest(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+        card = create_card_instance(self, create_column_instance(self, create_board_instance(self)))
+        self.file = File(card=card, name=SimpleUploadedFile('notes.txt', b'0123456789'))
+        self.file.save()
+        self.url = reverse_lazy('file_api_download', kwargs={'pk': self.file.pk})
+
+    def test_range_and_conditional_requests(self):
+        request = self.client.get(self.url)
+        self.assertEqual(b''.join(request.streaming_content), b'0123456789')
+        self.assertIn('immutable', request['Cache-Control'])
+        self.assertEqual(request['Content-Disposition'], 'attachment; filename="notes.txt"; filename*=UTF-8\'\'notes.txt')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=request['ETag']).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        request = self.client.get(self.url, HTTP_RANGE='bytes=2-4')
+        self.assertEqual(request.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(request['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(b''.join(request.streaming_content), b'234')
+        self.assertEqual(b''.join(self.client.get(self.url, HTTP_RANGE='bytes=-3').streaming_content), b'789')
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=20-').status_code,
+                         status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        # A stale If-Range gets the whole file
+        request = self.client.get(self.url, HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"old"')
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+
+    def test_download_name(self):
+        self.file.original_name = 'отчёт "1".txt'
+        self.file.save()
+        request = self.client.get(self.url)
+        self.assertEqual(request['Content-Disposition'],
+                         'attachment; filename=" _1_.txt"; filename*=UTF-8\'\'%D0%BE%D1%82%D1%87%D1%91%D1%82%20%221%22.txt')
+
+    def test_html_pages_link_the_checked_background(self):
+        board = Board.objects.get(owner=self.user1)
+        board.background = SimpleUploadedFile('a.png', b'png')
+        board.save()
+        self.client.force_login(self.user1)
+        response = self.client.get(reverse_lazy('board_detail', kwargs={'pk': board.pk}))
+        self.assertContains(response, reverse_lazy('board_api_background', kwargs={'pk': board.pk}))
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect')
+    def test_transfer_is_offloaded(self):
+        request = self.client.get(self.url)
+        self.assertEqual(request['X-Accel-Redirect'], f'/protected-media/{self.file.name.name}')
+        self.assertEqual(request.content, b'')
+
+    def test_requires_board_access(self):
+        other = User(email='b@c.com', password='12345678', username='bc')
+        other.save()
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class StaticFilesTest(APITestCase):
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+
+    def test_collected_files_are_hashed_and_compressed(self):
+        storage = import_string(settings.STATICFILES_STORAGE)(location=self.static_root)
+        source = FileSystemStorage(location=self.static_root)
+        source.save('board.css', ContentFile('.board { color: red; }\n' * 100))
+        list(storage.post_process({'board.css': (source, 'board.css')}))
+
+        name = storage.stored_name('board.css')
+        self.assertRegex(name, r'^board\.[0-9a-f]{12}\.css$')
+        for extension in ('', '.gz', '.br'):
+            self.assertTrue(os.path.exists(os.path.join(self.static_root, name + extension)))
+
+
+class ServerTest(APITestCase):
+    def test_readiness(self):
+        request = self.client.get(reverse_lazy('ready'))
+        self.assertEqual((request.status_code, request.json()), (status.HTTP_200_OK, {'status': 'ready'}))
+
+    def test_server_config(self):
+        command = ServeCommand()
+        options = command.get_options({'asgi': False, 'bind': '127.0.0.1:9000', 'workers': 4, 'threads': 8,
+                                       'no_preload': False})
+        cfg = ServerApplication(APPLICATIONS['wsgi'], options).cfg
+        self.assertEqual((cfg.workers, cfg.threads, cfg.worker_class_str), (4, 8, 'gthread'))
+        self.assertTrue(cfg.preload_app)
+        self.assertEqual(cfg.address, [('127.0.0.1', 9000)])
+
+        options = command.get_options({'asgi': True, 'bind': '127.0.0.1:9000', 'workers': 2, 'threads': 1,
+                                       'no_preload': True})
+        cfg = ServerApplication(APPLICATIONS['asgi'], options).cfg
+        self.assertEqual(cfg.worker_class_str, 'uvicorn.workers.UvicornWorker')
+        self.assertFalse(cfg.preload_app)
+
+    def test_clear_metrics_keeps_job_worker_files(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ('histogram_serve-12.db', 'gauge_livesum_serve-13.db', 'histogram_run_jobs-14.db'):
+            open(os.path.join(directory, name), 'w').close()
+        with override_settings(METRICS_DIR=directory, PROCESS_COMMAND='serve'):
+            clear_metrics()
+        self.assertEqual(os.listdir(directory), ['histogram_run_jobs-14.db'])
+
+    @override_settings(BOARD_EVENTS_NOTIFY=False)
+    def test_asgi_workers_need_notify(self):
+        with self.assertRaisesMessage(CommandError, 'BOARD_EVENTS_NOTIFY'):
+            call_command('serve', '--asgi', '--workers', '2')
+
+    @override_settings(MEDIA_SENDFILE='', METRICS_DIR='')
+    def test_asgi_warns_without_sendfile(self):
+        stderr = StringIO()
+        with mock.patch.object(ServerApplication, 'run'):
+            call_command('serve', '--asgi', '--workers', '1', stderr=stderr)
+        self.assertIn('MEDIA_SENDFILE', stderr.getvalue())
+        stderr = StringIO()
+        with mock.patch.object(ServerApplication, 'run'), override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            call_command('serve', '--asgi', '--workers', '1', stderr=stderr)
+        self.assertEqual(stderr.getvalue(), '')
+
+
+@override_settings(LAST_SEEN_FLUSH_INTERVAL=3600)
+class QueryBudgetTest(APITestCase):
+
+    def setUp(self):
+        endpoint_stats.clear()
+        cache.clear()
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.board = create_board_instance(self)
+        self.client.force_authenticate(user=self.user1)
+
+    def test_requests_are_timed_per_view(self):
+        for _ in range(2):
+            request = self.client.get(reverse_lazy('board_api_detail', kwargs={'pk': self.board.pk}))
+        self.assertRegex(request['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, '
+                                                     r'render;dur=[\d.]+, total;dur=')
+        stats = endpoint_stats.snapshot()['BoardDetailUpdateDeleteAPIView.get']
+        self.assertEqual(stats['count'], 2)
+        self.assertGreater(stats['queries']['p50'], 0)
+        self.assertEqual(stats['size']['max'], len(request.content))
+
+    def test_serializers_are_timed(self):
+        to_representation = BoardSerializer.to_representation
+
+        def slow_to_representation(serializer, instance):
+            time.sleep(0.05)
+            return to_representation(serializer, instance)
+
+        with mock.patch.object(BoardSerializer, 'to_representation', slow_to_representation):
+            request = self.client.get(reverse_lazy('board_api_detail', kwargs={'pk': self.board.pk}))
+        self.assertRegex(request['Server-Timing'], r'serialize;dur=([5-9]\d|\d{3,})\.')
+        stats = endpoint_stats.snapshot()['BoardDetailUpdateDeleteAPIView.get']
+        self.assertGreaterEqual(stats['serialize']['max'], 50)
+        self.assertLess(stats['render']['max'], 50)
+
+    @override_settings(REQUEST_QUERY_BUDGET=0)
+    def test_requests_over_budget_are_logged(self):
+        with self.assertLogs('main.timing', 'WARNING') as logs:
+            self.client.get(reverse_lazy('board_api_detail', kwargs={'pk': self.board.pk}))
+        self.assertIn('BoardDetailUpdateDeleteAPIView.get', logs.output[0])
+
+    def test_stats_are_staff_only(self):
+        self.client.get(reverse_lazy('board_api'))
+        self.assertEqual(self.client.get(reverse_lazy('endpoint_stats')).status_code, status.HTTP_403_FORBIDDEN)
+        self.user1.is_staff = True
+        self.user1.save()
+        self.client.force_login(self.user1)
+        request = self.client.get(reverse_lazy('endpoint_stats'))
+        self.assertIn('BoardListAPIView.get', request.json())
+
+
+@override_settings(LAST_SEEN_FLUSH_INTERVAL=3600)
+class MetricsTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.board = create_board_instance(self)
+
+    def get_value(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_and_cache_lookups(self):
+        labels = {'url_name': 'board_api_detail', 'method': 'GET', 'status': '200'}
+        requests = self.get_value('trello_request_duration_seconds_count', **labels)
+        hits = self.get_value('trello_cache_requests_total', cache='board_snapshot', result='hit')
+        self.client.force_authenticate(user=self.user1)
+        for _ in range(2):
+            self.client.get(reverse_lazy('board_api_detail', kwargs={'pk': self.board.pk}))
+        self.assertEqual(self.get_value('trello_request_duration_seconds_count', **labels), requests + 2)
+        self.assertEqual(self.get_value('trello_cache_requests_total', cache='board_snapshot', result='hit'), hits + 1)
+
+        with override_settings(METRICS_TOKEN='secret'):
+            request = self.client.get(reverse_lazy('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertIn(b'trello_request_queries_bucket{le="1.0",url_name="board_api_detail"}', request.content)
+
+    @override_settings(EMAIL_BACKEND='main.metrics.MeteredEmailBackend',
+                       EMAIL_DELIVERY_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_sent_emails_are_counted(self):
+        sent = self.get_value('trello_emails_sent_total')
+        send_mail('Subject', 'Message', 'from@b.com', ['a@b.com'])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(self.get_value('trello_emails_sent_total'), sent + 1)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse_lazy('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        request = self.client.get(reverse_lazy('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_no_token_is_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse_lazy('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        staff = User.objects.create(email='staff@b.com', username='staff', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse_lazy('metrics')).status_code, status.HTTP_200_OK)
+
+
+class ReplicaRouterTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        lag_checks.clear()
+        self.addCleanup(lag_checks.clear)
+        self.router = ReplicaRouter()
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_reads_go_to_replicas_that_keep_up(self):
+        self.assertEqual(self.router.db_for_read(Board), 'default')
+        with mock.patch('main.db.router.get_replica_lag', return_value=0), read_from_replica():
+            self.assertEqual(self.router.db_for_read(Board), 'replica')
+            self.assertEqual(self.router.db_for_write(Board), 'default')
+        lag_checks.clear()
+        with mock.patch('main.db.router.get_replica_lag', return_value=60), read_from_replica():
+            self.assertEqual(self.router.db_for_read(Board), 'default')
+
+    def test_writers_read_from_primary(self):
+        reads = []
+
+        def db_for_read(router, model, **hints):
+            reads.append(replica_alias.get())
+            return 'default'
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', db_for_read):
+            self.client.get(reverse_lazy('board_api'))
+            self.assertTrue(reads and all(reads))
+
+            self.client.post(reverse_lazy('board_api'), {'title': 'Board'})
+            self.assertTrue(is_pinned_to_primary(self.user1.pk))
+            reads.clear()
+            self.client.get(reverse_lazy('board_api'))
+            self.assertFalse(any(reads))
+        self.assertIsNone(replica_alias.get())
+
+    @override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+    def test_one_replica_per_request(self):
+        board = Board.objects.create(title='Board', owner=self.user1)
+        Column.objects.create(board=board, name='Column')
+        reads = []
+        route = ReplicaRouter.db_for_read
+
+        def db_for_read(router, model, **hints):
+            reads.append(route(router, model, **hints))
+            # There are no replica connections
+            return 'default'
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', db_for_read), \
+                mock.patch('main.db.router.get_replica_lag', return_value=0):
+            for _ in range(10):
+                # Not from the board snapshot cache, so the whole tree is read
+                cache.clear()
+                reads.clear()
+                request = self.client.get(reverse_lazy('board_api_detail', kwargs={'pk': board.pk}))
+                self.assertEqual(request.status_code, status.HTTP_200_OK)
+                self.assertGreater(len(reads), 1)
+                self.assertEqual(len(set(reads)), 1)
+                self.assertIn(reads[0], ['replica1', 'replica2'])
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_roles_are_read_from_primary(self):
+        board = Board.objects.create(title='Board', owner=self.user1)
+        with mock.patch('main.db.router.get_replica_lag', return_value=0), read_from_replica():
+            # There is no 'replica' connection, a read routed there would fail
+            self.assertEqual(RequestCache().get_role(self.user1, board), BoardAccess.OWNER)
+
+    def test_replicas_need_a_shared_cache(self):
+        with override_settings(DATABASE_REPLICAS=['replica']):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['main.E001'])
+            with override_settings(CACHES={'default': {
+                    'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost'}}):
+                self.assertEqual(check_shared_cache(None), [])
+        self.assertEqual(check_shared_cache(None), [])
+
+
+class FakeConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(APITestCase):
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(size=2, timeout=0.01)
+        first = pool.get(FakeConnection, lambda connection, idle: True)
+        pool.put(first)
+        self.assertIs(pool.get(FakeConnection, lambda connection, idle: True), first)
+        second = pool.get(FakeConnection, lambda connection, idle: True)
+        self.assertIsNot(second, first)
+        # Both slots are checked out
+        with self.assertRaises(PoolTimeout):
+            pool.get(FakeConnection, lambda connection, idle: True)
+        pool.put(second, reusable=False)
+        self.assertTrue(second.closed)
+
+    def test_broken_connections_are_replaced(self):
+        pool = ConnectionPool(size=1, timeout=0.01)
+        first = pool.get(FakeConnection, lambda connection, idle: True)
+        pool.put(first)
+        second = pool.get(FakeConnection, lambda connection, idle: False)
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+
+
+class BlobStorageTest(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.card = create_card_instance(self, create_column_instance(self, create_board_instance(self)))
+
+    def attach(self, name, content):
+        file = File(card=self.card, name=SimpleUploadedFile(name, content))
+        file.save()
+        return file
+
+    def test_same_content_is_stored_once(self):
+        first = self.attach('report.pdf', b'same content')
+        second = self.attach('copy of report.pdf', b'same content')
+        other = self.attach('other.pdf', b'other content')
+        self.assertEqual(first.name.name, second.name.name)
+        self.assertNotEqual(first.name.name, other.name.name)
+        self.assertEqual((first.original_name, second.original_name), ('report.pdf', 'copy of report.pdf'))
+        self.assertEqual(Blob.objects.get(name=first.name.name).references, 2)
+
+        path = first.name.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.filter(name=first.name.name).exists())
+
+    def test_replaced_background_is_released(self):
+        board = Board(title='Board', owner=self.user1, background=SimpleUploadedFile('a.png', b'first'))
+        board.save()
+        path = board.background.path
+        with self.captureOnCommitCallbacks(execute=True):
+            board.background = SimpleUploadedFile('b.png', b'second')
+            board.save()
+        self.assertFalse(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            board.delete()
+        self.assertFalse(Blob.objects.exists())
+
+    def test_same_background_uploaded_again(self):
+        board = Board.objects.create(title='Board', owner=self.user1, background=SimpleUploadedFile('a.png', b'same'))
+        path = board.background.path
+        board.background = SimpleUploadedFile('b.png', b'same')
+        board.save()
+        self.assertEqual(Blob.objects.get().references, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            board.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class BoardChangesTest(APITestCase):
+
+    def setUp(self):
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+        self.board = create_board_instance(self)
+        self.url = reverse_lazy('board_api_changes', kwargs={'pk': self.board.pk})
+
+    def get_changes(self, since):
+        request = self.client.get(self.url, {'since': since})
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        return request.data
+
+    def test_changes_since_version(self):
+        column = create_column_instance(self, self.board)
+        card = create_card_instance(self, column)
+        data = self.get_changes(0)
+        self.assertEqual([row['id'] for row in data['inserted']['card']], [card.pk])
+        self.assertNotIn('cards', data['inserted']['column'][0])
+        version = data['version']
+
+        card.name = 'Changed'
+        card.save()
+        checklist = create_checklist_instance(self, card)
+        data = self.get_changes(version)
+        self.assertEqual(data['updated'], {'card': [data['updated']['card'][0]]})
+        self.assertEqual(data['updated']['card'][0]['name'], 'Changed')
+        self.assertEqual([row['id'] for row in data['inserted']['checklist']], [checklist.pk])
+        version = data['version']
+
+        checklist_pk = checklist.pk
+        checklist.delete()
+        data = self.get_changes(version)
+        self.assertEqual(data['deleted'], {'checklist': [checklist_pk]})
+        self.assertEqual(data['inserted'], {})
+        self.assertEqual(data['updated'], {})
+        self.assertEqual(self.get_changes(data['version'])['deleted'], {})
+
+    def test_rows_point_to_card_ids(self):
+        card = create_card_instance(self, create_column_instance(self, self.board))
+        mark = Mark.objects.create(board=self.board, name='Mark', color='Blue')
+        MarkCard.objects.create(mark=mark, card=card)
+        Comment.objects.create(text='Some text', card=card, author=self.user1)
+        data = self.get_changes(0)
+        self.assertEqual(data['inserted']['comment'][0]['card'], card.pk)
+        self.assertEqual(data['inserted']['comment'][0]['author'], self.user1.pk)
+        self.assertEqual((data['inserted']['markcard'][0]['card'], data['inserted']['markcard'][0]['mark']),
+                         (card.pk, mark.pk))
+
+    def test_moved_card_leaves_tombstones(self):
+        card = create_card_instance(self, create_column_instance(self, self.board))
+        checklist = create_checklist_instance(self, card)
+        other_board = Board.objects.create(title='Other', owner=self.user1)
+        version = self.get_changes(0)['version']
+        card.column = create_column_instance(self, other_board)
+        card.save()
+        self.assertEqual(self.get_changes(version)['deleted'], {'card': [card.pk], 'checklist': [checklist.pk]})
+        request = self.client.get(reverse_lazy('board_api_changes', kwargs={'pk': other_board.pk}), {'since': 0})
+        self.assertEqual([row['id'] for row in request.data['inserted']['card']], [card.pk])
+        self.assertEqual([row['id'] for row in request.data['inserted']['checklist']], [checklist.pk])
+
+    def test_deleted_column_removes_its_cards(self):
+        column = create_column_instance(self, self.board)
+        card = create_card_instance(self, column)
+        version = self.get_changes(0)['version']
+        column_pk = column.pk
+        column.delete()
+        self.assertEqual(self.get_changes(version)['deleted'], {'card': [card.pk], 'column': [column_pk]})
+
+    def test_board_save_keeps_version(self):
+        create_column_instance(self, self.board)
+        stale = Board.objects.get(pk=self.board.pk)
+        create_column_instance(self, self.board)
+        version = Board.objects.get(pk=self.board.pk).version
+        stale.title = 'Changed'
+        stale.save()
+        self.assertEqual(Board.objects.get(pk=self.board.pk).version, version + 1)
+
+    def test_board_delete_removes_changes(self):
+        create_column_instance(self, self.board)
+        Members(member=self.user1, board=self.board).save()
+        self.board.delete()
+        self.assertFalse(BoardChange.objects.exists())
+
+    def test_board_delete_does_not_record_its_content(self):
+        counts = []
+        for columns in (1, 10):
+            board = Board.objects.create(title='Board', owner=self.user1)
+            for _ in range(columns):
+                column = create_column_instance(self, board)
+                for _ in range(3):
+                    create_card_instance(self, column)
+                Mark.objects.create(board=board, name='Mark', color='red')
+            with CaptureQueriesContext(connection) as context:
+                board.delete()
+            counts.append(len(context.captured_queries))
+            self.assertFalse(BoardChange.objects.filter(board=board.pk).exists())
+        self.assertEqual(counts[0], counts[1])
+
+        # Deleted by a queryset, the boards are only known from their own signals
+        board = Board.objects.create(title='Board', owner=self.user1)
+        create_column_instance(self, board)
+        with CaptureQueriesContext(connection) as context:
+            Board.objects.filter(pk=board.pk).delete()
+        self.assertFalse(any('UPDATE "boards_board"' in query['sql'] for query in context.captured_queries))
+
+
+class BoardEventsTest(APITestCase):
+
+    def setUp(self):
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.user2 = User(email='b@c.com', password='12345678', username='bc')
+        self.user2.save()
+        self.board = create_board_instance(self)
+        self.application = BoardEventsApplication(None)
+
+    def stream(self, user, events=()):
+        token = Token.objects.create(user=user)
+        scope = {'type': 'http', 'path': f'/api/boards/{self.board.pk}/events/',
+                 'headers': [(b'authorization', f'Token {token.key}'.encode())]}
+        messages = []
+
+        async def run():
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+                if message['type'] == 'http.response.start' and message['status'] == 200:
+                    for event in events:
+                        broker.dispatch(self.board.pk, event)
+                if b'data:' in message.get('body', b''):
+                    disconnect.set()
+
+            await asyncio.wait_for(self.application(scope, receive, send), timeout=5)
+
+        async_to_sync(run)()
+        return messages
+
+    def test_events_are_streamed(self):
+        event = {'version': 3, 'model': 'card', 'id': 1, 'deleted': False}
+        messages = self.stream(self.user1, events=[event])
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(messages[-1]['body'], f'id: 3\nevent: change\ndata: {json.dumps(event)}\n\n'.encode())
+        self.assertEqual(broker.subscribers, {})
+
+    @override_settings(BOARD_EVENTS_QUEUE_SIZE=1)
+    def test_slow_client_is_disconnected(self):
+        events = [{'version': version, 'model': 'card', 'id': 1, 'deleted': False} for version in range(3)]
+        messages = self.stream(self.user1, events=events)
+        # What the queue held is sent, the events it had no room for end the stream
+        self.assertEqual(messages[-1], {'type': 'http.response.body', 'body': b''})
+        self.assertEqual(sum(b'data:' in message.get('body', b'') for message in messages), 1)
+        self.assertEqual(broker.subscribers, {})
+
+    def test_stream_requires_board_access(self):
+        messages = self.stream(self.user2)
+        self.assertEqual(messages[0]['status'], status.HTTP_403_FORBIDDEN)
+
+    def test_changes_are_published_after_commit(self):
+        loop = asyncio.new_event_loop()
+        queue = EventQueue()
+        broker.subscribe(self.board.pk, loop, queue)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                column = create_column_instance(self, self.board)
+            loop.run_until_complete(asyncio.sleep(0))
+            event = queue.get_nowait()
+        finally:
+            broker.unsubscribe(self.board.pk, loop, queue)
+            loop.close()
+        self.assertEqual((event['model'], event['id'], event['deleted']), ('column', column.pk, False))
+
+
+@override_settings(LAST_SEEN_FLUSH_INTERVAL=3600, LAST_SEEN_MAX_PENDING=1000)
+class LastSeenRecorderTest(APITestCase):
+
+    def setUp(self):
+        last_seen_recorder.clear()
+        self.user1 = User(email='a@b.com', password='12345678')
+        self.user1.save()
+        self.board = create_board_instance(self)
+
+    def test_board_reads_are_buffered(self):
+        self.client.force_authenticate(user=self.user1)
+        url = reverse_lazy('board_api_detail', kwargs={'pk': self.board.pk})
+        self.client.get(url)
+        self.client.get(url)
+        self.assertFalse(LastSeen.objects.exists())
+
+        self.assertEqual(last_seen_recorder.flush(), 1)
+        first = LastSeen.objects.get(user=self.user1, board=self.board).seen
+        self.client.get(url)
+        last_seen_recorder.flush()
+        self.assertEqual(LastSeen.objects.count(), 1)
+        self.assertGreater(LastSeen.objects.get().seen, first)
+
+    def test_flush_skips_deleted_boards(self):
+        last_seen_recorder.record(self.user1.pk, self.board.pk)
+        self.board.delete()
+        self.assertEqual(last_seen_recorder.flush(), 0)
+
+    def test_list_shows_accessible_boards(self):
+        self.client.force_authenticate(user=self.user1)
+        other = Board.objects.create(title='Other', owner=self.user1)
+        last_seen_recorder.record(self.user1.pk, self.board.pk)
+        last_seen_recorder.record(self.user1.pk, other.pk)
+        other.owner = None
+        other.save()
+        request = self.client.get(reverse_lazy('last_seen_api'))
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['id'] for row in request.data],
+                         [LastSeen.objects.get(user=self.user1, board=self.board).pk])
+
+    @override_settings(LAST_SEEN_FLUSH_INTERVAL=0.01)
+    def test_flushed_from_a_thread(self):
+        flushed = threading.Event()
+        with mock.patch.object(last_seen_recorder, 'flush', side_effect=lambda: flushed.set()):
+            last_seen_recorder.start()
+            self.addCleanup(last_seen_recorder.stop)
+            self.assertTrue(flushed.wait(5))
+
+    def test_failed_flush_keeps_entries(self):
+        last_seen_recorder.record(self.user1.pk, self.board.pk)
+        with mock.patch.object(LastSeen.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                last_seen_recorder.flush()
+        self.assertEqual(last_seen_recorder.flush(), 1)
+
+    @override_settings(LAST_SEEN_MAX_PENDING=2)
+    def test_flush_when_buffer_is_full(self):
+        second = create_board_instance(self)
+        last_seen_recorder.record(self.user1.pk, self.board.pk)
+        self.assertEqual(LastSeen.objects.count(), 0)
+        last_seen_recorder.record(self.user1.pk, second.pk)
+        self.assertEqual(LastSeen.objects.count(), 2)
+
+        # A failed flush is logged, the read goes on
+        last_seen_recorder.record(self.user1.pk, self.board.pk)
+        with mock.patch.object(LastSeen.objects, 'bulk_create', side_effect=DatabaseError), \
+                self.assertLogs('boards.last_seen', 'ERROR'):
+            last_seen_recorder.record(self.user1.pk, second.pk)
+        self.assertEqual(len(last_seen_recorder.pending), 2)
+
+    @override_settings(LAST_SEEN_MAX_PENDING=1)
+    def test_full_buffer_wakes_the_thread(self):
+        flushed = threading.Event()
+        with mock.patch.object(last_seen_recorder, 'flush', side_effect=lambda: flushed.set()):
+            last_seen_recorder.start()
+            self.addCleanup(last_seen_recorder.stop)
+            with CaptureQueriesContext(connection) as context:
+                last_seen_recorder.record(self.user1.pk, self.board.pk)
+            self.assertEqual(context.captured_queries, [])
+            self.assertTrue(flushed.wait(5))
+
+
 class MemberTest(APITestCase):
     def setUp(self):
 
@@ -116,6 +1103,17 @@ class MemberTest(APITestCase):
             {'board': second.pk})
         self.assertEqual(request.status_code, status.HTTP_202_ACCEPTED)
 
+    def test_PATCH_request_reuses_fetched_objects(self):
+        self.client.force_authenticate(user=self.user1)
+        board = create_board_instance(self)
+        member = Members(member=self.user2, board=board)
+        member.save()
+        request = self.client.patch(
+            reverse_lazy('member_api_detail', kwargs={'pk': member.pk}),
+            {'member': self.user2.pk})
+        self.assertEqual(request.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(request['X-Request-Cache-Hits'], '1')
+
     def test_PUT_request(self):
         self.client.force_authenticate(user=self.user1)
         board = create_board_instance(self)
@@ -135,6 +1133,58 @@ class MemberTest(APITestCase):
         self.assertEqual(request.status_code, status.HTTP_204_NO_CONTENT)
 
 
+class BoardAccessTest(APITestCase):
+    def setUp(self):
+        self.user1 = User(email='a@b.com', password='123123123')
+        self.user1.save()
+        self.user2 = User(email='b@c.com', password='123123123', username='bc')
+        self.user2.save()
+
+    def roles(self, board):
+        return dict(BoardAccess.objects.filter(board=board).values_list('user', 'role'))
+
+    def test_owner_and_members_are_synced(self):
+        board = create_board_instance(self)
+        self.assertEqual(self.roles(board), {self.user1.pk: BoardAccess.OWNER})
+
+        member = Members(member=self.user2, board=board)
+        member.save()
+        self.assertEqual(self.roles(board), {self.user1.pk: BoardAccess.OWNER, self.user2.pk: BoardAccess.MEMBER})
+
+        board.owner = self.user2
+        board.save()
+        self.assertEqual(self.roles(board), {self.user2.pk: BoardAccess.OWNER})
+
+        board.owner = self.user1
+        board.save()
+        self.assertEqual(self.roles(board), {self.user1.pk: BoardAccess.OWNER, self.user2.pk: BoardAccess.MEMBER})
+
+        second = Board(title='Second Board')
+        second.save()
+        member.board = second
+        member.save()
+        self.assertEqual(self.roles(board), {self.user1.pk: BoardAccess.OWNER})
+        self.assertEqual(self.roles(second), {self.user2.pk: BoardAccess.MEMBER})
+
+        member.delete()
+        self.assertEqual(self.roles(second), {})
+
+    def test_rebuild_command(self):
+        board = create_board_instance(self)
+        Members(member=self.user2, board=board).save()
+        BoardAccess.objects.all().delete()
+        call_command('rebuild_board_access', stdout=StringIO())
+        self.assertEqual(self.roles(board), {self.user1.pk: BoardAccess.OWNER, self.user2.pk: BoardAccess.MEMBER})
+
+    def test_member_cannot_update_board(self):
+        board = create_board_instance(self)
+        Members(member=self.user2, board=board).save()
+        self.client.force_authenticate(user=self.user2)
+        url = reverse_lazy('board_api_detail', kwargs={'pk': board.pk})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.patch(url, {'title': 'Changed'}).status_code, status.HTTP_403_FORBIDDEN)
+
+
 def create_column_instance(self, board):
     column = Column(name='New Column Name', board=board)
     column.save()
@@ -258,6 +1308,342 @@ class CardTest(APITestCase):
         request = self.client.delete(reverse_lazy('card_api_detail', kwargs={'pk': card.pk}))
         self.assertEqual(request.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_GET_request_is_one_query_per_list(self):
+        self.client.force_authenticate(user=self.user1)
+        board = create_board_instance(self)
+        Members(member=self.user2, board=board).save()
+        column = create_column_instance(self, board)
+        for _ in range(5):
+            create_card_instance(self, column)
+        foreign = Board(title='Foreign Board', owner=self.user2)
+        foreign.save()
+        create_card_instance(self, create_column_instance(self, foreign))
+        with CaptureQueriesContext(connection) as context:
+            request = self.client.get(self.card_url)
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(request.data['results']), 5)
+        # cards + comments, marks, files and checklists prefetches
+        self.assertEqual(len(context.captured_queries), 5)
+
+    def test_GET_request_is_paginated_by_cursor(self):
+        self.client.force_authenticate(user=self.user1)
+        board = create_board_instance(self)
+        column = create_column_instance(self, board)
+        cards = [create_card_instance(self, column) for _ in range(5)]
+        request = self.client.get(self.card_url, {'page_size': 3})
+        self.assertEqual([card['id'] for card in request.data['results']], [card.pk for card in cards[:3]])
+        request = self.client.get(request.data['next'])
+        self.assertEqual([card['id'] for card in request.data['results']], [card.pk for card in cards[3:]])
+        self.assertIsNone(request.data['next'])
+
+
+class CardBatchTest(APITestCase):
+
+    def setUp(self):
+        self.user1 = User(email='a@b.com', password='123123123')
+        self.user1.save()
+        self.user2 = User(email='b@c.com', password='123123123', username='bc')
+        self.user2.save()
+        self.board = create_board_instance(self)
+        self.other_board = Board.objects.create(title='Other', owner=self.user1)
+        self.column = create_column_instance(self, self.board)
+        self.other_column = create_column_instance(self, self.other_board)
+        self.cards = [create_card_instance(self, self.column) for _ in range(3)]
+        self.batch_url = reverse_lazy('card_api_batch')
+
+    def post(self, operations):
+        return self.client.post(self.batch_url, data={'operations': operations}, format='json')
+
+    def test_operations_are_applied_together(self):
+        self.client.force_authenticate(user=self.user1)
+        version = Board.objects.get(pk=self.board.pk).version
+        request = self.post([
+            {'op': 'create', 'column': self.column.pk, 'name': 'New', 'description': 'descr'},
+            {'op': 'update', 'id': self.cards[0].pk, 'name': 'Renamed'},
+            {'op': 'move', 'id': self.cards[1].pk, 'column': self.other_column.pk},
+        ])
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in request.data['results']], [201, 200, 200])
+        self.assertEqual(Card.objects.get(pk=self.cards[0].pk).name, 'Renamed')
+        self.assertEqual(Card.objects.get(pk=self.cards[1].pk).column, self.other_column)
+        self.assertTrue(Card.objects.filter(pk=request.data['results'][0]['id'], name='New').exists())
+
+        # The moved card is gone from the first board and new on the other one
+        self.assertGreater(Board.objects.get(pk=self.board.pk).version, version)
+        changes = BoardChange.objects.filter(model='card', object_id=self.cards[1].pk)
+        self.assertTrue(changes.get(board=self.board).deleted)
+        self.assertFalse(changes.get(board=self.other_board).deleted)
+
+        request = self.post([{'op': 'delete', 'id': self.cards[2].pk}])
+        self.assertEqual(request.data['results'], [{'op': 'delete', 'id': self.cards[2].pk, 'status': 204}])
+        self.assertFalse(Card.objects.filter(pk=self.cards[2].pk).exists())
+
+    def test_query_count_does_not_grow(self):
+        self.client.force_authenticate(user=self.user1)
+        cards = self.cards + [create_card_instance(self, self.column) for _ in range(20)]
+        counts = []
+        for moved in (cards[:2], cards[2:]):
+            with CaptureQueriesContext(connection) as context:
+                request = self.post([{'op': 'move', 'id': card.pk, 'column': self.other_column.pk} for card in moved])
+            self.assertEqual(request.status_code, status.HTTP_200_OK)
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_children_follow_their_cards(self):
+        self.client.force_authenticate(user=self.user1)
+        comments = [Comment.objects.create(card=card, author=self.user1, text='text') for card in self.cards]
+        check_list = CheckList.objects.create(card=self.cards[1], name='Check')
+        request = self.post([{'op': 'move', 'id': self.cards[0].pk, 'column': self.other_column.pk}])
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        changes = BoardChange.objects.filter(model='comment', object_id=comments[0].pk)
+        self.assertTrue(changes.get(board=self.board).deleted)
+        self.assertFalse(changes.get(board=self.other_board).deleted)
+
+        # Deleted with their children, without a query per row
+        cards = self.cards[1:] + [create_card_instance(self, self.column) for _ in range(10)]
+        Comment.objects.bulk_create([Comment(card=card, author=self.user1, text='text') for card in cards[2:]])
+        version = Board.objects.get(pk=self.board.pk).version
+        with CaptureQueriesContext(connection) as context:
+            request = self.post([{'op': 'delete', 'id': card.pk} for card in cards])
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertLess(len(context.captured_queries), 30)
+        self.assertEqual(Board.objects.get(pk=self.board.pk).version, version + 1)
+        self.assertFalse(Comment.objects.filter(pk__in=[comment.pk for comment in comments[1:]]).exists())
+        self.assertTrue(BoardChange.objects.get(board=self.board, model='checklist', object_id=check_list.pk).deleted)
+        self.assertTrue(BoardChange.objects.get(board=self.board, model='card', object_id=self.cards[2].pk).deleted)
+
+    def test_nothing_is_applied_without_access(self):
+        self.client.force_authenticate(user=self.user2)
+        Members(member=self.user2, board=self.board).save()
+        request = self.post([
+            {'op': 'update', 'id': self.cards[0].pk, 'name': 'Renamed'},
+            {'op': 'move', 'id': self.cards[1].pk, 'column': self.other_column.pk},
+        ])
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([result['status'] for result in request.data['results']], [424, 400])
+        self.assertEqual(Card.objects.get(pk=self.cards[0].pk).name, 'Some Card Name')
+
+    def test_invalid_operations(self):
+        self.client.force_authenticate(user=self.user1)
+        self.assertEqual(self.post([]).status_code, status.HTTP_400_BAD_REQUEST)
+        request = self.post([{'op': 'move', 'id': self.cards[0].pk}, {'op': 'delete', 'id': self.cards[1].pk}])
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('column', request.data['results'][0]['errors'])
+        self.assertEqual(request.data['results'][1]['status'], 424)
+        self.assertTrue(Card.objects.filter(pk=self.cards[1].pk).exists())
+
+
+class RankTest(APITestCase):
+
+    def setUp(self):
+        self.user1 = User(email='a@b.com', password='123123123')
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+        self.board = create_board_instance(self)
+        self.column = create_column_instance(self, self.board)
+        self.other_column = create_column_instance(self, self.board)
+        self.cards = [create_card_instance(self, self.column) for _ in range(3)]
+
+    def get_order(self, column):
+        return list(Card.objects.filter(column=column).values_list('pk', flat=True))
+
+    def test_rank_keys(self):
+        ranks = spread_ranks(100)
+        self.assertEqual(ranks, sorted(set(ranks)))
+        self.assertEqual(len(spread_ranks(3)[0]), 1)
+        for before, after in [(None, None), (None, '1'), ('a', 'b'), ('9z', 'a0'), ('zz', None), ('a', 'a01')]:
+            rank = rank_between(before, after)
+            self.assertLess(before or '', rank)
+            if after:
+                self.assertLess(rank, after)
+            self.assertFalse(rank.endswith('0'))
+
+    def test_tied_ranks(self):
+        with self.assertRaises(RankConflict):
+            place([('a', 1), ('a', 2), ('b', 3)], 4, after=1)
+        Card.objects.filter(pk__in=[card.pk for card in self.cards]).update(rank='a')
+        url = reverse_lazy('card_api_detail', kwargs={'pk': self.cards[2].pk})
+        request = self.client.patch(url, data={'after': self.cards[0].pk}, format='json')
+        self.assertEqual(request.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.get_order(self.column), [self.cards[0].pk, self.cards[2].pk, self.cards[1].pk])
+        self.assertEqual(len(set(Card.objects.filter(column=self.column).values_list('rank', flat=True))), 3)
+
+        # A batch is refused, the column is respread for the retry
+        Card.objects.filter(pk__in=[card.pk for card in self.cards]).update(rank='a')
+        operations = [{'op': 'move', 'id': self.cards[1].pk, 'column': self.column.pk, 'after': self.cards[0].pk}]
+        request = self.client.post(reverse_lazy('card_api_batch'), data={'operations': operations}, format='json')
+        self.assertEqual(request.data['results'][0]['status'], status.HTTP_409_CONFLICT)
+        request = self.client.post(reverse_lazy('card_api_batch'), data={'operations': operations}, format='json')
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_order(self.column)[:2], [self.cards[0].pk, self.cards[1].pk])
+
+    def test_move_writes_one_row(self):
+        self.assertEqual(self.get_order(self.column), [card.pk for card in self.cards])
+        url = reverse_lazy('card_api_detail', kwargs={'pk': self.cards[2].pk})
+        with CaptureQueriesContext(connection) as context:
+            request = self.client.patch(url, data={'after': self.cards[0].pk}, format='json')
+        self.assertEqual(request.status_code, status.HTTP_202_ACCEPTED)
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE "boards_card"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.get_order(self.column), [self.cards[0].pk, self.cards[2].pk, self.cards[1].pk])
+
+        # Into another column, before its only card
+        other = create_card_instance(self, self.other_column)
+        request = self.client.patch(url, data={'column': self.other_column.pk, 'before': other.pk}, format='json')
+        self.assertEqual(request.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.get_order(self.other_column), [self.cards[2].pk, other.pk])
+        request = self.client.patch(url, data={'after': self.cards[0].pk}, format='json')
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_board_is_returned_in_order(self):
+        self.client.patch(reverse_lazy('column_api_detail', kwargs={'pk': self.other_column.pk}),
+                          data={'before': self.column.pk}, format='json')
+        self.client.patch(reverse_lazy('card_api_detail', kwargs={'pk': self.cards[0].pk}),
+                          data={'after': self.cards[2].pk}, format='json')
+        request = self.client.get(reverse_lazy('board_api_detail', kwargs={'pk': self.board.pk}))
+        columns = request.data['columns']
+        self.assertEqual([column['id'] for column in columns], [self.other_column.pk, self.column.pk])
+        self.assertEqual([card['id'] for card in columns[1]['cards']],
+                         [self.cards[1].pk, self.cards[2].pk, self.cards[0].pk])
+
+    def test_batch_positions(self):
+        request = self.client.post(reverse_lazy('card_api_batch'), data={'operations': [
+            {'op': 'create', 'column': self.column.pk, 'name': 'First', 'description': 'descr',
+             'before': self.cards[0].pk},
+            {'op': 'move', 'id': self.cards[2].pk, 'column': self.column.pk, 'after': self.cards[0].pk},
+            {'op': 'move', 'id': self.cards[1].pk, 'column': self.other_column.pk},
+        ]}, format='json')
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        created = request.data['results'][0]['id']
+        self.assertEqual(self.get_order(self.column), [created, self.cards[0].pk, self.cards[2].pk])
+        self.assertEqual(self.get_order(self.other_column), [self.cards[1].pk])
+
+        request = self.client.post(reverse_lazy('card_api_batch'), data={'operations': [
+            {'op': 'update', 'id': self.cards[0].pk, 'after': self.cards[1].pk}]}, format='json')
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('after', request.data['results'][0]['errors'])
+
+    @override_settings(RANK_MAX_LENGTH=2)
+    def test_long_ranks_are_rebalanced(self):
+        # Every new card right after the first one halves the same gap, the keys get longer
+        for i in range(12):
+            request = self.client.post(reverse_lazy('card_api'), data={
+                'column': self.column.pk, 'name': f'Card {i}', 'description': 'descr', 'due_date': '2030-01-01',
+                'after': self.cards[0].pk}, format='json')
+            self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(len(Card.objects.get(pk=request.data['id']).rank), 2)
+        self.assertEqual(Job.objects.filter(name='boards.services.rebalance_ranks', status=Job.PENDING).count(), 1)
+        order = self.get_order(self.column)
+
+        run_pending_jobs()
+        self.assertEqual(self.get_order(self.column), order)
+        self.assertEqual(list(Card.objects.filter(column=self.column).values_list('rank', flat=True)), spread_ranks(15))
+
+
+class FileUploadTest(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.part_dir = os.path.join(self.media_root, 'uploads')
+        override = override_settings(MEDIA_ROOT=self.media_root, CHUNKED_UPLOAD_DIR=self.part_dir,
+                                     CHUNKED_UPLOAD_MAX_CHUNK_SIZE=8)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user1 = User(email='a@b.com', password='123123123')
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+        self.card = create_card_instance(self, create_column_instance(self, create_board_instance(self)))
+        self.content = b'chunked attachment'
+
+    def start_upload(self, checksum=None):
+        request = self.client.post(reverse_lazy('file_upload_api'), {
+            'card': self.card.pk, 'name': 'notes.txt', 'size': len(self.content),
+            'checksum': checksum or hashlib.sha256(self.content).hexdigest()})
+        self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        return reverse_lazy('file_upload_api_detail', kwargs={'pk': request.data['id']}), request.data['id']
+
+    def put_chunk(self, url, offset, data):
+        return self.client.put(url, data, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunked_upload(self):
+        url, pk = self.start_upload()
+        self.assertEqual(self.put_chunk(url, 0, self.content[:8]).data['offset'], 8)
+        # A retried chunk with a stale offset is refused and reports where to resume
+        request = self.put_chunk(url, 0, self.content[:8])
+        self.assertEqual((request.status_code, request.data['offset']), (status.HTTP_409_CONFLICT, 8))
+        self.assertEqual(self.client.get(url).data['offset'], 8)
+        self.assertEqual(self.put_chunk(url, 8, self.content[8:]).status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.put_chunk(url, 8, self.content[8:16])
+        self.put_chunk(url, 16, self.content[16:])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            request = self.client.post(reverse_lazy('file_upload_api_complete', kwargs={'pk': pk}))
+        self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        file = File.objects.get(card=self.card)
+        self.assertEqual(file.name.read(), self.content)
+        self.assertEqual((file.original_name, request.data['original_name']), ('notes.txt', 'notes.txt'))
+        self.assertFalse(FileUpload.objects.exists())
+        self.assertEqual(os.listdir(self.part_dir), [])
+
+    def test_checksum_mismatch_restarts_upload(self):
+        url, pk = self.start_upload(checksum='0' * 64)
+        for offset in range(0, len(self.content), 8):
+            self.put_chunk(url, offset, self.content[offset:offset + 8])
+        request = self.client.post(reverse_lazy('file_upload_api_complete', kwargs={'pk': pk}))
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(FileUpload.objects.get().offset, 0)
+        self.assertFalse(File.objects.exists())
+
+    def test_upload_requires_board_access(self):
+        url, pk = self.start_upload()
+        other = User(email='b@c.com', password='123123123', username='bc')
+        other.save()
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.put_chunk(url, 0, self.content[:8]).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_chunk_is_read_before_locking(self):
+        url, pk = self.start_upload()
+        upload = FileUpload.objects.get(pk=pk)
+        with self.assertRaises(UploadError):
+            write_chunk(upload, BytesIO(self.content[:4]), 0, 8)
+        self.assertEqual((FileUpload.objects.get(pk=pk).offset, os.listdir(self.part_dir)), (0, []))
+        # The row is not touched while the client sends the chunk
+        with CaptureQueriesContext(connection) as context:
+            stream = BytesIO(self.content[:8])
+            read = stream.read
+            stream.read = lambda size: self.assertEqual(context.captured_queries, []) or read(size)
+            write_chunk(upload, stream, 0, 8)
+        self.assertTrue(context.captured_queries)
+        self.assertEqual(os.listdir(self.part_dir), [f'{pk}.part'])
+
+    @override_settings(CHUNKED_UPLOAD_MAX_SIZE=16)
+    def test_size_is_limited(self):
+        request = self.client.post(reverse_lazy('file_upload_api'), {
+            'card': self.card.pk, 'name': 'notes.txt', 'size': 17, 'checksum': '0' * 64})
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('size', request.data)
+
+    def test_checksum_is_verified_before_locking(self):
+        url, pk = self.start_upload()
+        for offset in range(0, len(self.content), 8):
+            self.put_chunk(url, offset, self.content[offset:offset + 8])
+        # Called outside of any transaction but the test's own
+        depth = len(connection.savepoint_ids)
+        depths = []
+        with mock.patch('boards.uploads.get_checksum', side_effect=lambda path: depths.append(
+                len(connection.savepoint_ids)) or hashlib.sha256(self.content).hexdigest()):
+            request = self.client.post(reverse_lazy('file_upload_api_complete', kwargs={'pk': pk}))
+        self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(depths, [depth])
+
+    def test_card_without_column(self):
+        self.card.column.delete()
+        request = self.client.post(reverse_lazy('file_upload_api'), {
+            'card': self.card.pk, 'name': 'notes.txt', 'size': 1, 'checksum': '0' * 64})
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('card', request.data)
+
 
 def create_checklist_instance(self, card):
     check = CheckList(name='Some checklist name', done=True, card=card)
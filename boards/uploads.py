@@ -0,0 +1,116 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.utils import timezone
+
+from boards.models import File, FileUpload
+from boards.storage import release
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+def get_part_path(upload):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{upload.pk}.part')
+
+
+def write_chunk(upload, stream, offset, length):
+    # Chunks must be sent in order, a retried chunk is sent again from the recorded offset.
+    # The chunk is read from the client into its own file first, the row is only locked to
+    # add it to the part file, so parallel requests can't interleave.
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE or offset + length > upload.size:
+        raise UploadError('Chunk is too large')
+    if offset != upload.offset:
+        raise UploadError(f'Expected offset {upload.offset}')
+
+    path = get_part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=f'{upload.pk}.', suffix='.chunk',
+                                     delete=False) as chunk:
+        written = 0
+        while written < length:
+            data = stream.read(min(CHUNK_SIZE, length - written))
+            if not data:
+                break
+            chunk.write(data)
+            written += len(data)
+    try:
+        if written != length:
+            raise UploadError('Chunk is incomplete')
+        with transaction.atomic():
+            upload = FileUpload.objects.select_for_update().get(pk=upload.pk)
+            if offset != upload.offset:
+                raise UploadError(f'Expected offset {upload.offset}')
+            if offset == 0:
+                os.replace(chunk.name, path)
+            else:
+                with open(path, 'ab') as part, open(chunk.name, 'rb') as data:
+                    # A chunk that failed halfway left data past the recorded offset
+                    part.truncate(offset)
+                    shutil.copyfileobj(data, part, CHUNK_SIZE)
+            upload.offset = offset + length
+            upload.save(update_fields=['offset'])
+    finally:
+        delete_part(chunk.name)
+    return upload
+
+
+def get_checksum(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for data in iter(lambda: part.read(CHUNK_SIZE), b''):
+            checksum.update(data)
+    return checksum.hexdigest()
+
+
+def finalize_upload(upload):
+    # No chunk is accepted once offset reaches size, so the part file is checked and stored
+    # before the row is locked, the lock is only held to create the File and drop the upload
+    upload = FileUpload.objects.get(pk=upload.pk)
+    if upload.offset != upload.size:
+        raise UploadError(f'Only {upload.offset} of {upload.size} bytes were received')
+    path = get_part_path(upload)
+    if get_checksum(path) != upload.checksum:
+        with transaction.atomic():
+            # The data can't be trusted, so the upload starts over
+            FileUpload.objects.select_for_update().filter(pk=upload.pk, offset=upload.size).update(offset=0)
+        delete_part(path)
+        raise UploadError('Checksum does not match')
+
+    file = File(card_id=upload.card_id, original_name=upload.name)
+    with open(path, 'rb') as part:
+        file.name.save(upload.name, DjangoFile(part), save=False)
+    with transaction.atomic():
+        if not FileUpload.objects.select_for_update().filter(pk=upload.pk).exists():
+            # Finalized by a concurrent request, this copy of the content is not used
+            release(file.name.name)
+            raise UploadError('Upload was already finalized')
+        file.save()
+        upload.delete()
+    return file
+
+
+def delete_part(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def delete_expired_uploads():
+    expired = timezone.now() - timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY)
+    # Deleted one by one so the post_delete signal removes the part files
+    count = 0
+    for upload in FileUpload.objects.filter(created_on__lt=expired):
+        upload.delete()
+        count += 1
+    return count
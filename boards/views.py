@@ -1,14 +1,12 @@
-import datetime
-
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render
 from django.urls import reverse_lazy, reverse
 from django.views import generic
 from django.contrib.auth.mixins import LoginRequiredMixin
 from boards.models import Card, Comment, Board, Column, CheckList, Mark, Favourite, Archive, LastSeen
 from boards.forms import CommentForm, CardForm, ColumnForm, SearchUserForm, SearchMarkForm
-from django.db.models import Q
+from boards.last_seen import last_seen_recorder
 
 User = get_user_model()
 
@@ -26,7 +24,7 @@ class BoardView(LockedView, generic.ListView):
     def get_queryset(self):
         queryset = super().get_queryset()
         user = self.request.user
-        boards = queryset.filter(Q(owner=user) | Q(members__member=user))
+        boards = queryset.accessible_to(user)
 
         return boards
 
@@ -50,10 +48,7 @@ class BoardDetailView(LockedView, generic.FormView, generic.DetailView):
     success_url = '#'
 
     def get(self, request, *args, **kwargs):
-        saw, created = LastSeen.objects.get_or_create(user=self.request.user, board=self.get_object())
-        if not created:
-            saw.seen = datetime.datetime.now()
-            saw.save()
+        last_seen_recorder.record(self.request.user.pk, self.kwargs['pk'])
         return super().get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
@@ -353,20 +348,11 @@ class FavouriteCreateView(LockedView, generic.CreateView):
     success_url = reverse_lazy('favourite_list')
 
     def form_valid(self, form):
-        form.instance.author = self.request.user
-        return super().form_valid(form)
-
-    def post(self, request, *args, **kwargs):
-        product = self.get_form_kwargs()
-        data = product.get('data')['board']
-
-        if Favourite.objects.filter(board=data, author=self.request.user):
+        self.object, created = Favourite.objects.get_or_create(
+            board=form.cleaned_data['board'], author=self.request.user)
+        if not created:
             return HttpResponse('You already have it in Favourites', content_type='text/plain')
-        else:
-            form = self.get_form()
-            form.instance.author = self.request.user
-
-            return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class FavouriteUpdateView(LockedView, generic.UpdateView):
@@ -435,5 +421,6 @@ class LastSeenView(LockedView, generic.ListView):
     context_object_name = 'boards'
 
     def get_queryset(self):
+        last_seen_recorder.flush()
         queryset = LastSeen.objects.filter(user=self.request.user,).order_by('-seen')[:6]
         return queryset
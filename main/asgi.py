@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, it uses the models
+from boards.asgi import BoardEventsApplication  # noqa: E402
+
+application = BoardEventsApplication(django_application)
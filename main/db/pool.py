@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Keeps up to size connections per process. Checked in connections are reused
+    # newest first, so the ones left idle at the back are the first to go stale.
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def get(self, connect, check):
+        # check(connection, idle_seconds) tells whether a checked in connection still works
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'No database connection was free within {self.timeout}s')
+        try:
+            while True:
+                with self.lock:
+                    connection, returned_at = self.idle.pop() if self.idle else (None, None)
+                if connection is None:
+                    return connect()
+                if check(connection, time.monotonic() - returned_at):
+                    return connection
+                close_quietly(connection)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection, reusable=True):
+        try:
+            if reusable:
+                with self.lock:
+                    self.idle.append((connection, time.monotonic()))
+            else:
+                close_quietly(connection)
+        finally:
+            self.slots.release()
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for connection, _ in idle:
+            close_quietly(connection)
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class AcquireStats:
+    # Time spent getting a database connection, whether opened or taken from the pool
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def record(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {'count': self.count, 'total': self.total, 'max': self.max}
+
+
+acquire_stats = AcquireStats()
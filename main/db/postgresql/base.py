@@ -0,0 +1,76 @@
+import threading
+import time
+from functools import partial
+
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from main.db.pool import ConnectionPool, acquire_stats
+from main.metrics import DB_CONNECTION_ACQUIRE
+
+# Pools are per process and per database alias
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    size = settings_dict.get('POOL_SIZE') or 0
+    if size <= 0:
+        return None
+    with pools_lock:
+        if alias not in pools:
+            pools[alias] = ConnectionPool(size, settings_dict.get('POOL_TIMEOUT', 10))
+        return pools[alias]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # The stock backend, plus an optional pool (POOL_SIZE in the database settings) and
+    # the time spent acquiring connections in main.db.pool.acquire_stats.
+    # With a pool CONN_MAX_AGE should be 0, closing a connection then checks it back in.
+    acquire_time = None
+
+    def get_new_connection(self, conn_params):
+        start = time.perf_counter()
+        pool = get_pool(self.alias, self.settings_dict)
+        if pool is None:
+            connection = super().get_new_connection(conn_params)
+        else:
+            connection = pool.get(partial(super().get_new_connection, conn_params), self.check_pooled)
+            # Set by get_new_connection for fresh connections, reused ones need it as well
+            self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+        self.acquire_time = time.perf_counter() - start
+        acquire_stats.record(self.acquire_time)
+        DB_CONNECTION_ACQUIRE.labels(self.alias).observe(self.acquire_time)
+        return connection
+
+    def check_pooled(self, connection, idle):
+        if connection.closed:
+            return False
+        if idle < self.settings_dict.get('POOL_CHECK_AFTER', 30):
+            return True
+        # Idle for a while, the server may have dropped it in the meantime
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close(self):
+        pool = get_pool(self.alias, self.settings_dict)
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            pool.put(self.connection, reusable=self.reset_pooled(self.connection))
+
+    def reset_pooled(self, connection):
+        if connection.closed:
+            return False
+        try:
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            return connection.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+        except Exception:
+            return False
@@ -0,0 +1,110 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Database the reads of a view go to while it may read from a replica, chosen once so every
+# query of a request sees the same replay point. See boards.api.routing.ReplicaReadMixin
+replica_alias = ContextVar('replica_alias', default=None)
+
+lag_checks = {}
+lag_checks_lock = threading.Lock()
+
+# Cache backends that every process has its own copy of
+PROCESS_CACHES = ('LocMemCache', 'DummyCache')
+
+
+@contextmanager
+def read_from_replica():
+    token = replica_alias.set(choose_replica())
+    try:
+        yield
+    finally:
+        replica_alias.reset(token)
+
+
+def get_pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    # The cache is shared between processes, see check_shared_cache, so this holds across workers
+    cache.set(get_pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned_to_primary(user_id):
+    return bool(cache.get(get_pin_key(user_id)))
+
+
+def check_shared_cache(app_configs, **kwargs):
+    # Registered in boards.apps. A per-process cache would pin writers only in the worker that
+    # served the write, the next read on another worker could miss it on a lagging replica.
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DATABASE_REPLICAS and backend.rsplit('.', 1)[-1] in PROCESS_CACHES:
+        return [checks.Error(
+            f'DATABASE_REPLICA_HOSTS is set but the default cache ({backend}) is not shared between processes.',
+            hint='Set CACHE_BACKEND and CACHE_LOCATION to a Redis or Memcached cache.',
+            id='main.E001',
+        )]
+    return []
+
+
+def get_replica_lag(alias):
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+            'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+        )
+        return cursor.fetchone()[0]
+
+
+def is_replica_usable(alias):
+    # Checked at most every REPLICA_LAG_CHECK_INTERVAL seconds per process
+    now = time.monotonic()
+    with lag_checks_lock:
+        checked = lag_checks.get(alias)
+    if checked and now - checked[0] < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return checked[1]
+    try:
+        usable = get_replica_lag(alias) <= settings.REPLICA_MAX_LAG
+    except DatabaseError:
+        logger.warning('Replica %s is unreachable', alias, exc_info=True)
+        usable = False
+    with lag_checks_lock:
+        lag_checks[alias] = (now, usable)
+    return usable
+
+
+def choose_replica():
+    # A random replica that is not lagging behind, or the primary when none is usable
+    replicas = [alias for alias in settings.DATABASE_REPLICAS if is_replica_usable(alias)]
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    # Writes, and reads outside of read_from_replica(), go to the primary. Reads inside it go
+    # to the database it chose.
+    def db_for_read(self, model, **hints):
+        return replica_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,98 @@
+import os
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from prometheus_client import (REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+                               values)
+
+# With PROMETHEUS_MULTIPROC_DIR set (see main.settings) every worker writes its values to
+# files in that directory and /metrics adds them up, whichever worker answers the scrape.
+
+
+def get_process_id(pid=None):
+    # Files are named after the command too, so `serve` can tell its own from the job worker's
+    return f'{settings.PROCESS_COMMAND or "manage"}-{pid or os.getpid()}'
+
+
+if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+    # Before any metric is created, they take the value class when they are
+    values.ValueClass = values.MultiProcessValue(get_process_id)
+
+
+REQUEST_LATENCY = Histogram(
+    'trello_request_duration_seconds', 'Time to respond, by URL name',
+    ['url_name', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_QUERIES = Histogram(
+    'trello_request_queries', 'Database queries per request, by URL name',
+    ['url_name'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+REQUEST_SERIALIZATION = Histogram(
+    'trello_request_serialization_seconds', 'Time spent in DRF serializers (Serializer.data), by URL name',
+    ['url_name'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+DB_CONNECTION_ACQUIRE = Histogram(
+    'trello_db_connection_acquire_seconds', 'Time to open a database connection or take one from the pool',
+    ['alias'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+CACHE_REQUESTS = Counter(
+    'trello_cache_requests_total', 'Cache lookups, by cache and result (hit or miss)',
+    ['cache', 'result'],
+)
+IMAGE_PROCESSING = Histogram(
+    'trello_image_processing_seconds', 'Time spent resizing and encoding board backgrounds',
+    ['operation'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+EMAILS_SENT = Counter('trello_emails_sent_total', 'Emails handed to the mail server')
+LAST_SEEN_PENDING = Gauge(
+    'trello_last_seen_pending', 'Board reads waiting to be written by boards.last_seen',
+    multiprocess_mode='livesum',
+)
+
+
+def observe_request(request, response, duration, queries, serialize):
+    url_name = request.resolver_match.url_name or 'unnamed'
+    REQUEST_LATENCY.labels(url_name, request.method, response.status_code).observe(duration)
+    REQUEST_QUERIES.labels(url_name).observe(queries)
+    REQUEST_SERIALIZATION.labels(url_name).observe(serialize)
+
+
+def record_cache_lookup(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def get_registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics():
+    return generate_latest(get_registry())
+
+
+class MeteredEmailBackend(BaseEmailBackend):
+    # Counts the messages sent through EMAIL_DELIVERY_BACKEND, which does the actual sending
+    def __init__(self, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.backend = get_connection(settings.EMAIL_DELIVERY_BACKEND, fail_silently=fail_silently, **kwargs)
+
+    def open(self):
+        return self.backend.open()
+
+    def close(self):
+        return self.backend.close()
+
+    def send_messages(self, email_messages):
+        sent = self.backend.send_messages(email_messages)
+        EMAILS_SENT.inc(sent or 0)
+        return sent
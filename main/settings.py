@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 import os
+import sys
+import tempfile
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,6 +46,8 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    # Before staticfiles, so runserver serves static files through WhiteNoise as well
+    'whitenoise.runserver_nostatic',
     'django.contrib.staticfiles',
     'social_django',
     'boards',
@@ -60,7 +64,9 @@ CSRF_COOKIE_DOMAIN = config('CSRF_COOKIE_DOMAIN')
 
 
 MIDDLEWARE = [
+    'main.timing.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -96,7 +102,8 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'boards.api.pagination.IdCursorPagination',
+    'PAGE_SIZE': config('API_PAGE_SIZE', default=50, cast=int),
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
@@ -109,6 +116,80 @@ REST_FRAMEWORK = {
     ]
 }
 
+# Upper bound for the ?page_size= query parameter of the list endpoints
+API_MAX_PAGE_SIZE = config('API_MAX_PAGE_SIZE', default=200, cast=int)
+# Most operations accepted by one /api/card/batch/ request
+CARD_BATCH_MAX_OPERATIONS = config('CARD_BATCH_MAX_OPERATIONS', default=200, cast=int)
+# Column and card rank keys (boards.ranks) longer than this get the whole column or board respread
+RANK_MAX_LENGTH = config('RANK_MAX_LENGTH', default=16, cast=int)
+
+# Server-sent board events (boards.asgi). With BOARD_EVENTS_NOTIFY events are fanned out
+# through Postgres LISTEN/NOTIFY, so every worker process sees every change. `serve --asgi` does
+# not start more than one worker without it.
+BOARD_EVENTS_NOTIFY = config('BOARD_EVENTS_NOTIFY', default=False, cast=bool)
+BOARD_EVENTS_HEARTBEAT = config('BOARD_EVENTS_HEARTBEAT', default=15, cast=int)
+BOARD_EVENTS_RETRY = config('BOARD_EVENTS_RETRY', default=3000, cast=int)
+# Events waiting to be sent to one client, a slower client is disconnected and reconnects
+BOARD_EVENTS_QUEUE_SIZE = config('BOARD_EVENTS_QUEUE_SIZE', default=100, cast=int)
+
+# Board reads are buffered by boards.last_seen and flushed in bulk
+LAST_SEEN_FLUSH_INTERVAL = config('LAST_SEEN_FLUSH_INTERVAL', default=30, cast=int)
+LAST_SEEN_MAX_PENDING = config('LAST_SEEN_MAX_PENDING', default=1000, cast=int)
+
+# Lifetime of the serialized board trees cached by boards.api.cache.get_board_snapshot
+BOARD_SNAPSHOT_TIMEOUT = config('BOARD_SNAPSHOT_TIMEOUT', default=3600, cast=int)
+
+# Background jobs (boards.jobs), run with `manage.py run_jobs`
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=3, cast=int)
+JOB_LEASE = config('JOB_LEASE', default=300, cast=int)
+# Seconds done jobs are kept before run_jobs deletes them
+JOB_KEEP_DONE = config('JOB_KEEP_DONE', default=86400, cast=int)
+
+# Board backgrounds are resized to these widths (and kept at full size) as JPEG and WebP
+BOARD_BACKGROUND_WIDTHS = [320, 768, 1280, 1920]
+BOARD_BACKGROUND_QUALITY = 70
+# Largest variant kept, and uploads above this many pixels are rejected
+BOARD_BACKGROUND_MAX_WIDTH = 2560
+BOARD_BACKGROUND_MAX_PIXELS = 40_000_000
+# Variants rendered on request by /api/boards/<pk>/background/ before the worker has run
+BOARD_BACKGROUND_CACHE_DIR = os.path.join(BASE_DIR, 'media/variant_cache/')
+
+# Chunked card attachment uploads (boards.uploads). Chunks are appended to a part file in
+# CHUNKED_UPLOAD_DIR, unfinished uploads are removed by `manage.py clean_uploads` after the expiry.
+CHUNKED_UPLOAD_DIR = config('CHUNKED_UPLOAD_DIR', default=os.path.join(BASE_DIR, 'uploads/'))
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = config('CHUNKED_UPLOAD_MAX_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)
+# Largest file that can be uploaded, its part file is kept until the upload is finalized or expires
+CHUNKED_UPLOAD_MAX_SIZE = config('CHUNKED_UPLOAD_MAX_SIZE', default=1024 * 1024 * 1024, cast=int)
+CHUNKED_UPLOAD_EXPIRY = config('CHUNKED_UPLOAD_EXPIRY', default=24 * 60 * 60, cast=int)
+
+# `manage.py serve` (gunicorn). WEB_CONCURRENCY is the worker count Heroku and most hosts set.
+SERVER_BIND = config('SERVER_BIND', default='0.0.0.0:8000')
+SERVER_WORKERS = config('WEB_CONCURRENCY', default=(os.cpu_count() or 1) * 2 + 1, cast=int)
+SERVER_THREADS = config('SERVER_THREADS', default=1, cast=int)
+SERVER_TIMEOUT = config('SERVER_TIMEOUT', default=30, cast=int)
+SERVER_KEEPALIVE = config('SERVER_KEEPALIVE', default=5, cast=int)
+SERVER_MAX_REQUESTS = config('SERVER_MAX_REQUESTS', default=1000, cast=int)
+
+# main.timing.QueryBudgetMiddleware logs requests over either budget (queries, milliseconds)
+# and keeps this many recent requests per view for /stats/endpoints/
+REQUEST_QUERY_BUDGET = config('REQUEST_QUERY_BUDGET', default=50, cast=int)
+REQUEST_TIME_BUDGET = config('REQUEST_TIME_BUDGET', default=500, cast=int)
+ENDPOINT_STATS_SAMPLES = config('ENDPOINT_STATS_SAMPLES', default=1000, cast=int)
+
+# Management command this process runs (serve, run_jobs, ...), empty for anything else
+PROCESS_COMMAND = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith('-') else ''
+
+# Prometheus metrics at /metrics (main.metrics). The server workers and the job worker share their
+# values through files in METRICS_DIR, named after the command, `manage.py serve` removes the files
+# of the previous server when it starts. Scrapers send METRICS_TOKEN as a bearer token, without one
+# set only staff users can read the metrics.
+METRICS_DIR = config('METRICS_DIR', default=os.path.join(tempfile.gettempdir(), 'trello-metrics')
+                     if PROCESS_COMMAND in ('serve', 'run_jobs') else '')
+if METRICS_DIR:
+    # Read when prometheus_client is imported
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', METRICS_DIR)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'api_key': {
@@ -121,6 +202,7 @@ SWAGGER_SETTINGS = {
 
 
 WSGI_APPLICATION = 'main.wsgi.application'
+ASGI_APPLICATION = 'main.asgi.application'
 
 # LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = "dashboard"
@@ -130,14 +212,46 @@ LOGOUT_REDIRECT_URL = "dashboard"
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
 
+# main.db.postgresql is the stock backend plus an optional per-process pool (DB_POOL_SIZE > 0,
+# CONN_MAX_AGE is then 0 so every request checks its connection back in) and connect timing.
+# Without the pool connections are kept for DB_CONN_MAX_AGE seconds and checked before reuse.
+DB_POOL_SIZE = config('DB_POOL_SIZE', default=0, cast=int)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'main.db.postgresql',
         'NAME': config('NAME'),
         'USER': config('USER_NAME'),
         'PASSWORD': config('PASSWORD'),
         'HOST': config('HOST'),
         'PORT': config('PORT'),
+        'CONN_MAX_AGE': 0 if DB_POOL_SIZE else config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL_SIZE': DB_POOL_SIZE,
+        'POOL_TIMEOUT': config('DB_POOL_TIMEOUT', default=10, cast=int),
+    }
+}
+
+# Read replicas, one database alias per host in DATABASE_REPLICA_HOSTS. main.db.router sends
+# safe requests of the boards API there, users who wrote in the last REPLICA_PIN_SECONDS and
+# replicas more than REPLICA_MAX_LAG seconds behind use the primary. Tests mirror them to the
+# default database, so DATABASE_REPLICA_HOSTS=localhost gives a local two-database setup.
+DATABASE_REPLICAS = []
+for index, host in enumerate(config('DATABASE_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{index}')
+DATABASE_ROUTERS = ['main.db.router.ReplicaRouter']
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=2, cast=float)
+REPLICA_LAG_CHECK_INTERVAL = config('REPLICA_LAG_CHECK_INTERVAL', default=5, cast=int)
+
+# The default cache is per process unless CACHE_BACKEND says otherwise. With several workers it has
+# to be shared (e.g. django.core.cache.backends.redis.RedisCache, CACHE_LOCATION=redis://host:6379/0),
+# the replica pins above live there and a system check refuses to start with replicas and no shared cache.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
     }
 }
 
@@ -179,17 +293,31 @@ STATIC_URL = 'static/'
 MEDIA_URL = 'media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+
+# Protected media (boards.media) can hand the transfer to the front server: 'x-accel-redirect'
+# for nginx, with an internal location at MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT,
+# or 'x-sendfile' for Apache/lighttpd. Otherwise the WSGI server's file_wrapper sends the file, under
+# ASGI the worker reads it on the event loop, so ASGI deployments should set it (see docker-compose.yml).
+MEDIA_SENDFILE = config('MEDIA_SENDFILE', default='')
+MEDIA_ACCEL_REDIRECT_PREFIX = config('MEDIA_ACCEL_REDIRECT_PREFIX', default='/protected-media/')
 # STATICFILES_DIRS = (
 #     os.path.join(BASE_DIR, 'static/'),
 # )
 STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
+# collectstatic writes content-hashed copies with .gz and .br (Brotli) versions next to them,
+# WhiteNoise serves the hashed names with a far-future immutable Cache-Control.
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Assets missing from the manifest fall back to their plain name instead of failing the page
+WHITENOISE_MANIFEST_STRICT = False
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-EMAIL_BACKEND = config('EMAIL_BACKEND')
+# Sending goes through EMAIL_BACKEND from the environment, wrapped to count the messages for /metrics
+EMAIL_BACKEND = 'main.metrics.MeteredEmailBackend'
+EMAIL_DELIVERY_BACKEND = config('EMAIL_BACKEND')
 EMAIL_USE_TLS = config('EMAIL_USE_TLS')
 EMAIL_HOST = config('EMAIL_HOST')
 EMAIL_PORT = config('EMAIL_PORT')
@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+
+from main.metrics import observe_request
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('total', 'db', 'serialize', 'render', 'queries', 'size')
+
+# The RequestTiming of the request being answered, for the serializers
+current_timing = ContextVar('current_timing', default=None)
+base_serializer_data = BaseSerializer.data
+
+
+def get_view_name(request, view_func):
+    view_class = getattr(view_func, 'view_class', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    return f'{view_class.__name__}.{request.method.lower()}'
+
+
+def percentile(ordered, fraction):
+    # Nearest rank on an already sorted list
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class RequestTiming:
+    # Installed with connection.execute_wrapper() on every database for one request
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view = None
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.serializing = False
+        self.render = 0.0
+        self.render_start = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    def start_render(self):
+        self.render_start = time.perf_counter()
+
+    def end_render(self, response):
+        self.render = time.perf_counter() - self.render_start
+
+    def get_server_timing(self, total):
+        return (f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+                f'serialize;dur={self.serialize * 1000:.1f}, render;dur={self.render * 1000:.1f}, '
+                f'total;dur={total * 1000:.1f}')
+
+
+def timed_serializer_data(serializer):
+    # Serializer.data, timed once per top level serializer. Nested ones go through to_representation
+    # and serializers read inside another one (e.g. a SerializerMethodField) are part of its time.
+    # Queries made by lazy querysets count in both db and serialize.
+    timing = current_timing.get()
+    if timing is None or timing.serializing:
+        return base_serializer_data.fget(serializer)
+    timing.serializing = True
+    start = time.perf_counter()
+    try:
+        return base_serializer_data.fget(serializer)
+    finally:
+        timing.serialize += time.perf_counter() - start
+        timing.serializing = False
+
+
+def time_serializers():
+    # Serializer.data and ListSerializer.data both end in BaseSerializer.data
+    BaseSerializer.data = property(timed_serializer_data)
+
+
+class EndpointStats:
+    # The latest ENDPOINT_STATS_SAMPLES requests of every view in this process
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=settings.ENDPOINT_STATS_SAMPLES))
+        self.counts = defaultdict(int)
+
+    def record(self, view, **sample):
+        with self.lock:
+            self.samples[view].append(sample)
+            self.counts[view] += 1
+
+    def snapshot(self):
+        with self.lock:
+            samples = {view: list(rows) for view, rows in self.samples.items()}
+            counts = dict(self.counts)
+        stats = {}
+        for view, rows in samples.items():
+            stats[view] = {'count': counts[view]}
+            for metric in METRICS:
+                values = sorted(row[metric] for row in rows if row[metric] is not None)
+                if values:
+                    stats[view][metric] = {
+                        'p50': percentile(values, 0.5),
+                        'p95': percentile(values, 0.95),
+                        'p99': percentile(values, 0.99),
+                        'max': values[-1],
+                    }
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+class QueryBudgetMiddleware:
+    # Times every request that reaches a view: database queries, DRF serializers, rendering of
+    # template and DRF responses, the total and the response size. The timings are sent back in a
+    # Server-Timing header, kept in endpoint_stats and main.metrics, and requests over the
+    # budget are logged.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing = request.timing = RequestTiming()
+        token = current_timing.set(timing)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timing))
+                response = self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        if timing.view is None:
+            return response
+        total = time.perf_counter() - timing.start
+        response['Server-Timing'] = timing.get_server_timing(total)
+        if response.streaming:
+            size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+        else:
+            size = len(response.content)
+        endpoint_stats.record(timing.view, total=total * 1000, db=timing.db * 1000,
+                              serialize=timing.serialize * 1000, render=timing.render * 1000,
+                              queries=timing.queries, size=size)
+        observe_request(request, response, total, timing.queries, timing.serialize)
+        if timing.queries > settings.REQUEST_QUERY_BUDGET or total * 1000 > settings.REQUEST_TIME_BUDGET:
+            logger.warning('%s %s (%s) took %.1f ms with %d queries (%.1f ms in the database)',
+                           request.method, request.path, timing.view, total * 1000, timing.queries, timing.db * 1000)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.timing.view = get_view_name(request, view_func)
+
+    def process_template_response(self, request, response):
+        # The last hook before the response is rendered
+        request.timing.start_render()
+        response.add_post_render_callback(request.timing.end_render)
+        return response
@@ -13,8 +13,6 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
@@ -22,6 +20,7 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from boards.api import views
+from main.views import EndpointStatsView, MetricsView, ReadinessView
 
 
 schema_view = get_schema_view(
@@ -40,6 +39,9 @@ schema_view = get_schema_view(
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('ready/', ReadinessView.as_view(), name='ready'),
+    path('stats/endpoints/', EndpointStatsView.as_view(), name='endpoint_stats'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('', include('accounts.urls')),
@@ -48,6 +50,7 @@ urlpatterns = [
     path('api/boards/', include('boards.api.urls')),
     path('api/card/', views.CardListCreateAPIView.as_view(), name='card_api'),
     path('api/card/<int:pk>/', views.CardDetailDeleteUpdate.as_view(), name='card_api_detail'),
+    path('api/card/batch/', views.CardBatchAPIView.as_view(), name='card_api_batch'),
     path('api/members/', views.MembersListAPIView.as_view(), name='member_api'),
     path('api/members/<int:pk>/', views.MembersDetailUpdateDeleteAPIView.as_view(), name='member_api_detail'),
     path('api/column/', views.ColumnListCreateAPIView.as_view(), name='column_api'),
@@ -58,11 +61,18 @@ urlpatterns = [
     path('api/archive/<int:pk>', views.ArchiveDetailUpdateDeleteView.as_view(), name='archive_api_detail'),
     path('api/file/', views.FileListCreateAPIView.as_view(), name='file_api'),
     path('api/file/<int:pk>/', views.FileDetailDeleteAPIView.as_view(), name='file_api_detail'),
+    path('api/file/<int:pk>/download/', views.FileDownloadAPIView.as_view(), name='file_api_download'),
+    path('api/file/upload/', views.FileUploadCreateAPIView.as_view(), name='file_upload_api'),
+    path('api/file/upload/<int:pk>/', views.FileUploadAPIView.as_view(), name='file_upload_api_detail'),
+    path('api/file/upload/<int:pk>/complete/', views.FileUploadCompleteAPIView.as_view(),
+         name='file_upload_api_complete'),
     path('api/comment/card/<int:card_id>/', views.CommentCreateAPIView.as_view(), name='comment_api'),
     path('api/mark/', views.MarkListAPIView.as_view(), name='mark_api'),
     path('api/mark/<int:pk>/', views.MarkDetailUpdateDeleteAPIView.as_view(), name='mark_api_detail'),
     path('api/favourite/', views.FavouriteListAPIView.as_view(), name='favourite_api'),
-    path('api/favourite/<int:pk>/', views.FavouriteDetailDeleteView.as_view(), name='favourite_api_detail')
+    path('api/favourite/<int:pk>/', views.FavouriteDetailDeleteView.as_view(), name='favourite_api_detail'),
+    path('api/last_seen/', views.LastSeenListAPIView.as_view(), name='last_seen_api'),
 
-    ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
+    ]
+# Static files are served by WhiteNoise. Media is not served here, attachments and
+# backgrounds go through the views that check board access.
@@ -0,0 +1,41 @@
+from django.db import DatabaseError, connection
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from main.metrics import render_metrics
+from main.timing import endpoint_stats
+
+
+class ReadinessView(View):
+    # Polled by the load balancer, a worker only gets traffic once it can reach the database
+    def get(self, request):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError:
+            return JsonResponse({'status': 'unavailable'}, status=503)
+        return JsonResponse({'status': 'ready'})
+
+
+class EndpointStatsView(View):
+    # Percentiles of the recent requests of each view, for this worker process only
+    def get(self, request):
+        if not request.user.is_staff:
+            return JsonResponse({'detail': 'Forbidden'}, status=403)
+        return JsonResponse(endpoint_stats.snapshot())
+
+
+class MetricsView(View):
+    # Scraped by Prometheus with METRICS_TOKEN, values of all worker processes. Without a token
+    # configured only staff can see them.
+    def get(self, request):
+        if settings.METRICS_TOKEN:
+            allowed = request.headers.get('Authorization') == f'Bearer {settings.METRICS_TOKEN}'
+        else:
+            allowed = request.user.is_staff
+        if not allowed:
+            return HttpResponse(status=403)
+        return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)